@@ -1,54 +1,61 @@
 import uuid
 import os
-import boto3
 import base64
 from argon2 import PasswordHasher
+from envelope_encryption import EnvelopeCipher, KMSKeyProvider, LocalKeyProvider, is_envelope
 
 KEY_ID = '952ac3d9-9dc4-4322-8127-834c8a4fb54e'
+KMS_REGION = 'ap-southeast-1'
+LOCAL_MASTER_KEY_FILE = r"cache/local_master.key"  # Only used when ENVELOPE_KEY_PROVIDER=local
 AUTH_SIZE = 32
 
 ph = PasswordHasher()
 
 """ AES Encryption and Decryption using AWS KMS"""
-def AWS_encrypt(plaintext):
-    """ Encrypts plaintext and returns cipertext using AWS KMS"""
+_envelope_cipher = None
 
-    session = boto3.session.Session(
-        aws_access_key_id=os.environ.get('ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('SECRET_ACCESS_KEY'),
-        region_name='ap-southeast-1'
-    )
 
-    client = session.client(
-        service_name='kms'
-    )
+def _get_envelope_cipher() -> EnvelopeCipher:
+    """ Returns envelope cipher (created on first use, data keys are cached inside) """
+    global _envelope_cipher
+    if _envelope_cipher is None:
+        # Local key file can stand in for KMS when testing (ENVELOPE_KEY_PROVIDER=local)
+        if os.environ.get("ENVELOPE_KEY_PROVIDER") == "local":
+            provider = LocalKeyProvider(os.environ.get("LOCAL_MASTER_KEY_FILE", LOCAL_MASTER_KEY_FILE))
+        else:
+            provider = KMSKeyProvider(KEY_ID, region_name=KMS_REGION)
+        _envelope_cipher = EnvelopeCipher(provider)
+    return _envelope_cipher
 
-    # Encrypt
-    encryption_result = client.encrypt(
-        KeyId=KEY_ID,
-        Plaintext=plaintext.encode("utf-8")
-    )
 
-    ciphertext_blob = encryption_result['CiphertextBlob']
-    return base64.b64encode(ciphertext_blob)
+def AWS_encrypt(plaintext):
+    """ Encrypts plaintext and returns cipertext using a data key from AWS KMS """
+    return _get_envelope_cipher().encrypt(plaintext)
 
 
 def AWS_decrypt(ciphertext_blob):
-    """ Decrypts ciphertext and returns plaintext using AWS KMS """
+    """ Decrypts ciphertext and returns plaintext using a data key from AWS KMS """
+    cipher = _get_envelope_cipher()
+    if is_envelope(ciphertext_blob):
+        return cipher.decrypt(ciphertext_blob)
+
+    # Values encrypted directly by KMS (before envelope encryption was used) are stored base64 encoded
+    if not isinstance(cipher.provider, KMSKeyProvider):
+        raise ValueError("Invalid ciphertext")
+    decryption_result = cipher.provider.client.decrypt(CiphertextBlob=base64.b64decode(ciphertext_blob, validate=True))
+    return decryption_result['Plaintext'].decode("utf-8")
 
-    session = boto3.session.Session(
-        aws_access_key_id=os.environ.get('ACCESS_KEY_ID'),
-        aws_secret_access_key=os.environ.get('SECRET_ACCESS_KEY'),
-        region_name='ap-southeast-1'
-    )
 
-    client = session.client(
-        service_name='kms'
-    )
+def AWS_encrypt_many(plaintexts):
+    """ Encrypts a list of plaintexts (one data key for the whole batch) """
+    return _get_envelope_cipher().encrypt_many(plaintexts)
 
-    # Decrypt
-    decryption_result = client.decrypt(CiphertextBlob=ciphertext_blob)
-    return decryption_result['Plaintext'].decode("utf-8")
+
+def AWS_decrypt_many(ciphertexts):
+    """ Decrypts a list of ciphertexts (each data key is unwrapped once, KMS ciphertexts one by one) """
+    ciphertexts = list(ciphertexts)
+    envelopes = iter(_get_envelope_cipher().decrypt_many(filter(is_envelope, ciphertexts)))
+    return [next(envelopes) if is_envelope(ciphertext) else AWS_decrypt(ciphertext) for ciphertext in ciphertexts]
 
 
 """ UUID v5 for user id"""
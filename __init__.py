@@ -1,9 +1,11 @@
 from flask import (
     Flask, render_template, request, redirect, url_for, flash,
-    make_response, g as flask_global, abort, jsonify, session  # TODO: session to be removed
+    make_response, g as flask_global, abort, jsonify, session,  # TODO: session to be removed
+    Response, Blueprint, current_app
 )
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+import limiter_storage  # Registers sqlite:// storage for Flask-Limiter
 from werkzeug.utils import secure_filename
 from SecurityFunctions import generate_uuid4, generate_uuid5, pw_hash, pw_verify, pw_rehash
 from db_fetch.customer import create_lockout_time, delete_failed_logins
@@ -13,29 +15,44 @@ from models import User, Book, Review, Order, UPLOAD_FOLDER as _PROFILE_PIC_PATH
     BOOK_IMG_UPLOAD_FOLDER as _BOOK_IMG_PATH
 import db_fetch as dbf
 import os  # For saving and deleting images
-from PIL import Image
-from math import ceil
 from itsdangerous import URLSafeTimedSerializer, BadData
-from encrypt import aws_encrypt, aws_decrypt
+from encrypt import aws_encrypt, aws_decrypt, aws_decrypt_many
 from OTP import generateOTP
-from google_authenticator import gmail_send
+from google_authenticator import gmail_send_async
+from event_loop import async_to_sync
 from csp import get_csp
-from api_schema import LOGIN_SCHEMA, CREATE_USER_SCHEMA
-from flask_expects_json import expects_json
-import jsonschema
+from cache_handler import MemoryCache, FragmentCacheExtension, PageCache, TemplateBytecodeCache, precompile_templates
+from metrics import REGISTRY, HTTP_REQUESTS, HTTP_REQUEST_SECONDS, RATE_LIMITED, IMAGE_PROCESSING_SECONDS
+from profiling import SamplingProfiler
+import payments
+import inventory
+from api_schema import LOGIN_SCHEMA, CREATE_USER_SCHEMA, CART_SCHEMA
 from functools import wraps
 from flask_wtf.csrf import CSRFProtect, CSRFError
 from urllib.parse import unquote
 from typing import Union
-import pyotp
+from base64 import urlsafe_b64encode, b64decode
+import binascii
+import json
+import asyncio
+import csv
+import io
+import sys
 import datetime
+from hmac import compare_digest
+from time import perf_counter
+import time
+import random
+import gc
 
 from forms import (
     SignUpForm, LoginForm, ChangePasswordForm, ResetPasswordForm, ForgetPasswordForm,
-    AccountPageForm, CreateUserForm, DeleteUserForm, AddBookForm, OrderForm, OTPForm, CreateReviewText, BackUpCodeForm
+    AccountPageForm, CreateUserForm, DeleteUserForm, AddBookForm, OrderForm, OTPForm, CreateReviewText, BackUpCodeForm,
+    lang_list, category_list
 )
 
-import stripe
+# Slow to import and only needed by a few routes, so these are imported where used:
+# stripe (checkout), PIL (book covers), pyotp (2FA), jsonschema (json apis) and httpx (emails)
 
 # CONSTANTS
 # TODO @everyone: set to False when deploying
@@ -45,34 +62,193 @@ ACCOUNTS_PER_PAGE = 10  # Number of accounts to display per page (manage account
 DOMAIN_NAME = "https://localhost:5000/"
 ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png"}
 DISALLOWED_CHARA_DICT = str.maketrans("", "", r"<>{}")
+FRAGMENT_CACHE_SIZE = 512  # Max number of rendered template fragments kept per worker
+PAGE_CACHE_SIZE = 256  # Max number of anonymous pages kept per worker
+PAGE_CACHE_TTL = 300  # Max age of cached anonymous pages (5 mins)
+WARMUP_PATHS = ("/", "/books/latest", "/books/name_a_to_z", "/books/name_z_to_a",
+                "/books/price_low_to_high", "/books/price_high_to_low")  # Anonymous pages cached before fork
+API_USERS_PAGE_SIZE = 50  # Default number of users per page of /api/admin/users
+API_USERS_MAX_PAGE_SIZE = 500  # Max number of users per page of /api/admin/users
+API_USER_FIELDS = ("user_id", "username", "email", "profile_pic", "role", "name")  # Fields that can be requested
+DECRYPT_BATCH_SIZE = 100  # Number of emails decrypted at a time when streaming
+RATELIMIT_STORAGE_URI = "sqlite:///cache/ratelimit.db?stripes=4"  # Rate limit counters shared by all workers
+ANALYTICS_DAYS = 30  # Number of days of sales shown on dashboards
+ANALYTICS_MAX_DAYS = 366  # Max number of days of sales from /api/admin/analytics
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}  # Export file formats and mimetypes
+EXPORT_CHUNK_SIZE = 1000  # Number of rows fetched at a time when exporting
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")  # Spreadsheets run cells starting with these as formulas
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # Bearer token of metrics scrapers (admins can always view)
 
-app = Flask(__name__)
-csrf = CSRFProtect(app)
-app.config.from_pyfile("config/app.cfg")  # Load config file
-app.jinja_env.add_extension("jinja2.ext.do")  # Add do extension to jinja environment
 BOOK_UPLOAD_FOLDER = _BOOK_IMG_PATH[1:]  # Book image upload folder
 PROFILE_PIC_UPLOAD_FOLDER = _PROFILE_PIC_PATH[1:]  # Profile pic upload folder
-app.config['RECAPTCHA_PUBLIC_KEY'] = '6Ld_DnUhAAAAAGcuOtjXHX-peLN2QURPU8nhtT2d'
-app.config['RECAPTCHA_PRIVATE_KEY'] = '6Ld_DnUhAAAAAKHGn71fzgPvdcvvoqRLDF812aKr'
+
+# Extensions (bound to the app by create_app)
+csrf = CSRFProtect()
 limiter = Limiter(
-    app,
     key_func=get_remote_address,
-    default_limits=["30 per second"]
+    default_limits=["30 per second"],
+    storage_uri=RATELIMIT_STORAGE_URI
 )
+page_cache = PageCache(user_cookie=USER_SESSION_NAME, max_size=PAGE_CACHE_SIZE, enabled=not DEBUG)
+profiler = SamplingProfiler()  # Only samples requests selected by PROFILE_ENDPOINTS or PROFILE_SAMPLE_RATE
+payment_worker = payments.PaymentWorker()  # Processes Stripe webhook events
+hold_sweeper = inventory.HoldSweeper()  # Deletes expired stock holds
+
+# Blueprints (routes keep their full paths, endpoints are prefixed with the blueprint name)
+main_bp = Blueprint("main", __name__)  # Home, catalogue, cart and checkout
+user_bp = Blueprint("user", __name__)  # Sign up, login and account pages
+admin_bp = Blueprint("admin", __name__)  # Admin and staff pages
+api_bp = Blueprint("api", __name__)  # JSON api
+monitoring_bp = Blueprint("monitoring", __name__)  # Metrics, profiles and debug routes
+
 
-url_serialiser = URLSafeTimedSerializer(app.config["SECRET_KEY"])
+def resize_cover(path: str, operation: str) -> None:
+    """ Resizes book cover saved at path (PIL is imported on first use) """
+    from PIL import Image
+    with IMAGE_PROCESSING_SECONDS.time(operation=operation):
+        image = Image.open(path)
+        resized_image = image.resize((259, 371))
+        resized_image.save(path)
 
-# testing mode
-app.config['STRIPE_PUBLIC_KEY'] = 'pk_test_51LNFSvLeIrXIJDLVMtA0cZuNhFl3fFrgE6fjUAgSEzhs9SHLF5alwOVK8Cu1XZcF7NF9GBEinYI9nY8WuRw7c7ee00qzmDKaVq'
-app.config['STRIPE_SECRET_KEY'] = 'sk_test_51LNFSvLeIrXIJDLVEVQ8XVgIIhIWcKy0d7WVM5mM7TIBTxNLNMFUcN5Gx3zcmTKHyxJkrxiB98qZzdt5qYYrPM55002ARsY3yC'
 
-stripe.api_key = app.config['STRIPE_SECRET_KEY']
+def expects_json(schema: dict, ignore_for: list[str]=None):
+    """ Same as flask_expects_json.expects_json, but jsonschema is only imported on first request """
+
+    def decorator(func):
+        validated = None
+
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            nonlocal validated
+            if validated is None:
+                from flask_expects_json import expects_json as _expects_json
+                validated = _expects_json(schema, ignore_for=ignore_for)(func)
+            return validated(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def get_url_serialiser() -> URLSafeTimedSerializer:
+    """ Returns serialiser of password reset tokens (signed with the app's secret key) """
+    return URLSafeTimedSerializer(current_app.config["SECRET_KEY"])
+
 
 def allowed_file(filename):
     # Return true if there is an extension in file, and its extension is in the allowed extensions
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def encode_cursor(user_id: str) -> str:
+    """ Returns opaque pagination cursor pointing after user_id """
+    return urlsafe_b64encode(user_id.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    """ Returns user_id from pagination cursor (empty string for first page) """
+    try:
+        return b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def get_accounts_page(retrieve_page, count) -> dict:
+    """
+    Returns template variables for a page of accounts (manage users/staff pages)
+    Pages are selected by cursors in the query string (after, before or last) and filtered by username (q)
+    """
+    search = request.args.get("q", default="", type=str).strip()
+    try:
+        after = request.args.get("after", type=decode_cursor)
+        before = request.args.get("before", type=decode_cursor)
+    except ValueError:
+        after = before = None
+    last = "last" in request.args
+
+    page = retrieve_page(ACCOUNTS_PER_PAGE, after=after, before=before, last=last, search=search)
+
+    # Went past the last page (e.g. after deleting its users), show last page instead
+    if not page.rows and (after is not None or before is not None):
+        page = retrieve_page(ACCOUNTS_PER_PAGE, last=True, search=search)
+
+    display_users = [User(*data) for data in page.rows]
+
+    # Decrypt emails of page in one batch
+    for user, email in zip(display_users, aws_decrypt_many(user.email for user in display_users)):
+        user.email = email
+
+    # Links keep search query
+    query = {"q": search} if search else {}
+    return dict(
+        display_users=display_users,
+        search=search,
+        first_link=query,
+        prev_link=dict(query, before=encode_cursor(page.first_key)) if page.has_prev else None,
+        next_link=dict(query, after=encode_cursor(page.last_key)) if page.has_next else None,
+        last_link=dict(query, last=1),
+        total_entries=count(search)
+    )
+
+
+def stream_users_json(users_data: list[tuple], columns: tuple, fields: list[str]):
+    """ Yields users as a json array, decrypting emails in batches as it goes """
+    email_index = columns.index("email") if "email" in fields else None
+
+    yield "["
+    for start in range(0, len(users_data), DECRYPT_BATCH_SIZE):
+        batch = users_data[start:start + DECRYPT_BATCH_SIZE]
+
+        # Only decrypt when email is requested
+        emails = None
+        if email_index is not None:
+            emails = aws_decrypt_many(row[email_index] for row in batch)
+
+        for i, row in enumerate(batch):
+            user = dict(zip(columns, row))
+            if emails is not None:
+                user["email"] = emails[i]
+            separator = "," if start or i else ""
+            yield separator + json.dumps({field: user[field] for field in fields})
+    yield "]"
+
+
+def csv_safe(value):
+    """ Returns cell value that spreadsheets will not run as a formula (text starting with CSV_FORMULA_PREFIXES is quoted) """
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_export(chunks, file_format: str):
+    """ Yields csv or ndjson text chunk by chunk (first chunk from dbf.stream_db is the column names) """
+    chunks = iter(chunks)
+    columns = next(chunks)
+
+    if file_format == "ndjson":
+        for rows in chunks:
+            yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+        return
+
+    # Reuse one buffer for every chunk
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        # User-controlled text (usernames, addresses, titles) must not become formulas
+        writer.writerows([csv_safe(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_response(chunks, name: str, file_format: str) -> Response:
+    """ Returns a streamed file download of chunks from dbf.stream_db """
+    response = Response(stream_export(chunks, file_format), mimetype=EXPORT_FORMATS[file_format])
+    filename = f"{name}-{datetime.date.today().isoformat()}.{file_format}"
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
 def get_user():
     """ Returns user if cookie is correct, else returns None """
 
@@ -105,9 +281,10 @@ def user_authenticate(username: str, password: str) -> Union[tuple, None]:
     if "@" in username:  # Authenticate by email
         user_emails = dbf.retrieve_user_ids_and_emails()
         user_id = None
-        for i in user_emails:
-            the_email = i[1]  # Email is in index 0 of tuple
-            if aws_decrypt(the_email) == username:
+
+        # Decrypt all emails in one batch (email is in index 1 of tuple)
+        for i, the_email in zip(user_emails, aws_decrypt_many(i[1] for i in user_emails)):
+            if the_email == username:
                 user_id = i[0]
                 break
     else:                # Authenticate by username
@@ -146,7 +323,7 @@ def login_required(func):
     """
     Put this in routes that user must be logged in to access with the @ sign
     For example:
-    @app.route('/user/account")
+    @user_bp.route("/user/account")
     @login_required
     """
 
@@ -156,8 +333,8 @@ def login_required(func):
         Logged in check here
         """
         if isinstance(flask_global.user, User):
-            return func(*args, **kwargs)
-        return redirect(url_for('login'))
+            return current_app.ensure_sync(func)(*args, **kwargs)  # Route may be an async view
+        return redirect(url_for('user.login'))
 
     return decorated_function
 
@@ -166,12 +343,12 @@ def roles_required(roles: list[str], mode="regular"):
     """
     Put this in routes that only allow selected roles with the @ sign
     For example:
-    @app.route('/admin/manage-account")
+    @admin_bp.route("/admin/manage-users")
     @roles_required(["admin"])
 
     You can also add multiple roles for the route
     E.g:
-    @app.route('/admin/inventory')
+    @admin_bp.route("/admin/inventory")
     @roles_required(["admin", "staff"])
     """
 
@@ -190,8 +367,8 @@ def roles_required(roles: list[str], mode="regular"):
                     abort(404)
                 elif mode == "api":
                     return jsonify(message="The resource you requested does not exist."), 404
-            # Execute routes after
-            return func(*args, **kwargs)
+            # Execute routes after (route may be an async view)
+            return current_app.ensure_sync(func)(*args, **kwargs)
         return decorated_function
     return decorator
 
@@ -199,16 +376,29 @@ def roles_required(roles: list[str], mode="regular"):
 """ Before request """
 
 
-@app.before_request
+def start_request_stats():
+    # Registered first, so queries (and time) of cached pages are recorded too
+    flask_global.request_start = perf_counter()
+    flask_global.query_stats = dbf.start_query_stats()
+
+    # Sample stacks of listed endpoints, and a fraction of other requests
+    config = current_app.config
+    if request.endpoint in config["PROFILE_ENDPOINTS"] or random.random() < config["PROFILE_SAMPLE_RATE"]:
+        profiler.start(request.endpoint or "none")
+        flask_global.profiled = True
+
+
 def before_request():
     flask_global.user = get_user()  # Get user
-    csrf.protect()
+
+    # Webhooks are authenticated by their signature instead
+    if request.endpoint != "api.stripe_webhook":
+        csrf.protect()
 
 
 """ After request """
 
 
-@app.after_request
 def after_request(response):
     user: User = flask_global.user
 
@@ -246,19 +436,42 @@ def after_request(response):
     allow_blob = flask_global.get("allow_blob", default=False)
     response.headers["Content-Security-Policy"] = get_csp(blob=allow_blob)
 
+    # Database time and number of queries (shown in browser dev tools), only to admins unless enabled,
+    # as query counts differ between e.g. known and unknown usernames
+    query_stats = flask_global.get("query_stats")
+    show_timing = current_app.debug or current_app.config["SERVER_TIMING"] or (user and user.role == "admin")
+    if query_stats is not None and show_timing:
+        response.headers["Server-Timing"] = query_stats.server_timing()
+
+    # Request metrics (requests not matching any route are grouped, so labels stay bounded)
+    request_start = flask_global.get("request_start")
+    if request_start is not None:
+        endpoint = request.endpoint or "none"
+        HTTP_REQUESTS.inc(method=request.method, endpoint=endpoint, status=response.status_code)
+        HTTP_REQUEST_SECONDS.observe(perf_counter() - request_start, method=request.method, endpoint=endpoint)
+        REGISTRY.flush()
+
     return response
 
 
+def stop_query_stats(exception=None):
+    dbf.stop_query_stats()
+    if flask_global.get("profiled"):
+        profiler.stop()
+        profiler.flush()
+
+
 """    Home Page    """
 
 """ Home page """
 
 
-@app.route("/")
+@main_bp.route("/")
 @limiter.limit("10/second", override_defaults=False)
+@page_cache.cached(ttl=PAGE_CACHE_TTL)
 def home():
     if flask_global.user and flask_global.user.role in ["admin", "staff"]:
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("admin.dashboard"))
 
     english_books_data = dbf.retrieve_books_by_language("English")
     chinese_books_data = dbf.retrieve_books_by_language("Chinese")
@@ -272,12 +485,12 @@ def home():
 """ Sign up page """
 
 
-@app.route("/user/sign-up", methods=["GET", "POST"])
+@user_bp.route("/user/sign-up", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
-def sign_up():
+async def sign_up():
     # If user is already logged in
     if flask_global.user is not None:
-        return redirect(url_for("account"))
+        return redirect(url_for("user.account"))
 
     # Get sign up form
     sign_up_form = SignUpForm(request.form)
@@ -299,12 +512,13 @@ def sign_up():
         # Create new user
 
         # Ensure that email and username are not registered yet
-        if dbf.username_exists(username):
+        # (SQLite is called in a thread, so the event loop keeps serving other requests meanwhile)
+        if await asyncio.to_thread(dbf.username_exists, username):
             errors["DisplayFieldError"] = errors["SignUpUsernameError"] = True
             flash("Username taken", "sign-up-username-error")
             return render_template("user/sign_up.html", form=sign_up_form)
 
-        elif dbf.email_exists(email):
+        elif await asyncio.to_thread(dbf.email_exists, email):
             errors["DisplayFieldError"] = errors["SignUpEmailError"] = True
             flash("Email already registered", "sign-up-email-error")
             return render_template("user/sign_up.html", form=sign_up_form)
@@ -323,24 +537,24 @@ def sign_up():
         minute = datetime.datetime.now().minute
         second = datetime.datetime.now().second
         print(one_time_pass)
-        if dbf.retrieve_otp(user_id):
+        if await asyncio.to_thread(dbf.retrieve_otp, user_id):
             print("deleted")
-            dbf.delete_otp(user_id)
-        dbf.create_otp(user_id, one_time_pass, year, month, day, hour, minute, second)
+            await asyncio.to_thread(dbf.delete_otp, user_id)
+        await asyncio.to_thread(dbf.create_otp, user_id, one_time_pass, year, month, day, hour, minute, second)
         # Send email with OTP
         subject = "OTP for registration"
         message = "Do not reply to this email.\nPlease enter " + one_time_pass + " as your OTP to complete your registration."
 
-        gmail_send(email, subject, message)
+        await gmail_send_async(email, subject, message)
         add_cookie({"Temp_User_ID": user_id, "Temp_User_Email": email, "Temp_User_Password": password, "Temp_User_Username": username})
 
-        return redirect(url_for("otpverification"))
+        return redirect(url_for("user.otpverification"))
 
     # Render sign up page
     return render_template("user/sign_up.html", form=sign_up_form)
 
 
-@app.route("/user/sign-up/otpverification", methods=["GET", "POST"])
+@user_bp.route("/user/sign-up/otpverification", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 def otpverification():
     temp_user_id = get_cookie_value(request, "Temp_User_ID")
@@ -348,12 +562,12 @@ def otpverification():
     email = get_cookie_value(request, "Temp_User_Email")
     password = get_cookie_value(request, "Temp_User_Password")
     if temp_user_id is None:
-        return redirect(url_for("sign_up"))
+        return redirect(url_for("user.sign_up"))
     else:
         pass
     temporary_data = dbf.retrieve_otp(temp_user_id)
     if temporary_data is None:
-        return redirect(url_for("sign_up"))
+        return redirect(url_for("user.sign_up"))
     else:
         pass
     one_time_pass = temporary_data[1]
@@ -369,7 +583,7 @@ def otpverification():
     if time_check.seconds > 300:
         dbf.delete_otp(temp_user_id)
         flash("OTP expired please try again", "OTP-expired")
-        return redirect(url_for("sign_up"))
+        return redirect(url_for("user.sign_up"))
     OTPformat = OTPForm(request.form)
     print(request.method)
     if request.method == "POST":
@@ -384,11 +598,11 @@ def otpverification():
             remove_cookies(["Temp_User_ID", "Temp_User_Email", "Temp_User_Password", "Temp_User_Username"])
 
             # Return redirect with session cookie
-            return redirect(url_for("home"))
+            return redirect(url_for("main.home"))
 
         else:
             flash("Invalid OTP Entered! Please try again!")
-            return redirect(url_for("otpverification"))
+            return redirect(url_for("user.otpverification"))
     else:
         return render_template("user/OTP.html", form=OTPformat)
 
@@ -396,12 +610,12 @@ def otpverification():
 """ Login page """
 
 
-@app.route("/user/login", methods=["GET", "POST"])
+@user_bp.route("/user/login", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 def login():
     # If user is already logged in
     if flask_global.user is not None:
-        return redirect(url_for("account"))
+        return redirect(url_for("user.account"))
 
     login_form = LoginForm(request.form)
 
@@ -409,7 +623,7 @@ def login():
     return render_template("user/login.html", form=login_form)
 
 
-@app.route("/user/login/twoFA", methods=["GET", "POST"])
+@user_bp.route("/user/login/twoFA", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 def twoFA():
     user_id = get_cookie_value(request, "user_id")
@@ -422,9 +636,10 @@ def twoFA():
 
     if not (user_id and user_data and twoFA_code):
         remove_cookies(["user_id", "user_data"])
-        return redirect(url_for("login"))
+        return redirect(url_for("user.login"))
 
     if request.method == "POST":
+        import pyotp
         twoFAinput = OTPformat.otp.data
         twoFAchecker = pyotp.TOTP(twoFA_code[1]).verify(twoFAinput)
         try:
@@ -441,13 +656,13 @@ def twoFA():
                 if next_page and next_page[:len(DOMAIN_NAME)] == DOMAIN_NAME:
                     return redirect(next_page)
                 else:
-                    return redirect(url_for("home"))
+                    return redirect(url_for("main.home"))
             else:
                 flash("Invalid OTP Entered! Please try again!")
                 return redirect(request.full_path)
         except:
             remove_cookies(["user_id", "user_data"])
-            return redirect(url_for("login"))
+            return redirect(url_for("user.login"))
     else:
         return render_template("user/2FA.html", form=OTPformat, twoFA_code=twoFA_code)
 
@@ -455,9 +670,9 @@ def twoFA():
 """ Forgot password page """
 
 
-@app.route("/user/password/forget", methods=["GET", "POST"])
+@user_bp.route("/user/password/forget", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
-def password_forget():
+async def password_forget():
     # Create form
     forget_password_form = ForgetPasswordForm(request.form)
 
@@ -473,25 +688,25 @@ def password_forget():
             # Get email
             email = forget_password_form.email.data.lower()
 
-            if dbf.email_exists(aws_encrypt(email)):
+            if await asyncio.to_thread(dbf.email_exists, aws_encrypt(email)):
                 # Generate token
-                token = url_serialiser.dumps(email, salt=app.config["PASSWORD_FORGET_SALT"])
+                token = get_url_serialiser().dumps(email, salt=current_app.config["PASSWORD_FORGET_SALT"])
 
                 # Send message to email entered
                 subject = "Reset Your Password"
                 message = "Do not reply to this email.\nPlease click on ths link to reset your password." + url_for(
-                    "password_reset", token=token, _external=True)
+                    "user.password_reset", token=token, _external=True)
 
-                gmail_send(email, subject, message)
+                await gmail_send_async(email, subject, message)
 
             flash(f"Verification email sent to {email}")
-            return redirect(url_for("login"))
+            return redirect(url_for("user.login"))
 
     return render_template("user/password/password_forget.html", form=forget_password_form)
 
 #In case maybe google authenticator
 
-@app.route("/user/account/google_authenticator", methods=["GET", "POST"])
+@user_bp.route("/user/account/google_authenticator", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def google_authenticator():
@@ -501,6 +716,7 @@ def google_authenticator():
     if user.role == "admin":
         abort(403)
 
+    import pyotp
     secret_token = get_cookie_value(request, "token")
     if secret_token is None:
         secret_token = pyotp.random_base32()
@@ -513,14 +729,14 @@ def google_authenticator():
             flash("2FA setup Complete")
             dbf.create_2FA_token(user.user_id, secret_token)
             remove_cookies(["token"])
-            return redirect(url_for("backup_codes"))
+            return redirect(url_for("user.backup_codes"))
         else:
             flash("Invalid OTP Entered! Please try again!")
-            return redirect(url_for("google_authenticator"))
+            return redirect(url_for("user.google_authenticator"))
     else:
         return render_template("user/google_authenticator.html", form=OTP_Test, secret_token=secret_token)
 
-@app.route("/user/account/google_authenticator/backup_codes", methods=["GET", "POST"])
+@user_bp.route("/user/account/google_authenticator/backup_codes", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def backup_codes():
@@ -538,7 +754,7 @@ def backup_codes():
     dbf.create_backup_codes(user.user_id, code1, code2, code3, code4, code5, code6)
     return render_template("user/backup_codes.html", code1=code1, code2=code2, code3=code3, code4=code4, code5=code5, code6=code6)
 
-@app.route("/user/login/twoFA/backup_codes", methods=["GET", "POST"])
+@user_bp.route("/user/login/twoFA/backup_codes", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 def backup_codes_login():
     # User is a Class
@@ -568,15 +784,15 @@ def backup_codes_login():
             if bool(dbf.retrieve_failed_login(user.user_id[1])):
                 dbf.delete_failed_logins(user.user_id)
             remove_cookies(["user_id", "user_data"])
-            return redirect(url_for("home"))
+            return redirect(url_for("main.home"))
         else:
             flash("Invalid Backup Codes Entered! Please try again!")
-            return redirect(url_for("backup_codes_login"))
+            return redirect(url_for("user.backup_codes_login"))
             
     return render_template("user/lost_2FA.html", form=back_up_form, code1=code1, code2=code2, code3=code3, code4=code4, code5=code5, code6=code6)
 
 
-@app.route("/user/account/google_authenticator_disable", methods=["GET", "POST"])
+@user_bp.route("/user/account/google_authenticator_disable", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def google_authenticator_disable():
@@ -589,12 +805,12 @@ def google_authenticator_disable():
     dbf.delete_2FA_token(user.user_id)
     dbf.delete_backup_codes(user.user_id)
     flash("2FA has been disabled")
-    return redirect(url_for("account"))
+    return redirect(url_for("user.account"))
 
 """ Reset password page """
 
 
-@app.route("/user/password/reset/<token>", methods=["GET", "POST"])
+@user_bp.route("/user/password/reset/<token>", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 def password_reset(token):
     # Get user
@@ -603,21 +819,21 @@ def password_reset(token):
     user: User = flask_global.user
 
     if isinstance(user, User):
-        return redirect(url_for("account"))
+        return redirect(url_for("user.account"))
 
     # Get email from token
     try:
-        email = url_serialiser.loads(token, salt=app.config["PASSWORD_FORGET_SALT"], max_age=TOKEN_MAX_AGE)
+        email = get_url_serialiser().loads(token, salt=current_app.config["PASSWORD_FORGET_SALT"], max_age=TOKEN_MAX_AGE)
     except BadData:  # Token expired or Bad Signature
         flash("Token expired or invalid")
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
     # Get user
     try:
         user_check = dbf.retrieve_user_id(aws_encrypt(email))
     except:
         flash("Token expired or invalid")
-        return redirect(url_for("home"))
+        return redirect(url_for("main.home"))
 
     # Render form
     reset_password_form = ResetPasswordForm(request.form)
@@ -649,7 +865,7 @@ def password_reset(token):
                 dbf.delete_lockout_time(user_username)
             # Flash message and redirect to account page
             flash("Password has been successfully set")
-            return redirect(url_for("account"))
+            return redirect(url_for("user.account"))
 
     return render_template("user/password/password_reset.html", form=reset_password_form, email=email)
 
@@ -657,7 +873,7 @@ def password_reset(token):
 """ Change password page """
 
 
-@app.route("/user/password/change", methods=["GET", "POST"])
+@user_bp.route("/user/password/change", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def password_change():
@@ -707,7 +923,7 @@ def password_change():
 
                 # Flash success message and redirect
                 flash("Password has been changed successfully, please login again with your new password.")
-                return redirect(url_for("login"))
+                return redirect(url_for("user.login"))
 
     return render_template("user/password/password_change.html", form=change_password_form)
 
@@ -715,7 +931,7 @@ def password_change():
 """ View account page """
 
 
-@app.route("/user/account", methods=["GET", "POST"])
+@user_bp.route("/user/account", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def account():
@@ -724,7 +940,7 @@ def account():
 
     # If user is not logged in
     if not user:
-        return redirect(url_for("login"))
+        return redirect(url_for("user.login"))
 
     if user.role == "admin":
         abort(404)
@@ -765,7 +981,7 @@ def account():
             dbf.update_customer_account(account_details, account_details2)
 
         # Redirect to prevent form resubmission
-        return redirect(url_for("account"))
+        return redirect(url_for("user.account"))
 
     # Set username and gender to display
     account_page_form.name.data = user.name
@@ -787,39 +1003,40 @@ def account():
 """    Admin/Staff Pages    """
 
 
-@app.route("/admin/dashboard", methods=["GET"])
+@admin_bp.route("/admin/dashboard", methods=["GET"])
 @roles_required(["admin", "staff"])
 def dashboard():
-    customers = dbf.number_of_customers()
-    orders = dbf.number_of_orders()
-    book_count = dbf.number_of_books()
-    staff = dbf.number_of_staff()
-    reviews = dbf.no_of_all_reviews()
+    # Counters are maintained by triggers instead of counting every view
+    counters = dbf.retrieve_counters()
+    customers = counters["customers"]
+    orders = counters["orders"]
+    book_count = counters["books"]
+    staff = counters["staff"]
+    reviews = counters["reviews"]
     if flask_global.user.role == "admin":
         return render_template("admin/admin_dashboard.html",
                                customer_count=customers,
                                order_count=orders,
                                book_count=book_count,
-                               staff_count=staff)
+                               staff_count=staff,
+                               sales=dbf.retrieve_sales_summary(ANALYTICS_DAYS))
 
     elif flask_global.user.role == "staff":
         return render_template("admin/staff_dashboard.html",
                                order_count=orders,
                                book_count=book_count,
-                               review_count=reviews)
+                               review_count=reviews,
+                               sales=dbf.retrieve_sales_summary(ANALYTICS_DAYS))
 
 
 # Manage accounts page
-@app.route("/admin/manage-users", methods=["GET", "POST"])
+@admin_bp.route("/admin/manage-users", methods=["GET", "POST"])
 @roles_required(["admin"])
 def manage_users():
     # Flask global error variable for css
     flask_global.errors = {}
     errors = flask_global.errors
 
-    # Get page number
-    active_page = request.args.get("page", default=1, type=int)
-
     # Get sign up form
     create_user_form = CreateUserForm(request.form)
     delete_user_form = DeleteUserForm(request.form)
@@ -854,7 +1071,7 @@ def manage_users():
                 flash("Customer does not exist", "warning")
 
             # Redirect to prevent form resubmission
-            return redirect(f"{url_for('manage_users')}?page={active_page}")
+            return redirect(url_for("admin.manage_users", **request.args))
 
         # If action is to create user (and POST request is valid)
         elif create_user_form.validate():
@@ -878,68 +1095,28 @@ def manage_users():
                 user_id = generate_uuid5(username)  # Generate new unique user id for customer
                 dbf.create_customer(user_id, username, aws_encrypt(email), pw_hash(password))
                 flash(f"Created new customer: {username}")
-                return redirect(f"{url_for('manage_users')}?page={active_page}")
+                return redirect(url_for("admin.manage_users", **request.args))
 
         # Else, form was invalid
         else:
             errors["DisplayFieldError"] = True
 
-    # Get total number of customers
-    customer_count = dbf.number_of_customers()
-
-    # Set page number
-    last_page = ceil(customer_count / ACCOUNTS_PER_PAGE) or 1
-    if active_page < 1:
-        active_page = 1
-    elif active_page > last_page:
-        active_page = last_page
-
-    # Get users to be displayed
-    offset = (active_page - 1) * ACCOUNTS_PER_PAGE  # Offset for SQL query
-    display_users = [User(*data) for data in dbf.retrieve_these_customers(ACCOUNTS_PER_PAGE, offset)]
-
-    first_index = (active_page - 1) * ACCOUNTS_PER_PAGE
-
-    # Get page list
-    if last_page <= 5:
-        page_list = [i for i in range(1, last_page + 1)]
-    else:
-        center_item = active_page
-        if center_item < 3:
-            center_item = 3
-        elif center_item > last_page - 2:
-            center_item = last_page - 2
-        page_list = [i for i in range(center_item - 2, center_item + 2 + 1)]
-    prev_page = active_page - 1 if active_page - 1 > 0 else active_page
-    next_page = active_page + 1 if active_page + 1 <= last_page else last_page
-
-    # Get entries range
-    entries_range = (first_index + 1, first_index + len(display_users))
-
     return render_template(
         "admin/manage_accounts.html",
-        display_users=display_users,
-        aws_decrypt=aws_decrypt,
-        active_page=active_page, page_list=page_list,
-        prev_page=prev_page, next_page=next_page,
-        first_page=1, last_page=last_page,
-        entries_range=entries_range, total_entries=customer_count,
+        **get_accounts_page(dbf.retrieve_customers_page, dbf.approximate_number_of_customers),
         form_trigger=form_trigger,
         create_user_form=create_user_form,
         delete_user_form=delete_user_form
     )
 
 
-@app.route('/admin/manage-staff', methods=["GET", "POST"])
+@admin_bp.route('/admin/manage-staff', methods=["GET", "POST"])
 @roles_required(["admin"])
 def manage_staff():
     # Flask global error variable for css
     flask_global.errors = {}
     errors = flask_global.errors
 
-    # Get page number
-    active_page = request.args.get("page", default=1, type=int)
-
     # Get sign up form
     create_staff_form = CreateUserForm(request.form)
     delete_staff_form = DeleteUserForm(request.form)
@@ -973,7 +1150,7 @@ def manage_staff():
                 flash("Staff does not exist", "warning")
 
             # Redirect to prevent form resubmission
-            return redirect(f"{url_for('manage_staff')}?page={active_page}")
+            return redirect(url_for("admin.manage_staff", **request.args))
 
         # If action is to create user (and POST request is valid)
         elif create_staff_form.validate():
@@ -997,59 +1174,22 @@ def manage_staff():
                 user_id = generate_uuid5(username)  # Generate new unique user id for customer
                 dbf.create_staff(user_id, username, aws_encrypt(email), pw_hash(password))
                 flash(f"Created new staff: {username}")
-                return redirect(f"{url_for('manage_staff')}?page={active_page}")
+                return redirect(url_for("admin.manage_staff", **request.args))
 
         # Else, form was invalid
         else:
             errors["DisplayFieldError"] = True
 
-    # Get total number of customers
-    staff_count = dbf.number_of_staff()
-
-    # Set page number
-    last_page = ceil(staff_count / ACCOUNTS_PER_PAGE) or 1
-    if active_page < 1:
-        active_page = 1
-    elif active_page > last_page:
-        active_page = last_page
-
-    # Get users to be displayed
-    offset = (active_page - 1) * ACCOUNTS_PER_PAGE  # Offset for SQL query
-    display_users = [User(*data) for data in dbf.retrieve_all_staff(ACCOUNTS_PER_PAGE, offset)]
-
-    first_index = (active_page - 1) * ACCOUNTS_PER_PAGE
-
-    # Get page list
-    if last_page <= 5:
-        page_list = [i for i in range(1, last_page + 1)]
-    else:
-        center_item = active_page
-        if center_item < 3:
-            center_item = 3
-        elif center_item > last_page - 2:
-            center_item = last_page - 2
-        page_list = [i for i in range(center_item - 2, center_item + 2 + 1)]
-    prev_page = active_page - 1 if active_page - 1 > 0 else active_page
-    next_page = active_page + 1 if active_page + 1 <= last_page else last_page
-
-    # Get entries range
-    entries_range = (first_index + 1, first_index + len(display_users))
-
     return render_template(
         "admin/manage_staff.html",
-        display_users=display_users,
-        aws_decrypt=aws_decrypt,
-        active_page=active_page, page_list=page_list,
-        prev_page=prev_page, next_page=next_page,
-        first_page=1, last_page=last_page,
-        entries_range=entries_range, total_entries=staff_count,
+        **get_accounts_page(dbf.retrieve_staff_page, dbf.approximate_number_of_staff),
         form_trigger=form_trigger,
         create_user_form=create_staff_form,
         delete_user_form=delete_staff_form
     )
 
 
-@app.route('/admin/inventory')
+@admin_bp.route('/admin/inventory')
 @roles_required(["admin", "staff"])
 def inventory():
     inventory_data = dbf.retrieve_inventory()
@@ -1059,7 +1199,35 @@ def inventory():
     return render_template('admin/inventory.html', count=len(book_inventory), books_list=book_inventory)
 
 
-@app.route('/admin/book/<book_id>')
+@admin_bp.route('/admin/export/inventory')
+@roles_required(["admin", "staff"])
+def export_inventory():
+    file_format = request.args.get("format", default="csv", type=str)
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+    return export_response(dbf.stream_inventory(EXPORT_CHUNK_SIZE), "inventory", file_format)
+
+
+@admin_bp.route('/admin/export/orders')
+@roles_required(["admin", "staff"])
+def export_orders():
+    file_format = request.args.get("format", default="csv", type=str)
+    if file_format not in EXPORT_FORMATS:
+        abort(400)
+
+    # Date range (inclusive, YYYY-MM-DD) and statuses (e.g. ?status=Ordered&status=Shipped)
+    try:
+        since, until = (datetime.date.fromisoformat(request.args[arg]).isoformat() if arg in request.args else None
+                        for arg in ("from", "to"))
+    except ValueError:
+        abort(400)
+    statuses = request.args.getlist("status")
+
+    orders = dbf.stream_orders(since, until, statuses, EXPORT_CHUNK_SIZE)
+    return export_response(orders, "orders", file_format)
+
+
+@admin_bp.route('/admin/book/<book_id>')
 @roles_required(["admin", "staff"])
 def view_book(book_id):
     book_data = dbf.retrieve_book(book_id)
@@ -1071,12 +1239,7 @@ def view_book(book_id):
     return render_template("admin/book_info_admin.html", book=book)
 
 
-lang_list = [('', 'Select'), ('English', 'English'), ('Chinese', 'Chinese'), ('Malay', 'Malay'), ('Tamil', 'Tamil')]
-category_list = [('', 'Select'), ('Action & Adventure', 'Action & Adventure'), ('Classic', 'Classic'),
-                 ('Comic', 'Comic'), ('Detective & Mystery', 'Detective & Mystery')]
-
-
-@app.route('/admin/add-book', methods=['GET', 'POST'])
+@admin_bp.route('/admin/add-book', methods=['GET', 'POST'])
 @roles_required(["admin", "staff"])
 def add_book():
     add_book_form = AddBookForm(request.form)
@@ -1101,9 +1264,7 @@ def add_book():
             book_img_filename = f"{book_id}.png"  # Generate unique name string for files
             path = os.path.join(BOOK_UPLOAD_FOLDER, book_img_filename)
             book_img.save(path)
-            image = Image.open(path)
-            resized_image = image.resize((259, 371))
-            resized_image.save(path)
+            resize_cover(path, "add_book_cover")
 
             book_details = (book_id,
                             add_book_form.language.data,
@@ -1124,7 +1285,7 @@ def add_book():
     return render_template('admin/add_book.html', form=add_book_form)
 
 
-@app.route('/admin/update-book/<book_id>/', methods=['GET', 'POST'])
+@admin_bp.route('/admin/update-book/<book_id>/', methods=['GET', 'POST'])
 @roles_required(["admin", "staff"])
 def update_book(book_id):
     # Get specified book
@@ -1148,9 +1309,7 @@ def update_book(book_id):
             book_img_filename = f"{generate_uuid4()}.png"  # Generate unique name string for files
             path = os.path.join(BOOK_UPLOAD_FOLDER, book_img_filename)
             book_img.save(path)
-            image = Image.open(path)
-            resized_image = image.resize((259, 371))
-            resized_image.save(path)
+            resize_cover(path, "update_book_cover")
 
         updated_details = (
             update_book_form.language.data,
@@ -1164,7 +1323,7 @@ def update_book(book_id):
         )
         dbf.book_update(updated_details, selected_book.book_id)
         flash("Book successfully updated!")
-        return redirect(url_for('inventory'))
+        return redirect(url_for('admin.inventory'))
     else:
         update_book_form.language.data = selected_book.language
         update_book_form.category.data = selected_book.genre
@@ -1176,7 +1335,7 @@ def update_book(book_id):
         return render_template('admin/update_book.html', form=update_book_form)
 
 
-@app.route('/admin/delete-book/<book_id>/', methods=['POST'])
+@admin_bp.route('/admin/delete-book/<book_id>/', methods=['POST'])
 @roles_required(["admin", "staff"])
 def delete_book(book_id):
     # Deletes book and its cover image
@@ -1188,10 +1347,10 @@ def delete_book(book_id):
     else:
         print("Book cover does not exist.")
     dbf.delete_book(book_id)
-    return redirect(url_for('inventory'))
+    return redirect(url_for('admin.inventory'))
 
 
-@app.route("/staff/manage-orders")
+@admin_bp.route("/staff/manage-orders")
 @roles_required(["staff"])
 def manage_orders():
     orders = [Order(*data) for data in dbf.get_all_orders()]
@@ -1202,7 +1361,7 @@ def manage_orders():
                            Book=Book)
 
 
-@app.route("/staff/manage-reviews")
+@admin_bp.route("/staff/manage-reviews")
 @roles_required(["staff"])
 def manage_reviews():
     books_list = [Book(*rows) for rows in dbf.retrieve_inventory()]
@@ -1213,11 +1372,12 @@ def manage_reviews():
 """    Books Pages    """
 
 
-@app.route("/book/<book_id>", methods=["GET", "POST"])
+@main_bp.route("/book/<book_id>", methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
+@page_cache.cached(ttl=PAGE_CACHE_TTL)
 def book_info(book_id):
     if flask_global.user and flask_global.user.role in ["admin", "staff"]:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('admin.dashboard'))
 
     # Get book details
     book_data = dbf.retrieve_book(book_id)
@@ -1229,18 +1389,21 @@ def book_info(book_id):
     book_id = book_data[0]
     book = Book(*book_data)
 
-    return render_template("book_info.html", book=book, book_id=book_id)
+    # Stock less other carts' holds
+    available = dbf.retrieve_available_stock([book_id]).get(book_id, 0)
+
+    return render_template("book_info.html", book=book, book_id=book_id, available=available)
 
 
 # TODO: @Miku @SpeedFox198 work on this (perhaps we not using this?)
-@app.route("/book/<book_id>/book_review", methods=["GET", "POST"])
+@main_bp.route("/book/<book_id>/book_review", methods=["GET", "POST"])
 def book_review(book_id):
     # Get current user
     user: User = flask_global.user
 
     # If user is not logged in
     if not user:
-        return redirect(url_for("login"))
+        return redirect(url_for("user.login"))
 
     if user.role == "admin":
         abort(404)
@@ -1267,15 +1430,16 @@ def book_review(book_id):
                 flash("Review successfully added!")
         if error_occured:
             flash("An error occured, review not added!", category="error")
-        return redirect(url_for("book_info", book_id=book_id))
+        return redirect(url_for("main.book_info", book_id=book_id))
     return render_template("review.html", book=book, form=createReview, book_id = book_id)
 
 
 """ Search Results Page """
 
 
-@app.route("/books/<sort_this>")
+@main_bp.route("/books/<sort_this>")
 @limiter.limit("10/second", override_defaults=False)
+@page_cache.cached(ttl=PAGE_CACHE_TTL)
 def books(sort_this):
     if flask_global.user and flask_global.user.role == "admin":
         abort(403)
@@ -1396,7 +1560,7 @@ def price_high_to_low(inventory_data):
 """  View Shopping Cart  """
 
 
-@app.route('/cart')
+@main_bp.route('/cart')
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def cart():
@@ -1418,14 +1582,18 @@ def cart():
     for book, quantity in cart_items:
         total_price += book.price * quantity
 
-    return render_template('cart.html', buy_count=buy_count, total_price=total_price, cart_items=cart_items)
+    # Stock less holds, the cart's own quantities are held for it
+    available = dbf.retrieve_available_stock(book.book_id for book, _ in cart_items)
+
+    return render_template('cart.html', buy_count=buy_count, total_price=total_price, cart_items=cart_items,
+                           available=available)
 
 
 """    Add to Shopping Cart    """
 
 
 # Add to cart
-@app.route("/add-to-cart", methods=['POST'])
+@main_bp.route("/add-to-cart", methods=['POST'])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def add_to_cart():
@@ -1441,44 +1609,25 @@ def add_to_cart():
     book_id = request.form['book_id']
     buying_quantity = int(request.form['quantity'])
 
-    book_data = dbf.retrieve_book(book_id)
-
-    # Check if book exists in database
-    if book_data is None:
-        abort(400)  # Bad Request
-
-    book = Book(*book_data)
-
-    # Check if quantity entered is valid
-    if buying_quantity is None:
-        raise TypeError("Must have buying quantity")
-
-    # stock left inside (basically customer can't buy more than this)
-    max_quantity = book.stock
-
     # Ensure quantity is within correct range
-    if buying_quantity < 0 or buying_quantity > max_quantity:
+    if buying_quantity < 1:
         abort(400)  # Bad Request
 
-    # if book_id is found
-    # Checking if book_id is already in cart
-    cart_item = dbf.get_cart_item(user_id, book_id)
-
-    # If book is not in customer's cart
-    if cart_item is None:
-        buying_quantity = min(max_quantity, buying_quantity)
-        # Add to cart
-        dbf.add_to_shopping_cart(user_id, book_id, buying_quantity)
+    # Add to the cart's line (or create it), holding as many as are left of the new quantity
+    _, requested, held = dbf.update_cart_lines(user_id, [(book_id, buying_quantity, True)])[0]
+    hold_sweeper.start()
 
-    # Else book is already added in customer's cart
-    else:
-        # Update quantity
-        buying_quantity += cart_item[2]
-        buying_quantity = min(max_quantity, buying_quantity)
-        dbf.update_shopping_cart(user_id, book_id, buying_quantity)
+    # Check if book exists in database
+    if not requested:
+        abort(400)  # Bad Request
 
     # Flash success message to user
-    flash("Book has been added to your cart")
+    if not held:
+        flash("Sorry, this book is out of stock", 'warning')
+    elif held < requested:
+        flash(f"Only {held} of this book are available, your cart has been updated", 'warning')
+    else:
+        flash("Book has been added to your cart")
 
     return redirect(request.referrer)  # Return to catalogue if book_id is not in inventory
 
@@ -1487,44 +1636,47 @@ def add_to_cart():
 """ Update Shopping Cart """
 
 
-@app.route('/update-cart/<book_id>', methods=['POST'])
+@main_bp.route('/update-cart/<book_id>', methods=['POST'])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def update_cart(book_id):
     # User is a Class
     user: User = flask_global.user
 
-    # Update quantity
+    # Update quantity (0 deletes the line)
     book_quantity = int(request.form['quantity'])
-    if book_quantity == 0:
-        # No books in cart, delete cart
-        return redirect(url_for("delete_buying_cart", book_id=book_id))
-    else:
-        # update book quantity
-        dbf.update_shopping_cart(user.user_id, book_id, book_quantity)
-        print('Update book quantity: ', str(book_quantity))
+    if book_quantity < 0:
+        abort(400)  # Bad Request
+
+    _, requested, held = dbf.update_cart_lines(user.user_id, [(book_id, book_quantity, False)])[0]
+    hold_sweeper.start()
+    if requested and not held:
+        flash("Sorry, this book is out of stock", 'warning')
+    elif held < requested:
+        flash(f"Only {held} of this book are available, your cart has been updated", 'warning')
 
-    return redirect(url_for('cart'))
+    return redirect(url_for('main.cart'))
 
 
 """ Delete Cart """
 
 
-@app.route("/delete-buying-cart/<book_id>", methods=['GET', 'POST'])
+@main_bp.route("/delete-buying-cart/<book_id>", methods=['GET', 'POST'])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def delete_buying_cart(book_id):
     user: User = flask_global.user
     # Get User ID
     user_id = user.user_id
-    dbf.delete_shopping_cart_item(user_id, book_id)
-    return redirect(url_for('cart'))
+    # Deletes the line and releases its hold
+    dbf.update_cart_lines(user_id, [(book_id, 0, False)])
+    return redirect(url_for('main.cart'))
 
 
 """ Customer Orders Page """
 
 
-@app.route("/my-orders")
+@main_bp.route("/my-orders")
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def my_orders():
@@ -1564,7 +1716,7 @@ def my_orders():
 """ Checkout Pages """
 
 
-@app.route('/checkout', methods=['GET', 'POST'])
+@main_bp.route('/checkout', methods=['GET', 'POST'])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
 def checkout():
@@ -1593,10 +1745,10 @@ def checkout():
 
 
 # Create Check out session with Stripe
-@app.route('/create-checkout-session', methods=['POST'])
+@main_bp.route('/create-checkout-session', methods=['POST'])
 @limiter.limit("10/second", override_defaults=False)
 @login_required
-def create_checkout_session():
+async def create_checkout_session():
     # User is a Class
     user: User = flask_global.user
 
@@ -1605,46 +1757,64 @@ def create_checkout_session():
 
     user_id = user.user_id
 
-    # Get cart items as a list of tuples, [(Book object, quantity)]
-    cart_items = [(Book(*dbf.retrieve_book(items)), quantity) for items, quantity in dbf.get_shopping_cart(user_id)]
-    buy_count = len(cart_items)
-
-    # Get total price
-    total_price = 0
-    for book, quantity in cart_items:
-        total_price += book.price * quantity
+    # Cart lines with prices in cents, (book_id, title, quantity, unit_amount)
+    # (SQLite is called in a thread and Stripe with its async client, so the event loop keeps serving other requests)
+    lines = await asyncio.to_thread(dbf.retrieve_checkout_lines, user_id)
 
     ship_method = 'Standard Delivery'
-    print("creating checkout session...")
 
     Orderform = OrderForm.OrderForm(request.form)
 
+    if not lines:
+        flash("Your cart is empty", 'warning')
+        return redirect(url_for("main.cart"))
+
     if request.method == 'POST' and Orderform.validate():
-        if ship_method == 'Standard Delivery':  # Standard Delivery
-            total_price += 5
-
-        total_price *= 100
-        total_price = int(total_price)
-        checkout_session = stripe.checkout.Session.create(
-            line_items=[
-                {
-                    'price_data': {
-                        'currency': 'sgd',
-                        'product_data': {
-                            'name': 'Books',
-                        },
-                        'unit_amount': total_price,
-                    },
-                    'quantity': 1,
-                },
-            ],
-            payment_method_types=['card'],
-            mode='payment',
-            success_url='https://127.0.0.1:5000/order-confirm',
-            cancel_url=request.referrer,
-        )
-        print(checkout_session.url)
-        return redirect(checkout_session.url)
+        # The whole cart is held until its session expires, or nothing is if any book ran out
+        short = await asyncio.to_thread(dbf.hold_cart_stock, user_id, payments.SESSION_EXPIRY + 300)
+        hold_sweeper.start()
+        if short:
+            titles = {book_id: title for book_id, title, _, _ in lines}
+            flash("Not enough stock left of " + ", ".join(f"{titles[book_id]} ({available} left)"
+                                                          for book_id, _, available in short), 'warning')
+            return redirect(url_for("main.cart"))
+
+        items = [(book_id, quantity, unit_amount) for book_id, _, quantity, unit_amount in lines]
+        checkout_hash = payments.cart_hash(items, ship_method)
+
+        # Checking out the same cart again (e.g. refresh, back button or retry after an error) reuses its
+        # payment, so its order id (the idempotency key of its session) and session are the same
+        payment = await asyncio.to_thread(dbf.retrieve_reusable_payment, user_id, checkout_hash, payments.SESSION_EXPIRY - 300)
+        if payment is not None and payment[1] is not None:
+            return redirect(payment[1])
+
+        # A session that was never stored can only be retried while Stripe still accepts its expiry
+        if payment is not None and time.time() - payment[2] < payments.SESSION_EXPIRY - payments.MIN_SESSION_EXPIRY:
+            order_id, _, created = payment
+        else:
+            # The pending payment exists before Stripe is called, so its session is never lost
+            order_id = generate_uuid4()
+            _, created = await asyncio.to_thread(dbf.create_payment, order_id, user_id, payments.CURRENCY, ship_method,
+                                                 payments.SHIPPING_FEES[ship_method], checkout_hash, items)
+
+        # One line per book, priced by cached Stripe prices
+        stripe = payments.get_stripe(current_app.config)
+        try:
+            line_items = await payments.checkout_line_items(stripe, payments.stripe_mode(current_app.config), lines, ship_method)
+            session_id, session_url = await payments.create_checkout_session(
+                stripe, order_id, created, line_items,
+                success_url=url_for("main.orderconfirm", order_id=order_id, _external=True),
+                cancel_url=url_for("main.cart", _external=True)
+            )
+        except Exception:
+            # Stripe errors, timeouts and connection errors (the session may still have been created)
+            current_app.logger.exception(f"Could not create checkout session of order {order_id}")
+            await asyncio.to_thread(dbf.fail_payment, order_id)
+            await asyncio.to_thread(dbf.release_cart_stock, user_id)
+            flash("We could not start your payment, please try again", 'warning')
+            return redirect(url_for("main.cart"))
+        await asyncio.to_thread(dbf.set_payment_session, order_id, session_id, session_url)
+        return redirect(session_url)
     else:
         flash(list(Orderform.errors.values())[0][0], 'warning')
         return redirect(request.referrer)
@@ -1652,44 +1822,41 @@ def create_checkout_session():
 
 #
 # show confirmation page upon successful payment
+# (orders are created by the Stripe webhook, this only looks up their status)
 #
-@app.route("/order-confirm")
+@main_bp.route("/order-confirm/<order_id>")
 @login_required
-def orderconfirm():
+def orderconfirm(order_id):
     # User is a Class
-    flask_global.user = get_user()
     user: User = flask_global.user
 
     if user.role == "admin":
         abort(404)
 
-    user_id = user.user_id
+    payment = dbf.retrieve_payment(order_id, user.user_id)
+    if payment is None:
+        abort(404)
 
-    # Get cart items as a list of tuples, [(Book object, quantity)]
-    cart_items = [(Book(*dbf.retrieve_book(items)), quantity)
-                  for items, quantity in dbf.get_shopping_cart(user_id)]
-    
-    # Generate order id
-    order_id = generate_uuid4()
+    return render_template("order_confirmation.html", status=payment[1])
 
-    # Shipping Option
-    shipping_option = 'Standard Delivery'
 
-    # Order pending
-    order_pending = 'Ordered'
+""" Stripe Webhook """
 
-    # Create order
-    dbf.create_order_details(order_id, user_id, shipping_option, order_pending)
 
-    # Create order items
-    for item, quantity in cart_items:
-        dbf.create_order_items(order_id, item.book_id, quantity)
-        
-        # Delete cart items
-        dbf.delete_shopping_cart_item(user_id, item.book_id)
-    
+@api_bp.route("/api/stripe/webhook", methods=["POST"])
+@limiter.exempt
+def stripe_webhook():
+    payload = request.get_data()
+    try:
+        event = payments.verify_webhook(payload, request.headers.get("Stripe-Signature"),
+                                        current_app.config["STRIPE_WEBHOOK_SECRET"])
+    except payments.WebhookSignatureError as e:
+        return jsonify(status=1, error=str(e)), 400
 
-    return render_template("order_confirmation.html")
+    # Stored before answering, processed by the payment worker (Stripe retries on anything but 2xx)
+    if dbf.save_stripe_event(event["id"], event["type"], payload.decode()):
+        payment_worker.notify()
+    return jsonify(status=0)
 
 
 """    Miscellaneous Pages    """
@@ -1697,8 +1864,9 @@ def orderconfirm():
 """ About Page """
 
 
-@app.route("/about")
+@main_bp.route("/about")
 @limiter.limit("10/second", override_defaults=False)
+@page_cache.cached(ttl=PAGE_CACHE_TTL)
 def about():
     return render_template("about.html")
 
@@ -1706,12 +1874,8 @@ def about():
 """ API Routes"""
 
 
-@app.route("/api/user/login", methods=["POST"])
-@limiter.limit("10/second", override_defaults=False)
-@expects_json(LOGIN_SCHEMA)
-def api_login():
-    username = flask_global.data["username"]
-    password = flask_global.data["password"]
+def login_attempt(username: str, password: str) -> tuple[Response, Union[tuple, None]]:
+    """ Checks a login of /api/user/login, returns (response, lockout alert as (email, subject, message) or None) """
     user_data = user_authenticate(username, password)
     time_check = datetime.datetime.now()
     if user_data is None:
@@ -1721,7 +1885,7 @@ def api_login():
             if bool(dbf.retrieve_failed_login(username)) == False:
                 print("Check 3")
                 dbf.create_failed_login(username, 1)
-                return jsonify(status=1)
+                return jsonify(status=1), None
             if dbf.retrieve_failed_login(username)[1] == 5:
                 print("Check 4")
                 year = datetime.datetime.now().year
@@ -1736,15 +1900,14 @@ def api_login():
                 email = dbf.retrieve_email_by_username(username)
                 subject = "ALERT - Account Locked"
                 message = "Your account has been locked for 30 minutes, someone has tried to login to your account 5 times. If this was not you, change your password immediately."
-                gmail_send(aws_decrypt(email), subject, message)
-                return jsonify(status=1)
+                return jsonify(status=1), (aws_decrypt(email), subject, message)
             if dbf.retrieve_failed_login(username)[1] < 5 and dbf.retrieve_failed_login(username)[1] > 0:
                 print("Check 5")
                 dbf.update_failed_login(username, dbf.retrieve_failed_login(username)[1] + 1)
-                return jsonify(status=1)
+                return jsonify(status=1), None
         else:
             print("Check 6")
-            return jsonify(status=1)
+            return jsonify(status=1), None
     user = User(*user_data)
     enable_2FA = bool(dbf.retrieve_2FA_token(user.user_id))
     if dbf.retrieve_lockout_time(username) is not None:
@@ -1762,7 +1925,7 @@ def api_login():
         print(difference_time.seconds)
         if difference_time.seconds < 1800:
             print("Your account is still locked")
-            return jsonify(status=1)
+            return jsonify(status=1), None
         else:
             dbf.delete_lockout_time(username)
             print("Your account is unlocked")
@@ -1774,17 +1937,28 @@ def api_login():
         add_cookie({"user_data": user_data, "user_id": user.user_id})
 
     # Status 0 for success
-    return jsonify(status=0, enable_2FA=enable_2FA)
+    return jsonify(status=0, enable_2FA=enable_2FA), None
+
+
+@api_bp.route("/api/user/login", methods=["POST"])
+@limiter.limit("10/second", override_defaults=False)
+@expects_json(LOGIN_SCHEMA)
+async def api_login():
+    # Password hashing and SQLite run in a thread, the lockout alert is sent from the event loop
+    response, alert = await asyncio.to_thread(login_attempt, flask_global.data["username"], flask_global.data["password"])
+    if alert is not None:
+        await gmail_send_async(*alert)
+    return response
 
 
-@app.route("/api/user/logout", methods=["POST"])
+@api_bp.route("/api/user/logout", methods=["POST"])
 @limiter.limit("10/second", override_defaults=False)
 def api_logout():
     flask_global.user = None
     return jsonify(status=0)  # Status 0 is success
 
 
-@app.route("/api/books", methods=["GET"])
+@api_bp.route("/api/books", methods=["GET"])
 @limiter.limit("10/second", override_defaults=False)
 def api_all_books():
     books_data = dbf.retrieve_inventory()
@@ -1805,7 +1979,7 @@ def api_all_books():
     return jsonify(output)
 
 
-@app.route("/api/books/<book_id>", methods=["GET"])
+@api_bp.route("/api/books/<book_id>", methods=["GET"])
 @limiter.limit("10/second", override_defaults=False)
 def api_single_book(book_id):
     if request.method == "GET":
@@ -1826,32 +2000,95 @@ def api_single_book(book_id):
         return jsonify(output)
 
 
-@app.route('/api/admin/users', methods=["GET", "POST"])
+@api_bp.route("/api/cart", methods=["GET", "POST"])
+@limiter.limit("10/second", override_defaults=False)
+@expects_json(CART_SCHEMA, ignore_for=["GET"])
+@roles_required(["customer"], "api")
+def api_cart():
+    """
+    Returns the user's cart, POST applies a batch of line changes first in one transaction:
+    {"lines": [{"book_id": "...", "quantity": 2, "op": "set"}, {"book_id": "...", "quantity": 1, "op": "add"}]}
+    Lines are cut to the stock left, see "changed" for the quantities requested and put in the cart
+    """
+    user_id = flask_global.user.user_id
+
+    output = {}
+    if request.method == "POST":
+        lines = [(line["book_id"], line["quantity"], line.get("op") == "add") for line in request.get_json()["lines"]]
+        changed = dbf.update_cart_lines(user_id, lines)
+        hold_sweeper.start()
+        output["changed"] = [dict(book_id=book_id, requested=requested, quantity=quantity)
+                             for book_id, requested, quantity in changed]
+
+    # Prices in cents, as charged at checkout
+    lines = dbf.retrieve_checkout_lines(user_id)
+    output.update(
+        items=[dict(book_id=book_id, title=title, quantity=quantity, unit_amount=unit_amount)
+               for book_id, title, quantity, unit_amount in lines],
+        count=len(lines),
+        subtotal=sum(quantity * unit_amount for _, _, quantity, unit_amount in lines),
+        currency=payments.CURRENCY,
+    )
+    return jsonify(output)
+
+
+@api_bp.route('/api/admin/users', methods=["GET", "POST"])
 @limiter.limit("10/second", override_defaults=False)
 @expects_json(CREATE_USER_SCHEMA, ignore_for=["GET"])
 @roles_required(["admin"], "api")
 def api_users():
     if request.method == "GET":
+        # Page size
+        limit = request.args.get("limit", default=API_USERS_PAGE_SIZE, type=int)
+        if not 0 < limit <= API_USERS_MAX_PAGE_SIZE:
+            return jsonify(status=1, error=f"Parameter 'limit' must be between 1 and {API_USERS_MAX_PAGE_SIZE}."), 400
+
+        # Fields to be returned (e.g. ?fields=user_id,username skips decrypting emails)
+        fields = request.args.get("fields", default=",".join(API_USER_FIELDS), type=str)
+        fields = list(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+        if not fields or not set(fields) <= set(API_USER_FIELDS):
+            return jsonify(status=1, error=f"Parameter 'fields' must be from {', '.join(API_USER_FIELDS)}."), 400
+
+        # Cursor from X-Next-Cursor header of previous page
+        cursor = request.args.get("cursor", default="", type=str)
+        try:
+            last_user_id = decode_cursor(cursor)
+        except ValueError:
+            return jsonify(status=1, error="Invalid cursor."), 400
 
-        users_data = dbf.retrieve_these_customers(limit=0, offset=0)
+        # Fetch one extra row to know if there is a next page (user_id is needed for cursor)
+        columns = tuple(dict.fromkeys(["user_id"] + fields))
+        users_data = dbf.retrieve_customers_after(last_user_id, limit + 1, columns)
+        has_next_page = len(users_data) > limit
+        users_data = users_data[:limit]
 
-        if not users_data:
+        if not users_data and not cursor:
             return jsonify(message="There are currently no users.")
 
         # Comment out personal info in case of excessive data exposure
-        output = [dict(user_id=row[0],
-                       username=row[1],
-                       email=aws_decrypt(row[2]),
-                       profile_pic=row[4],
-                       role=row[5],
-                       name=row[6],
-                       )
-                  for row in users_data]
+        response = Response(stream_users_json(users_data, columns, fields), mimetype="application/json")
+        if has_next_page:
+            response.headers["X-Next-Cursor"] = encode_cursor(users_data[-1][0])
+        return response
 
-        return jsonify(output)
 
+@api_bp.route('/api/admin/analytics', methods=["GET"])
+@limiter.limit("10/second", override_defaults=False)
+@roles_required(["admin", "staff"], "api")
+def api_analytics():
+    # Number of days of sales (reads daily rollups, not order history)
+    days = request.args.get("days", default=ANALYTICS_DAYS, type=int)
+    if not 0 < days <= ANALYTICS_MAX_DAYS:
+        return jsonify(status=1, error=f"Parameter 'days' must be between 1 and {ANALYTICS_MAX_DAYS}."), 400
+
+    top = request.args.get("top", default=5, type=int)
+    if not 0 < top <= 100:
+        return jsonify(status=1, error="Parameter 'top' must be between 1 and 100."), 400
 
-@app.route('/api/admin/users/<user_id>', methods=["GET"])
+    return jsonify(dbf.retrieve_sales_summary(days, top))
+
+
+@api_bp.route('/api/admin/users/<user_id>', methods=["GET"])
 @limiter.limit("10/second", override_defaults=False)
 @roles_required(["admin"], "api")
 def api_single_user(user_id):
@@ -1873,7 +2110,7 @@ def api_single_user(user_id):
 
 
 # TODO: @SpeedFox198 @Miku add limit
-@app.route("/api/reviews/<book_id>")
+@api_bp.route("/api/reviews/<book_id>")
 @limiter.limit("10/second", override_defaults=False)
 def api_reviews(book_id):
     """ Returns a list of customer reviews in json format """
@@ -1887,7 +2124,7 @@ def api_reviews(book_id):
     return jsonify(reviews=reviews, ratings=ratings)
 
 
-@app.route('/api/reviews/<book_id>', methods=["DELETE"])
+@api_bp.route('/api/reviews/<book_id>', methods=["DELETE"])
 @limiter.limit("10/second", override_defaults=False)
 @roles_required(["staff"], "api")
 def api_delete_reviews(book_id):  # created delete route bc staff only can delete but everyone can read reviews
@@ -1905,38 +2142,185 @@ def api_delete_reviews(book_id):  # created delete route bc staff only can delet
     return jsonify(status=0, message=f"Review by {deleted_review_username} deleted!")
 
 
+"""    Monitoring    """
+
+
+@monitoring_bp.route("/metrics")
+def metrics():
+    """ Returns metrics of all workers in Prometheus text format (for scrapers with METRICS_TOKEN, or admins) """
+    authorization = request.headers.get("Authorization", "")
+    scraper = bool(METRICS_TOKEN) and compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode())
+    admin = isinstance(flask_global.user, User) and flask_global.user.role == "admin"
+    if not scraper and not admin:
+        return jsonify(message="The resource you requested does not exist."), 404
+
+    return Response(REGISTRY.exposition(), mimetype="text/plain; version=0.0.4")
+
+
+@monitoring_bp.route("/api/admin/profiles", methods=["GET", "DELETE"])
+@roles_required(["admin"], "api")
+def api_profiles():
+    """ Returns number of stack samples of each profiled endpoint (DELETE clears them) """
+    if request.method == "DELETE":
+        profiler.clear()
+        return jsonify(status=0, message="Profiles cleared.")
+
+    return jsonify(endpoints=profiler.summary(), interval=profiler.interval,
+                   profile_endpoints=current_app.config["PROFILE_ENDPOINTS"],
+                   profile_sample_rate=current_app.config["PROFILE_SAMPLE_RATE"])
+
+
+@monitoring_bp.route("/admin/profiles/<endpoint>")
+@roles_required(["admin"])
+def download_profile(endpoint):
+    """ Downloads stack samples of endpoint as collapsed stacks or a speedscope file (?format=) """
+    if endpoint not in profiler.summary():
+        abort(404)
+
+    file_format = request.args.get("format", default="collapsed")
+    if file_format == "collapsed":
+        content, mimetype, extension = profiler.collapsed(endpoint), "text/plain", "txt"
+    elif file_format == "speedscope":
+        content, mimetype, extension = json.dumps(profiler.speedscope(endpoint)), "application/json", "speedscope.json"
+    else:
+        abort(400)
+
+    response = Response(content, mimetype=mimetype)
+    filename = f"profile-{secure_filename(endpoint)}-{datetime.date.today().isoformat()}.{extension}"
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+
+"""    Debug Routes    """
+
+
+# Only registered when debugging (totals are per worker)
+if DEBUG:
+    @monitoring_bp.route("/debug/queries", methods=["GET", "DELETE"])
+    @roles_required(["admin"], "api")
+    def debug_queries():
+        """ Returns queries with the most cumulative time (DELETE resets them) """
+        if request.method == "DELETE":
+            dbf.reset_top_queries()
+            return jsonify(status=0, message="Query totals reset.")
+
+        limit = request.args.get("limit", default=20, type=int)
+        return jsonify(slow_query_ms=dbf.SLOW_QUERY_MS, queries=dbf.top_queries(max(1, min(limit, 100))))
+
+
 """    Error Handlers    """
 
 
-# Error handling page
-@app.errorhandler(403)
 def forbidden(e):
     return render_template("error/403.html"), 403
 
 
-@app.errorhandler(404)
 def page_not_found(e):
     return render_template("error/404.html"), 404
 
 
-@app.errorhandler(429)
 def too_many_request(e):
+    RATE_LIMITED.inc(endpoint=request.endpoint or "none")
     return render_template("error/429.html"), 429
 
 
-@app.errorhandler(400)
 def bad_request(error):
-    if isinstance(error.description, jsonschema.ValidationError):
+    # jsonschema is only imported once a json route has been requested (see expects_json)
+    jsonschema = sys.modules.get("jsonschema")
+    if jsonschema is not None and isinstance(error.description, jsonschema.ValidationError):
         original_error = error.description
         return jsonify(status=1, error=original_error.message), 400
     return render_template("error/400.html"), 400
 
 
-@app.errorhandler(CSRFError)
 def csrf_error(error):
     return render_template("error/csrf.html", error=error), 400
 
 
+"""    App Factory    """
+
+
+def warm_up(app: Flask) -> None:
+    """
+    Does the work every worker would otherwise repeat on its first requests,
+    so that it is done once in the master process and shared copy-on-write after fork
+    """
+    # Compile (or load from the bytecode cache) every template, they are kept in the jinja environment's cache
+    _, errors = precompile_templates(app.jinja_env)
+    for name, error in errors.items():
+        app.logger.warning(f"Could not precompile template {name}: {error}")
+
+    # CSP strings are built when csp is imported, getting them checks both variants are there
+    get_csp()
+    get_csp(blob=True)
+
+    # Render catalogue pages into the page and fragment caches (as an anonymous user)
+    with app.test_client() as client:
+        for path in WARMUP_PATHS:
+            response = client.get(path)
+            if response.status_code != 200:
+                app.logger.warning(f"Could not warm up {path}: {response.status_code}")
+
+    # Everything allocated so far lives for as long as the worker, keep the garbage
+    # collector from touching (and so copying) its pages in every worker
+    gc.collect()
+    gc.freeze()
+
+
+def create_app(config: dict=None, warmup: bool=False) -> Flask:
+    """
+    Creates the app, config overrides config/app.cfg (e.g. RATELIMIT_ENABLED=False for benchmarks)
+    For WSGI servers, e.g. gunicorn "__init__:create_app()"
+
+    With warmup=True templates are compiled and catalogue pages cached before returning,
+    for preforking servers, e.g. gunicorn --preload "__init__:create_app(warmup=True)"
+    Per-worker state (thread pools, clients, connections, metrics) is recreated after fork.
+    """
+    app = Flask(__name__)
+    app.config.from_pyfile("config/app.cfg")  # Load config file
+    app.config['RECAPTCHA_PUBLIC_KEY'] = '6Ld_DnUhAAAAAGcuOtjXHX-peLN2QURPU8nhtT2d'
+    app.config['RECAPTCHA_PRIVATE_KEY'] = '6Ld_DnUhAAAAAKHGn71fzgPvdcvvoqRLDF812aKr'
+
+    # testing mode (stripe is imported and given the key on first checkout)
+    app.config['STRIPE_PUBLIC_KEY'] = 'pk_test_51LNFSvLeIrXIJDLVMtA0cZuNhFl3fFrgE6fjUAgSEzhs9SHLF5alwOVK8Cu1XZcF7NF9GBEinYI9nY8WuRw7c7ee00qzmDKaVq'
+    app.config['STRIPE_SECRET_KEY'] = 'sk_test_51LNFSvLeIrXIJDLVEVQ8XVgIIhIWcKy0d7WVM5mM7TIBTxNLNMFUcN5Gx3zcmTKHyxJkrxiB98qZzdt5qYYrPM55002ARsY3yC'
+    app.config['STRIPE_WEBHOOK_SECRET'] = os.environ.get("STRIPE_WEBHOOK_SECRET")  # Signing secret of the webhook endpoint
+    app.config.update(config or {})
+    app.async_to_sync = async_to_sync  # Async views run on the process' event loop (see event_loop)
+
+    app.jinja_env.add_extension("jinja2.ext.do")  # Add do extension to jinja environment
+    app.jinja_env.add_extension(FragmentCacheExtension)  # Add {% cache %} tag to jinja environment
+    app.jinja_env.fragment_cache = MemoryCache(FRAGMENT_CACHE_SIZE, name="fragment")
+    app.jinja_env.fragment_cache_enabled = not DEBUG  # Always re-render when debugging
+    if app.config.get("TEMPLATE_CACHE_DIR"):
+        app.jinja_env.bytecode_cache = TemplateBytecodeCache(app.config["TEMPLATE_CACHE_DIR"])
+
+    csrf.init_app(app)
+    limiter.init_app(app)
+
+    # Order matters, cached pages are served by page cache (skipping the before_request hooks after it)
+    app.before_request(start_request_stats)
+    page_cache.init_app(app)
+    app.before_request(before_request)
+    app.after_request(after_request)
+    app.teardown_request(stop_query_stats)
+
+    for blueprint in (main_bp, user_bp, admin_bp, api_bp, monitoring_bp):
+        app.register_blueprint(blueprint)
+
+    # Error handling pages
+    app.register_error_handler(403, forbidden)
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(429, too_many_request)
+    app.register_error_handler(400, bad_request)
+    app.register_error_handler(CSRFError, csrf_error)
+
+    dbf.upgrade_schema()  # Create tables and indexes added after schema.sql
+    if warmup:
+        warm_up(app)
+    return app
+
+
 """    Main    """
 if __name__ == "__main__":
-    app.run(debug=DEBUG, ssl_context=('cert.pem', 'key.pem'))  # Run app
+    create_app().run(debug=DEBUG, ssl_context=('cert.pem', 'key.pem'))  # Run app
@@ -26,3 +26,24 @@ CREATE_USER_SCHEMA = {
     },
     "required": ["username", "email", "password"]
 }
+
+CART_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "lines": {
+            "type": "array",
+            "minItems": 1,
+            "maxItems": 50,
+            "items": {
+                "type": "object",
+                "properties": {
+                    "book_id": {"type": "string"},
+                    "quantity": {"type": "integer", "minimum": 0, "maximum": 999},
+                    "op": {"enum": ["set", "add"]}  # Set the line's quantity (default) or add to it
+                },
+                "required": ["book_id", "quantity"]
+            }
+        }
+    },
+    "required": ["lines"]
+}
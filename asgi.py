@@ -0,0 +1,63 @@
+"""
+ASGI Entry Point
+----------------
+
+Serves the app from an ASGI server
+
+Usage:
+    uvicorn --factory asgi:create_asgi_app --workers 4
+    ASGI_THREADS=128 uvicorn --factory asgi:create_asgi_app
+
+Every request runs in its own thread, at most ASGI_THREADS at once (the rest
+wait on the server's event loop without a thread). Async views (sign up,
+forgotten password, login lockout alerts and checkout) wait on Gmail and
+Stripe on the process' event loop (see event_loop), so a waiting request only
+parks its thread, and a process can keep far more of them waiting than a sync
+worker's --threads. The WSGI entry point, gunicorn "__init__:create_app()",
+runs the same views.
+"""
+import asyncio
+import os
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+
+__all__ = ["ASGI_THREADS", "ThreadPerRequest", "create_asgi_app"]
+
+ASGI_THREADS = int(os.environ.get("ASGI_THREADS", 64))  # Requests run at once by each worker process
+
+
+class ThreadPerRequest:
+    """ ASGI app running a WSGI app, each request in its own thread """
+
+    def __init__(self, wsgi_app, threads: int=ASGI_THREADS) -> None:
+        self.app = WsgiToAsgi(wsgi_app)
+        self.threads = threads
+        self._slots = None  # Semaphore of the server's loop, created in it
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            return await self._lifespan(receive, send)
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.threads)
+        async with self._slots:
+            # WsgiToAsgi would otherwise run every request in the same thread
+            async with ThreadSensitiveContext():
+                await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _lifespan(receive, send) -> None:
+        """ Nothing to set up, the app is created before the server starts """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app(config: dict=None) -> ThreadPerRequest:
+    """ Creates the app (see create_app) served as an ASGI app """
+    from __init__ import create_app  # Only imported here, so benchmarks can wrap an app they loaded themselves
+    return ThreadPerRequest(create_app(config), ASGI_THREADS)
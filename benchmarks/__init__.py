@@ -0,0 +1 @@
+# File to allow imports
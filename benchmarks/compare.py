@@ -0,0 +1,77 @@
+"""
+Compare Micro Benchmarks
+------------------------
+
+Compares two result files of benchmarks.micro
+
+Usage:
+    python -m benchmarks.compare before.json after.json [--threshold 0.05]
+
+A change is significant when Welch's t statistic of the samples is above 2
+(about 95% confidence) and the means differ by more than the threshold.
+Exits with code 1 if any benchmark got significantly slower.
+"""
+import argparse
+import json
+import math
+import sys
+from benchmarks.micro import format_time
+
+DEFAULT_THRESHOLD = 0.05  # Changes under 5% are treated as noise
+SIGNIFICANT_T = 2.0
+
+
+def welch_t(before: list[float], after: list[float]) -> float:
+    """ Welch's t statistic of two samples """
+    def mean_variance(samples):
+        mean = sum(samples) / len(samples)
+        return mean, sum((sample - mean) ** 2 for sample in samples) / max(1, len(samples) - 1)
+
+    mean_before, variance_before = mean_variance(before)
+    mean_after, variance_after = mean_variance(after)
+    error = math.sqrt(variance_before / len(before) + variance_after / len(after))
+    return (mean_after - mean_before) / error if error else math.inf * (mean_after != mean_before)
+
+
+def compare(before: dict, after: dict, threshold: float=DEFAULT_THRESHOLD) -> list[tuple[str, str, bool]]:
+    """ Returns (name, description, significantly slower) of benchmarks in both results """
+    rows = []
+    for name, old in before["benchmarks"].items():
+        new = after["benchmarks"].get(name)
+        if new is None:
+            continue
+
+        change = new["mean"] / old["mean"]
+        significant = abs(welch_t(old["samples"], new["samples"])) > SIGNIFICANT_T and abs(change - 1) > threshold
+        if not significant:
+            verdict = "not significant"
+        elif change > 1:
+            verdict = f"{change:.2f}x slower"
+        else:
+            verdict = f"{1 / change:.2f}x faster"
+        rows.append((name, f"{format_time(old['mean'])} -> {format_time(new['mean'])}: {verdict}",
+                     significant and change > 1))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compares two micro benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="smallest change that counts")
+    args = parser.parse_args()
+
+    with open(args.before) as file:
+        before = json.load(file)
+    with open(args.after) as file:
+        after = json.load(file)
+
+    rows = compare(before, after, args.threshold)
+    for name, description, _ in rows:
+        print(f"{name:<32} {description}")
+    if any(slower for _, _, slower in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Concurrency Benchmarks
+----------------------
+
+Measures how many sign ups a single process can serve while Gmail is slow,
+served as WSGI (gunicorn --threads) and as ASGI (asgi.py)
+
+Usage:
+    python -m benchmarks.concurrency --snapshot cache/dataset-1.db [--threads 8] [--asgi-threads 64] [--latency 0.3]
+
+Gmail is replaced by a stub transport that answers after --latency seconds.
+sign_up is an async view in both modes, and awaits its email before answering.
+WSGI: --threads request threads send sign ups for --duration seconds, each
+waits for its request, so throughput is at most threads / latency (before).
+ASGI: --asgi-threads clients send sign ups through the ASGI app in-process
+(as an ASGI server would, with ASGI_THREADS = --asgi-threads), the emails of
+all of them are awaited on the process' event loop (after).
+"""
+import argparse
+import asyncio
+import io
+import itertools
+import statistics
+import sys
+import threading
+import time
+from contextlib import redirect_stdout
+from typing import Iterator
+from benchmarks.routes import CSRF_TOKEN, load_app
+
+DEFAULT_THREADS = 8
+DEFAULT_ASGI_THREADS = 64
+DEFAULT_LATENCY = 0.3  # Seconds Gmail takes to send an email
+DEFAULT_DURATION = 5  # Seconds each mode is run for
+
+
+class _StubGmail:
+    """ httpx transport handler standing in for the Gmail API, sending takes latency seconds """
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.sent = 0
+
+    async def __call__(self, request):
+        import httpx
+
+        await asyncio.sleep(self.latency)
+        self.sent += 1  # Only called on the event loop
+        return httpx.Response(200, json=dict(id=str(self.sent)))
+
+
+def _sign_up_data(n: int, token: str) -> dict:
+    return dict(username=f"bench_{n}", email=f"bench_{n}@example.com",
+                password="Benchmark1!", confirm="Benchmark1!", csrf_token=token)
+
+
+def _result(latencies: list[float], errors: int, elapsed: float) -> dict:
+    latencies.sort()
+    return dict(requests=len(latencies), errors=errors, seconds=elapsed, rps=len(latencies) / elapsed,
+                p50_ms=statistics.median(latencies) * 1000 if latencies else 0,
+                p95_ms=latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0)
+
+
+def run_wsgi(app, threads: int, duration: float, usernames: Iterator) -> dict:
+    """ Sends sign ups from threads for duration seconds, returns throughput and latency """
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker() -> None:
+        client = app.test_client()
+        token = CSRF_TOKEN.search(client.get("/user/sign-up").data).group(1).decode()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = client.post("/user/sign-up", data=_sign_up_data(next(usernames), token))
+            elapsed = time.perf_counter() - start
+            with lock:
+                (latencies if response.status_code == 302 else errors).append(elapsed)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return _result(latencies, len(errors), time.perf_counter() - start)
+
+
+async def run_asgi(app, clients: int, duration: float, usernames: Iterator) -> dict:
+    """ Sends sign ups from clients through the ASGI app for duration seconds, returns throughput and latency """
+    import httpx
+    from asgi import ThreadPerRequest
+
+    transport = httpx.ASGITransport(app=ThreadPerRequest(app, clients))
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+
+    async def worker() -> None:
+        # Over https, as the session cookie is secure (and the Referer is then checked with the CSRF token)
+        async with httpx.AsyncClient(transport=transport, base_url="https://localhost",
+                                     headers={"Referer": "https://localhost/user/sign-up"}) as client:
+            token = CSRF_TOKEN.search((await client.get("/user/sign-up")).content).group(1).decode()
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.post("/user/sign-up", data=_sign_up_data(next(usernames), token))
+                elapsed = time.perf_counter() - start
+                (latencies if response.status_code == 302 else errors).append(elapsed)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return _result(latencies, len(errors), time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures sign ups per second of one process with slow Gmail")
+    parser.add_argument("--snapshot", default="database.db", help="database copied before running")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="request threads of the WSGI process")
+    parser.add_argument("--asgi-threads", type=int, default=DEFAULT_ASGI_THREADS, help="requests run at once as ASGI")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="seconds Gmail takes per email")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds each mode is run for")
+    args = parser.parse_args()
+
+    import httpx
+
+    _, app = load_app(args.snapshot, count_sql=False)
+    app.config["TESTING"] = True  # Skips reCAPTCHA
+
+    gmail = _StubGmail(args.latency)
+    email_module = sys.modules["google_authenticator.google_email_send"]
+    email_module.get_access_token = lambda: "benchmark"
+    email_module._transport = httpx.MockTransport(gmail)
+
+    usernames = itertools.count()
+    results = {}
+    with redirect_stdout(io.StringIO()):  # Sign up prints every OTP and every message id
+        for mode, run_mode in ((f"wsgi x{args.threads}", lambda: run_wsgi(app, args.threads, args.duration, usernames)),
+                               (f"asgi x{args.asgi_threads}",
+                                lambda: asyncio.run(run_asgi(app, args.asgi_threads, args.duration, usernames)))):
+            sent = gmail.sent
+            result = results[mode] = run_mode()
+            result["emails_per_s"] = (gmail.sent - sent) / result["seconds"]
+
+    print(f"Gmail takes {args.latency * 1000:.0f} ms per email")
+    for mode, result in results.items():
+        print(f"{mode:<12} {result['rps']:>8.1f} req/s  {result['emails_per_s']:>6.1f} emails/s  "
+              f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  errors {result['errors']}")
+
+
+if __name__ == "__main__":
+    main()
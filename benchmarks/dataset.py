@@ -0,0 +1,260 @@
+"""
+Synthetic Dataset
+-----------------
+
+Generates a large, seeded dataset for load tests and benchmarks
+
+Usage:
+    python -m benchmarks.dataset [--seed 1] [--customers 100000] [--books 20000] ...
+    python -m benchmarks.dataset --restore cache/dataset-1.db
+
+The database is built from schema.sql into a snapshot file (with a .json
+manifest holding the seed, sizes and sha256) so every benchmark run can start
+from the same copy. The same seed and sizes always give the same rows,
+but emails are Fernet encrypted with a random IV, so share the snapshot file
+(not only the seed) when results must be compared byte for byte.
+
+Book popularity follows a power law (a few best sellers, a long tail), which
+drives orders, reviews and carts. All generated users share GENERATED_PASSWORD.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sqlite3
+import uuid
+from contextlib import closing
+from datetime import datetime, timedelta
+from itertools import accumulate, islice
+from typing import Iterable, Iterator
+from argon2 import PasswordHasher
+from encrypt import crypto
+from models import BOOK_IMG_UPLOAD_FOLDER
+import db_fetch as dbf
+
+GENERATED_PASSWORD = "Generated123!"
+BATCH_SIZE = 10000  # Rows per executemany
+END_DATE = datetime(2022, 8, 31)  # Orders and reviews are dated before this (fixed for determinism)
+DEFAULT_SIZES = dict(customers=100000, staff=20, books=20000, orders=200000, reviews=300000, carts=20000)
+MAX_REPEATED_DRAWS = 100000  # Reviews stop early after this many draws in a row found no new (book, customer) pair
+
+LANGUAGES = ("English", "English", "English", "Chinese", "Malay", "Tamil")  # Weighted towards English
+GENRES = ("Action & Adventure", "Classic", "Comic", "Detective & Mystery")
+STATUSES = ("Ordered", "Confirmed", "Shipped", "Delivered", "Cancelled")
+STATUS_WEIGHTS = (10, 10, 15, 60, 5)
+WORDS = ("shadow", "river", "python", "garden", "secret", "empire", "winter", "code", "island", "letters",
+         "midnight", "stars", "kingdom", "machine", "journey", "silent", "crown", "ocean", "fire", "glass")
+
+
+class Generator:
+    """ Generates rows from one seeded random number generator """
+
+    def __init__(self, seed: int, sizes: dict[str, int], days: int=365) -> None:
+        self.random = random.Random(seed)
+        self.sizes = sizes
+        self.days = days
+        self.covers = sorted(name for name in os.listdir(BOOK_IMG_UPLOAD_FOLDER[1:])
+                             if name.rsplit(".", 1)[-1].lower() in ("jpg", "jpeg", "png"))
+
+        # Same salt every run, so the hash is the same too
+        self.password = PasswordHasher().hash(GENERATED_PASSWORD, salt=seed.to_bytes(16, "big"))
+
+        self.customer_ids = [self.uuid() for _ in range(sizes["customers"])]
+        self.book_ids = [self.uuid() for _ in range(sizes["books"])]
+
+        # Power law popularity (rank r is picked with weight 1 / r^1.1), ranks are shuffled over books
+        ranks = list(range(1, len(self.book_ids) + 1))
+        self.random.shuffle(ranks)
+        self.book_weights = list(accumulate(1 / rank ** 1.1 for rank in ranks))
+
+        # Customer activity also follows a power law (most customers order rarely)
+        self.customer_weights = list(accumulate(1 / rank ** 0.8 for rank in range(1, len(self.customer_ids) + 1)))
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.random.getrandbits(128), version=4))
+
+    def popular_books(self, k: int) -> list[str]:
+        return self.random.choices(self.book_ids, cum_weights=self.book_weights, k=k)
+
+    def active_customer(self) -> str:
+        return self.random.choices(self.customer_ids, cum_weights=self.customer_weights)[0]
+
+    def timestamp(self) -> str:
+        seconds = self.random.randrange(self.days * 86400)
+        return (END_DATE - timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+
+    def sentence(self, words: int) -> str:
+        return " ".join(self.random.choices(WORDS, k=words)).capitalize() + "."
+
+    def users(self) -> Iterator[tuple]:
+        # Emails are encrypted like sign_up() does
+        for i, user_id in enumerate(self.customer_ids):
+            yield user_id, f"customer{i}", crypto.encrypt(f"customer{i}@example.com"), self.password, None, "customer"
+        for i in range(self.sizes["staff"]):
+            yield self.uuid(), f"staff{i}", crypto.encrypt(f"staff{i}@example.com"), self.password, None, "staff"
+
+    def customers(self) -> Iterator[tuple]:
+        for i, user_id in enumerate(self.customer_ids):
+            yield user_id, f"Customer {i}", None, f"{self.random.randrange(1, 999)} {self.random.choice(WORDS).title()} Road", \
+                self.random.randrange(80000000, 99999999)
+
+    def books(self) -> Iterator[tuple]:
+        for book_id in self.book_ids:
+            title = " ".join(self.random.choices(WORDS, k=self.random.randint(1, 4))).title()
+            yield (book_id, self.random.choice(LANGUAGES), self.random.choice(GENRES), title,
+                   self.random.randrange(0, 200), self.random.randrange(5, 80),
+                   f"{self.random.choice(WORDS).title()} {self.random.choice(WORDS).title()}",
+                   self.sentence(self.random.randint(10, 40)), self.random.choice(self.covers))
+
+    def orders(self) -> Iterator[tuple[tuple, list[tuple]]]:
+        """ Yields (order details, order items), orders have 1 to 6 distinct books """
+        for _ in range(self.sizes["orders"]):
+            order_id = self.uuid()
+            details = (order_id, self.active_customer(), self.timestamp(), "Standard Delivery",
+                       self.random.choices(STATUSES, STATUS_WEIGHTS)[0])
+            books = dict.fromkeys(self.popular_books(min(6, 1 + int(self.random.expovariate(0.9)))))
+            yield details, [(order_id, book_id, self.random.choice((1, 1, 1, 2, 3))) for book_id in books]
+
+    def reviews(self) -> Iterator[tuple]:
+        """
+        Yields reviews, at most one per customer per book (long tail follows popularity)
+        Stops early if the popular pairs are used up (see MAX_REPEATED_DRAWS), so fewer may be yielded
+        """
+        reviewed = set()
+        repeated = 0
+        while len(reviewed) < self.sizes["reviews"]:
+            for book_id in self.popular_books(BATCH_SIZE):
+                user_id = self.active_customer()
+                if (book_id, user_id) in reviewed:
+                    repeated += 1
+                    if repeated >= MAX_REPEATED_DRAWS:
+                        return
+                    continue
+                repeated = 0
+                reviewed.add((book_id, user_id))
+                yield book_id, user_id, self.random.choices((1, 2, 3, 4, 5), (5, 5, 15, 35, 40))[0], \
+                    self.timestamp(), self.sentence(self.random.randint(3, 60))
+                if len(reviewed) == self.sizes["reviews"]:
+                    return
+
+    def cart_items(self) -> Iterator[tuple]:
+        for user_id in self.random.sample(self.customer_ids, min(self.sizes["carts"], len(self.customer_ids))):
+            for book_id in dict.fromkeys(self.popular_books(self.random.randint(1, 4))):
+                yield user_id, book_id, self.random.randint(1, 3)
+
+
+def _insert(connection: sqlite3.Connection, query: str, rows: Iterable[tuple]) -> int:
+    """ Inserts rows in BATCH_SIZE transactions, returns number of rows inserted """
+    rows, count = iter(rows), 0
+    while batch := list(islice(rows, BATCH_SIZE)):
+        with connection:
+            connection.executemany(query, batch)
+        count += len(batch)
+    return count
+
+
+def check_sizes(sizes: dict[str, int], days: int) -> None:
+    """ Raises ValueError if the dataset cannot be generated with these sizes """
+    if any(size < 0 for size in sizes.values()):
+        raise ValueError("Sizes cannot be negative")
+    if sizes["customers"] < 1 or sizes["books"] < 1:
+        raise ValueError("Must have at least one customer and one book")
+    if days < 1:
+        raise ValueError("Must have at least one day of history")
+
+    # At most one review per customer per book
+    if sizes["reviews"] > sizes["customers"] * sizes["books"]:
+        raise ValueError(f"Cannot have more reviews than customers * books ({sizes['customers'] * sizes['books']})")
+
+
+def generate(path: str, seed: int, sizes: dict[str, int], days: int=365) -> dict:
+    """ Builds the dataset into a new snapshot file, returns its manifest """
+    check_sizes(sizes, days)
+    generator = Generator(seed, sizes, days)
+    building = f"{path}.building"
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if os.path.exists(building):
+        os.remove(building)
+
+    counts = {}
+    with closing(sqlite3.connect(building)) as connection:
+        for pragma in dbf.BULK_LOAD_PRAGMAS:
+            connection.execute(pragma)
+        with open("schema.sql", encoding="UTF-8") as file:
+            connection.executescript(file.read())
+
+        counts["Users"] = _insert(connection, "INSERT INTO Users VALUES (?, ?, ?, ?, ?, ?);", generator.users())
+        counts["Customers"] = _insert(connection, "INSERT INTO Customers VALUES (?, ?, ?, ?, ?);", generator.customers())
+        counts["Books"] = _insert(connection, "INSERT INTO Books VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);", generator.books())
+
+        # Order items are generated with their orders, then inserted in the same batches
+        counts["OrderDetails"] = counts["OrderItems"] = 0
+        orders = generator.orders()
+        while batch := list(islice(orders, BATCH_SIZE)):
+            with connection:
+                connection.executemany("INSERT INTO OrderDetails VALUES (?, ?, ?, ?, ?);", (details for details, _ in batch))
+                items = [item for _, order_items in batch for item in order_items]
+                connection.executemany("INSERT INTO OrderItems VALUES (?, ?, ?);", items)
+            counts["OrderDetails"] += len(batch)
+            counts["OrderItems"] += len(items)
+
+        counts["Reviews"] = _insert(connection, "INSERT INTO Reviews VALUES (?, ?, ?, ?, ?);", generator.reviews())
+        counts["CartItems"] = _insert(connection, "INSERT INTO CartItems VALUES (?, ?, ?);", generator.cart_items())
+
+        # Planner statistics, so query plans match a long running database
+        connection.execute("ANALYZE;")
+
+    os.replace(building, path)
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    manifest = dict(seed=seed, days=days, end_date=END_DATE.isoformat(), sizes=sizes, rows=counts,
+                    sha256=digest.hexdigest())
+    with open(f"{path}.json", "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def restore_snapshot(path: str, database: str=dbf.DATABASE) -> None:
+    """ Replaces database with a copy of the snapshot (and drops its WAL files) """
+    shutil.copyfile(path, f"{database}.restoring")
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    os.replace(f"{database}.restoring", database)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generates a seeded synthetic dataset snapshot")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--days", type=int, default=365, help="days of order and review history")
+    for table, size in DEFAULT_SIZES.items():
+        parser.add_argument(f"--{table}", type=int, default=size, help=f"number of {table} (default: {size})")
+    parser.add_argument("--output", help="snapshot file (default: cache/dataset-<seed>.db)")
+    parser.add_argument("--restore", metavar="SNAPSHOT", help=f"copy a snapshot over {dbf.DATABASE} instead")
+    args = parser.parse_args()
+
+    if args.restore:
+        restore_snapshot(args.restore)
+        print(f"\033[0;31mRestored {args.restore} to {dbf.DATABASE}!\033[0m")
+        return
+
+    sizes = {table: getattr(args, table) for table in DEFAULT_SIZES}
+    try:
+        check_sizes(sizes, args.days)
+    except ValueError as error:
+        parser.error(str(error))
+
+    output = args.output or f"cache/dataset-{args.seed}.db"
+    manifest = generate(output, args.seed, sizes, args.days)
+    for table, count in manifest["rows"].items():
+        print(f"{table}: {count}")
+    print(f"\033[0;31mSnapshot written to {output}!\033[0m")
+
+
+if __name__ == "__main__":
+    main()
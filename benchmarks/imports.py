@@ -0,0 +1,129 @@
+"""
+Import Time Benchmarks
+----------------------
+
+Measures how long a worker takes to import the app and run create_app(),
+using python -X importtime in fresh interpreters
+
+Usage:
+    python -m benchmarks.imports [--runs 5] [--top 15]
+    python -m benchmarks.imports --save-baseline cache/imports-baseline.json
+    python -m benchmarks.imports --baseline cache/imports-baseline.json --threshold 0.2
+
+Fails (exit code 1) if a DEFERRED module is imported at startup, or with
+--baseline, if import or create_app() time grew by more than the threshold.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from benchmarks.routes import WORKDIR
+
+DEFAULT_RUNS = 5
+DEFAULT_THRESHOLD = 0.2  # 20% slower is a regression
+
+# Slow to import and only needed by a few routes, these must be imported where they are used
+DEFERRED = ("stripe", "PIL.Image", "pyotp", "jsonschema", "flask_expects_json", "googleapiclient.discovery",
+            "google_auth_oauthlib", "boto3")
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Run in a fresh interpreter, prints deferred modules that were imported and create_app() time
+_STARTUP = f"""
+import importlib.util, json, sys, time
+spec = importlib.util.spec_from_file_location("app", "__init__.py")
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+start = time.perf_counter()
+module.create_app()
+create_app = time.perf_counter() - start
+print(json.dumps(dict(create_app_s=create_app, deferred=[name for name in {DEFERRED!r} if name in sys.modules])))
+"""
+
+
+def startup(snapshot: str) -> tuple[dict[str, int], dict]:
+    """ Starts a fresh interpreter, returns (cumulative microseconds of top-level imports, its output) """
+    os.makedirs(WORKDIR, exist_ok=True)
+    database = os.path.join(WORKDIR, "database.db")
+    shutil.copyfile(snapshot, database)
+
+    env = dict(os.environ, DATABASE_PATH=database)
+    env.setdefault("VERY_SECRET_KEY", "benchmark")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", _STARTUP],
+                             capture_output=True, text=True, env=env, check=True)
+
+    # Only top-level imports (nested ones are included in their cumulative time)
+    imports = {}
+    for line in process.stderr.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match and len(match.group(3)) == 1 and match.group(4) != "site":  # site is interpreter startup
+            imports[match.group(4)] = int(match.group(2))
+    return imports, json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def run(snapshot: str, runs: int=DEFAULT_RUNS, top: int=15) -> dict:
+    """ Returns median import times over runs """
+    totals, create_app, deferred = [], [], set()
+    modules = defaultdict(list)
+    for _ in range(runs):
+        imports, output = startup(snapshot)
+        totals.append(sum(imports.values()) / 1000)
+        create_app.append(output["create_app_s"] * 1000)
+        deferred.update(output["deferred"])
+        for name, microseconds in imports.items():
+            modules[name].append(microseconds / 1000)
+
+    slowest = sorted(((statistics.median(times), name) for name, times in modules.items()), reverse=True)[:top]
+    return dict(runs=runs, import_ms=statistics.median(totals), create_app_ms=statistics.median(create_app),
+                deferred_imported=sorted(deferred), slowest={name: ms for ms, name in slowest})
+
+
+def compare(results: dict, baseline: dict, threshold: float=DEFAULT_THRESHOLD) -> list[str]:
+    """ Returns regressions of results against baseline """
+    regressions = [f"{name} imported at startup" for name in results["deferred_imported"]]
+    for metric in ("import_ms", "create_app_ms"):
+        if baseline and baseline[metric] and results[metric] > baseline[metric] * (1 + threshold):
+            regressions.append(f"{metric} {baseline[metric]:.1f} -> {results[metric]:.1f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measures app import and create_app() time")
+    parser.add_argument("--snapshot", default="database.db", help="database copied for create_app()")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="fresh interpreters started")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports listed")
+    parser.add_argument("--output", help="write results as json")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run(args.snapshot, args.runs, args.top)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    for name, ms in results["slowest"].items():
+        print(f"{name:<40} {ms:>8.1f} ms")
+    print(f"Imports {results['import_ms']:.1f} ms, create_app() {results['create_app_ms']:.1f} ms "
+          f"(median of {results['runs']} runs)")
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(f"\033[0;31mRegression {regression}\033[0m")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Micro Benchmarks
+----------------
+
+Times hot primitives in isolation (pyperf style: calibrated loops,
+warmup, many samples) and writes the results as json
+
+Usage:
+    python -m benchmarks.micro [--snapshot database.db] [--output cache/micro.json] [--filter session] [--fast]
+    python -m benchmarks.compare cache/micro-before.json cache/micro-after.json
+
+Database benchmarks run on a copy of the snapshot (the repo database by default).
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, ContextManager
+from benchmarks.routes import load_app
+
+DEFAULT_SAMPLES = 20
+DEFAULT_MIN_TIME = 0.1  # Seconds each sample should take at least (loops are calibrated to this)
+
+
+@dataclass
+class Benchmark:
+    """ A function timed in a loop, context is entered around every sample """
+    name: str
+    func: Callable[[], Any]
+    context: Callable[[], ContextManager] = contextlib.nullcontext
+
+    samples: list[float] = field(default_factory=list)  # Seconds per call
+    loops: int = 1
+
+    def _sample(self, loops: int) -> float:
+        func = self.func
+        with self.context():
+            start = time.perf_counter()
+            for _ in range(loops):
+                func()
+            return time.perf_counter() - start
+
+    def run(self, samples: int=DEFAULT_SAMPLES, min_time: float=DEFAULT_MIN_TIME, warmups: int=1) -> None:
+        # Calibrate number of loops so timer resolution does not matter
+        loops = 1
+        while (elapsed := self._sample(loops)) < min_time and loops < 1 << 24:
+            loops *= max(2, min(10, int(min_time / max(elapsed, 1e-9)) + 1))
+        self.loops = loops
+
+        for _ in range(warmups):
+            self._sample(loops)
+        self.samples = [self._sample(loops) / loops for _ in range(samples)]
+
+    def result(self) -> dict:
+        return dict(loops=self.loops,
+                    samples=self.samples,
+                    mean=statistics.fmean(self.samples),
+                    stdev=statistics.stdev(self.samples) if len(self.samples) > 1 else 0.0,
+                    median=statistics.median(self.samples),
+                    min=min(self.samples))
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+@contextlib.contextmanager
+def _without_execution(general):
+    """ Replaces execute_db so only query construction of retrieve_db is timed """
+    execute_db = general.execute_db
+    general.execute_db = lambda query, parameters=None, fetchone=False: None
+    try:
+        yield
+    finally:
+        general.execute_db = execute_db
+
+
+def benchmarks(app_module) -> list[Benchmark]:
+    """ Returns benchmarks of the primitives (imported after the app so the snapshot is used) """
+    import db_fetch as dbf
+    from db_fetch import general
+    from session_handler import create_session, retrieve_session, UserSession
+    from SecurityFunctions import pw_hash, pw_verify
+    from encrypt import aws_encrypt, aws_decrypt
+    from models import Book, User
+
+    book_row = dbf.retrieve_inventory()[0]
+    book_id = book_row[0]
+    user_row = dbf.execute_db("SELECT * FROM Users LIMIT 1;", (), fetchone=True)
+    session = create_session(UserSession(user_row[0], user_row[5])).decode()
+    hashed = pw_hash("Benchmark123!")
+    ciphertext = aws_encrypt("customer@example.com")
+    books = {row[0]: Book(*row) for row in dbf.retrieve_inventory()}
+
+    # Sort helpers print their intermediate dicts
+    quiet = lambda: contextlib.redirect_stdout(io.StringIO())
+
+    return [
+        Benchmark("db.retrieve_db.build_query", lambda: general.retrieve_db("Books", ("title", "price"), 1, 10, 5, book_id=book_id, language="English"),
+                  lambda: _without_execution(general)),
+        Benchmark("db.execute_db.select_1", lambda: dbf.execute_db("SELECT 1;", ())),
+        Benchmark("db.retrieve_db.book_by_id", lambda: dbf.retrieve_book(book_id)),
+        Benchmark("db.retrieve_db.inventory", dbf.retrieve_inventory),
+        Benchmark("db.retrieve_reviews", lambda: dbf.retrieve_reviews(book_id)),
+        Benchmark("session.create_session", lambda: create_session(UserSession(user_row[0], user_row[5]))),
+        Benchmark("session.retrieve_session", lambda: retrieve_session(session)),
+        Benchmark("security.pw_hash", lambda: pw_hash("Benchmark123!")),
+        Benchmark("security.pw_verify", lambda: pw_verify(hashed, "Benchmark123!")),
+        Benchmark("crypto.aws_encrypt", lambda: aws_encrypt("customer@example.com")),
+        Benchmark("crypto.aws_decrypt", lambda: aws_decrypt(ciphertext)),
+        Benchmark("models.Book", lambda: Book(*book_row)),
+        Benchmark("models.User", lambda: User(*user_row)),
+        Benchmark("books.name_a_to_z", lambda: app_module.name_a_to_z(books), quiet),
+        Benchmark("books.name_z_to_a", lambda: app_module.name_z_to_a(books), quiet),
+        Benchmark("books.price_low_to_high", lambda: app_module.price_low_to_high(books), quiet),
+        Benchmark("books.price_high_to_low", lambda: app_module.price_high_to_low(books), quiet),
+    ]
+
+
+def run(snapshot: str, pattern: str=None, samples: int=DEFAULT_SAMPLES, min_time: float=DEFAULT_MIN_TIME) -> dict:
+    """ Runs benchmarks matching pattern, returns results with metadata """
+    app_module, _ = load_app(snapshot, count_sql=False)
+    results = {}
+    for benchmark in benchmarks(app_module):
+        if pattern and not re.search(pattern, benchmark.name):
+            continue
+        benchmark.run(samples, min_time)
+        results[benchmark.name] = benchmark.result()
+        print(f"{benchmark.name:<32} {format_time(results[benchmark.name]['mean']):>10} "
+              f"+- {format_time(results[benchmark.name]['stdev']):>10}")
+
+    metadata = dict(python=platform.python_version(),
+                    platform=platform.platform(),
+                    cpu_count=os.cpu_count(),
+                    date=datetime.now().isoformat(timespec="seconds"),
+                    snapshot=snapshot,
+                    samples=samples,
+                    min_time=min_time)
+    return dict(metadata=metadata, benchmarks=results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs micro benchmarks of hot primitives")
+    parser.add_argument("--snapshot", default="database.db", help="database copied for db benchmarks")
+    parser.add_argument("--filter", help="only run benchmarks whose name matches this regex")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME, help="seconds per sample")
+    parser.add_argument("--fast", action="store_true", help="fewer, shorter samples (less precise)")
+    parser.add_argument("--output", help="write results as json")
+    args = parser.parse_args()
+
+    if args.fast:
+        args.samples, args.min_time = min(args.samples, 5), min(args.min_time, 0.02)
+    results = run(args.snapshot, args.filter, args.samples, args.min_time)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
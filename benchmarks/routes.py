@@ -0,0 +1,293 @@
+"""
+Route Benchmarks
+----------------
+
+Drives the app in-process with the Flask test client through realistic scenarios
+and reports latency percentiles, throughput and SQL statements per route
+
+Usage:
+    python -m benchmarks.routes --snapshot cache/dataset-1.db [--iterations 200]
+    python -m benchmarks.routes --snapshot cache/dataset-1.db --save-baseline cache/bench-baseline.json
+    python -m benchmarks.routes --snapshot cache/dataset-1.db --baseline cache/bench-baseline.json --threshold 0.2
+
+Every run works on a fresh copy of the snapshot (see benchmarks.dataset), so
+scenarios that write (carts and orders) start from the same data each time.
+With --baseline, the run fails (exit code 1) if any route's p95 latency or
+SQL statements per request grew by more than the threshold.
+Checkouts go through the Stripe stub (STRIPE_STUB), so no requests reach Stripe.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import statistics
+import sys
+import contextvars
+import time
+from collections import defaultdict
+from typing import Callable
+from urllib.parse import urlsplit
+
+WORKDIR = "cache/bench"
+DEFAULT_ITERATIONS = 200
+DEFAULT_THRESHOLD = 0.2  # 20% slower (or more queries) is a regression
+CSRF_TOKEN = re.compile(rb'name="csrf_token" value="([^"]+)"')
+_SQL_STATEMENT = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE|WITH)\b", re.IGNORECASE)
+
+# SQL statements run for the current request, a counter shared with the threads
+# (asyncio.to_thread) and event loop tasks of async views, which copy the context
+_sql = contextvars.ContextVar("sql_statements", default=None)
+
+
+def _count_statement(statement: str) -> None:
+    """ sqlite3 trace callback (statements run by triggers are not counted) """
+    if _SQL_STATEMENT.match(statement):
+        counter = _sql.get()
+        if counter is not None:
+            counter[0] += 1
+
+
+def _install_sql_counter() -> None:
+    """ Wraps sqlite3.connect so every connection the app opens is traced """
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        connection = connect(*args, **kwargs)
+        connection.set_trace_callback(_count_statement)
+        return connection
+
+    sqlite3.connect = traced_connect
+
+
+def load_app(snapshot: str, count_sql: bool=True):
+    """ Copies the snapshot into WORKDIR and creates the app on top of it, returns the app module and app """
+    os.makedirs(WORKDIR, exist_ok=True)
+    database = os.path.join(WORKDIR, "database.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    shutil.copyfile(snapshot, database)
+
+    # Must be set before db_fetch is imported
+    os.environ["DATABASE_PATH"] = database
+    os.environ.setdefault("VERY_SECRET_KEY", "benchmark")
+    if count_sql:
+        _install_sql_counter()
+
+    spec = importlib.util.spec_from_file_location("app", "__init__.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    # Benchmarks would otherwise be measuring 429 responses (and Stripe's API)
+    return module, module.create_app(dict(RATELIMIT_ENABLED=False, STRIPE_STUB=True))
+
+
+class Recorder:
+    """ Records latency and SQL statements of each request by route """
+
+    def __init__(self) -> None:
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def request(self, client, route: str, method: str, path: str, expected=(200, 302), **kwargs):
+        counter = [0]
+        _sql.set(counter)
+        start = time.perf_counter()
+        response = client.open(path, method=method, **kwargs)
+        elapsed = time.perf_counter() - start
+
+        if self.recording:
+            self.latencies[route].append(elapsed)
+            self.queries[route].append(counter[0])
+            if response.status_code not in expected:
+                self.errors[route] += 1
+        return response
+
+
+class Context:
+    """ Ids and search words picked (with a fixed seed) from the snapshot """
+
+    def __init__(self, database: str, seed: int=0) -> None:
+        self.random = random.Random(seed)
+        connection = sqlite3.connect(database)
+        try:
+            self.book_ids = [row[0] for row in connection.execute("SELECT book_id FROM Books ORDER BY book_id LIMIT 1000;")]
+            self.words = sorted({word for title, in connection.execute("SELECT title FROM Books LIMIT 1000;")
+                                 for word in title.split()})
+            self.customer_id = connection.execute(
+                "SELECT user_id FROM Users WHERE role = 'customer' ORDER BY user_id LIMIT 1;").fetchone()[0]
+            self.staff_id = connection.execute(
+                "SELECT user_id FROM Users WHERE role = 'staff' ORDER BY user_id LIMIT 1;").fetchone()[0]
+        finally:
+            connection.close()
+
+    def book(self) -> str:
+        return self.random.choice(self.book_ids)
+
+    def word(self) -> str:
+        return self.random.choice(self.words)
+
+
+def login(client, user_id: str, role: str) -> None:
+    """ Logs client in by setting its session cookie """
+    from session_handler import create_user_session, USER_SESSION_NAME
+    client.set_cookie("localhost", USER_SESSION_NAME, create_user_session(user_id, role).decode())
+
+
+def browse(app, recorder: Recorder, context: Context) -> None:
+    """ Anonymous customer browsing the catalogue """
+    client = app.test_client()
+    book_id = context.book()
+    recorder.request(client, "GET /", "GET", "/")
+    recorder.request(client, "GET /books/latest?q=", "GET", f"/books/latest?q={context.word()}")
+    recorder.request(client, "GET /book/<id>", "GET", f"/book/{book_id}")
+    recorder.request(client, "GET /api/reviews/<id>", "GET", f"/api/reviews/{book_id}")
+
+
+def shop(app, recorder: Recorder, context: Context) -> None:
+    """ Logged in customer adding to cart, updating it and checking out """
+    client = app.test_client()
+    login(client, context.customer_id, "customer")
+
+    book_id = context.book()
+    page = recorder.request(client, "GET /book/<id> (customer)", "GET", f"/book/{book_id}")
+    token = CSRF_TOKEN.search(page.data).group(1).decode()
+
+    recorder.request(client, "POST /add-to-cart", "POST", "/add-to-cart",
+                     data=dict(book_id=book_id, quantity=1, csrf_token=token),
+                     headers={"Referer": f"/book/{book_id}"})
+    recorder.request(client, "POST /update-cart/<id>", "POST", f"/update-cart/{book_id}",
+                     data=dict(quantity=1, csrf_token=token))
+    recorder.request(client, "GET /cart", "GET", "/cart")
+    recorder.request(client, "POST /checkout", "POST", "/checkout", data=dict(csrf_token=token))
+    checkout = recorder.request(client, "POST /create-checkout-session", "POST", "/create-checkout-session",
+                                data=dict(name="Benchmark", contact_num="91234567", email="benchmark@example.com",
+                                          address="1 Benchmark Road", csrf_token=token),
+                                headers={"Referer": "/checkout"}, expected=(302,))
+
+    # The stub redirects straight to the success url (back to /cart if the book ran out of stock)
+    confirm_path = urlsplit(checkout.location).path
+    if confirm_path.startswith("/order-confirm/"):
+        recorder.request(client, "GET /order-confirm/<id>", "GET", confirm_path)
+
+    # Emptied again (as the webhook would after paying), so every run checks out a one book cart
+    client.post(f"/update-cart/{book_id}", data=dict(quantity=0, csrf_token=token))
+
+
+def staff(app, recorder: Recorder, context: Context) -> None:
+    """ Staff checking dashboards """
+    client = app.test_client()
+    login(client, context.staff_id, "staff")
+    recorder.request(client, "GET /admin/dashboard (staff)", "GET", "/admin/dashboard")
+    recorder.request(client, "GET /api/admin/analytics", "GET", "/api/admin/analytics")
+
+
+SCENARIOS: dict[str, Callable] = dict(browse=browse, shop=shop, staff=staff)
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """ Nearest rank percentile """
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))]
+
+
+def run(snapshot: str, iterations: int=DEFAULT_ITERATIONS, warmup: int=10, scenarios=tuple(SCENARIOS)) -> dict:
+    """ Runs scenarios round robin, returns results by route """
+    _, app = load_app(snapshot)
+    context = Context(os.environ["DATABASE_PATH"])
+    recorder = Recorder()
+
+    for _ in range(warmup):
+        for name in scenarios:
+            SCENARIOS[name](app, recorder, context)
+
+    recorder.recording = True
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for name in scenarios:
+            SCENARIOS[name](app, recorder, context)
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route, latencies in recorder.latencies.items():
+        routes[route] = dict(
+            requests=len(latencies),
+            errors=recorder.errors[route],
+            p50_ms=percentile(latencies, 50) * 1000,
+            p95_ms=percentile(latencies, 95) * 1000,
+            p99_ms=percentile(latencies, 99) * 1000,
+            mean_ms=statistics.fmean(latencies) * 1000,
+            throughput_rps=len(latencies) / sum(latencies),
+            sql_per_request=statistics.fmean(recorder.queries[route]),
+        )
+    total = sum(route["requests"] for route in routes.values())
+    return dict(snapshot=snapshot, iterations=iterations, elapsed_s=elapsed,
+                throughput_rps=total / elapsed, routes=routes)
+
+
+def compare(results: dict, baseline: dict, threshold: float=DEFAULT_THRESHOLD) -> list[str]:
+    """ Returns regressions of results against baseline """
+    regressions = []
+    for route, current in results["routes"].items():
+        previous = baseline["routes"].get(route)
+        if previous is None:
+            continue
+        for metric in ("p95_ms", "sql_per_request"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(f"{route}: {metric} {previous[metric]:.2f} -> {current[metric]:.2f}")
+    return regressions
+
+
+def report(results: dict, baseline: dict=None) -> None:
+    """ Prints results as a table (with change from baseline) """
+    print(f"{'route':<32} {'reqs':>5} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'sql':>6}")
+    for route, result in sorted(results["routes"].items()):
+        line = (f"{route:<32} {result['requests']:>5} {result['errors']:>4} {result['p50_ms']:>8.2f} "
+                f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['throughput_rps']:>8.1f} "
+                f"{result['sql_per_request']:>6.1f}")
+        previous = (baseline or {}).get("routes", {}).get(route)
+        if previous and previous["p95_ms"]:
+            line += f"  p95 {(result['p95_ms'] / previous['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+    print(f"Total {results['throughput_rps']:.1f} req/s over {results['elapsed_s']:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks app routes in-process against a dataset snapshot")
+    parser.add_argument("--snapshot", required=True, help="snapshot from python -m benchmarks.dataset")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS, help="runs of each scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="unrecorded runs of each scenario first")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (default: all)")
+    parser.add_argument("--output", help="write results as json")
+    parser.add_argument("--save-baseline", metavar="PATH", help="write results as the new baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = run(args.snapshot, args.iterations, args.warmup, args.scenario or tuple(SCENARIOS))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+    report(results, baseline)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"\033[0;31mRegression {regression}\033[0m")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
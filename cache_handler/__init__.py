@@ -0,0 +1,6 @@
+# File to allow imports
+from .catalogue import *
+from .memory_cache import *
+from .fragment_cache import *
+from .page_cache import *
+from .bytecode_cache import *
@@ -0,0 +1,55 @@
+"""
+Template Bytecode Cache
+-----------------------
+
+Keeps compiled templates on disk, so workers load them instead of compiling
+every template again after each restart
+
+Usage:
+    app.jinja_env.bytecode_cache = TemplateBytecodeCache("cache/templates")
+    precompile_templates(app.jinja_env)  # E.g. when deploying (see precompile_templates.py)
+
+A compiled template is used only while the hash of its source is unchanged and
+it was compiled by the same jinja version with the same extensions (python's
+version is checked by jinja itself), otherwise it is compiled and replaced.
+"""
+import os
+from hashlib import sha1
+from jinja2 import Environment, FileSystemBytecodeCache, __version__ as _JINJA_VERSION
+from jinja2.bccache import Bucket
+
+__all__ = ["TemplateBytecodeCache", "precompile_templates"]
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """ Jinja bytecode cache in directory (shared by all workers) """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory, "%s.jinja")
+
+    @staticmethod
+    def _fingerprint(environment: Environment) -> str:
+        """ Returns what compiled code depends on besides the source """
+        extensions = sorted(f"{type(extension).__module__}.{type(extension).__qualname__}"
+                            for extension in environment.extensions.values())
+        return ",".join([_JINJA_VERSION] + extensions)
+
+    def get_bucket(self, environment: Environment, name: str, filename: str, source: str) -> Bucket:
+        # Same as jinja's, but an outdated checksum also covers version and extensions
+        checksum = sha1(f"{self._fingerprint(environment)}\0{source}".encode("utf-8")).hexdigest()
+        bucket = Bucket(environment, self.get_cache_key(name, filename), checksum)
+        self.load_bytecode(bucket)
+        return bucket
+
+
+def precompile_templates(environment: Environment) -> tuple[int, dict[str, str]]:
+    """ Compiles every template of environment, returns (number compiled, {name: error} of the others) """
+    compiled, errors = 0, {}
+    for name in environment.list_templates():
+        try:
+            environment.get_template(name)
+            compiled += 1
+        except Exception as e:
+            errors[name] = str(e)
+    return compiled, errors
@@ -0,0 +1,68 @@
+"""
+Catalogue Version
+-----------------
+
+Stores a version number that is bumped whenever the book catalogue changes,
+cached pages and fragments are keyed on it so that every worker process
+drops stale entries as soon as any worker modifies the catalogue
+"""
+import os
+import time
+from threading import Lock
+
+__all__ = ["CATALOGUE_VERSION_FILE", "get_catalogue_version", "bump_catalogue_version"]
+
+# File shared by all workers on the host (contains a single integer)
+CATALOGUE_VERSION_FILE = r"cache/catalogue.version"
+
+_lock = Lock()
+_stat = None   # (mtime_ns, size) of version file when it was last read
+_version = 0   # Last version read from file
+
+
+def _read_version() -> int:
+    """ Reads version number from file (0 if missing or corrupted) """
+    try:
+        with open(CATALOGUE_VERSION_FILE) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def get_catalogue_version() -> int:
+    """ Returns the current catalogue version """
+    global _stat, _version
+
+    # Stat is much cheaper than reading, only reread file when it changed
+    try:
+        stat = os.stat(CATALOGUE_VERSION_FILE)
+        stat = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        stat = None
+
+    with _lock:
+        if stat != _stat:
+            _version = _read_version()
+            _stat = stat
+        return _version
+
+
+def bump_catalogue_version() -> int:
+    """ Increments and returns the catalogue version (invalidates cached catalogue pages) """
+    global _stat, _version
+
+    os.makedirs(os.path.dirname(CATALOGUE_VERSION_FILE), exist_ok=True)
+
+    with _lock:
+        # Nanosecond timestamp keeps versions unique even if two workers bump at once
+        version = max(_read_version() + 1, time.time_ns())
+
+        # Write to temp file then replace, so readers never see a half-written file
+        temp_file = f"{CATALOGUE_VERSION_FILE}.{os.getpid()}"
+        with open(temp_file, "w") as f:
+            f.write(str(version))
+        os.replace(temp_file, CATALOGUE_VERSION_FILE)
+
+        _version = version
+        _stat = None  # Force reread so mtime is picked up on next check
+        return version
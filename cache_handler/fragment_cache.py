@@ -0,0 +1,78 @@
+"""
+Fragment Cache
+--------------
+
+Jinja extension that caches rendered template fragments
+
+Usage:
+    {% cache "navbar", 300 %}
+        ...
+    {% endcache %}
+
+Key can be a string or a list of values (e.g. ["books-grid", sort_this, query]),
+ttl (seconds) is optional and defaults to no expiry. Every key is combined with
+the catalogue version, so fragments are rendered again once the catalogue changes.
+"""
+from typing import Any, Hashable
+from jinja2 import nodes
+from jinja2.ext import Extension
+from .catalogue import get_catalogue_version
+from .memory_cache import MemoryCache
+
+__all__ = ["FragmentCacheExtension"]
+
+
+def _make_hashable(key: Any) -> Hashable:
+    """ Converts lists (and nested lists) in key into tuples """
+    if isinstance(key, (list, tuple)):
+        return tuple(_make_hashable(i) for i in key)
+    return key
+
+
+class FragmentCacheExtension(Extension):
+    """ Adds the {% cache key, ttl %} tag to the jinja environment """
+
+    tags = {"cache"}
+
+    def __init__(self, environment) -> None:
+        super().__init__(environment)
+
+        # Attributes can be replaced after adding extension, e.g.
+        # app.jinja_env.fragment_cache = MemoryCache(1024)
+        environment.extend(
+            fragment_cache=MemoryCache(),
+            fragment_cache_enabled=True
+        )
+
+    def parse(self, parser):
+        # Line number of {% cache %} tag
+        lineno = next(parser.stream).lineno
+
+        # Cache key, followed by optional ttl
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(0))
+
+        # Everything until {% endcache %} is the fragment to be cached
+        body = parser.parse_statements(["name:endcache"], drop_needle=True)
+
+        return nodes.CallBlock(
+            self.call_method("_cache_support", args), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache_support(self, key, ttl, caller):
+        """ Returns cached fragment, renders and stores fragment if not cached """
+        environment = self.environment
+        if not environment.fragment_cache_enabled:
+            return caller()
+
+        key = (get_catalogue_version(), _make_hashable(key))
+        cache: MemoryCache = environment.fragment_cache
+
+        rv = cache.get(key)
+        if rv is None:
+            rv = caller()
+            cache.set(key, rv, int(ttl or 0))
+        return rv
@@ -0,0 +1,69 @@
+"""
+Memory Cache
+------------
+
+Size-bounded in-memory store shared by the fragment and page caches
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Hashable, Union
+from metrics import CACHE_REQUESTS
+
+__all__ = ["MemoryCache"]
+
+# Default number of entries kept in memory per worker
+_DEFAULT_MAX_SIZE = 512
+
+
+class MemoryCache:
+    """ Size-bounded in-memory LRU store with optional expiry per entry """
+
+    def __init__(self, max_size: int=_DEFAULT_MAX_SIZE, name: str=None) -> None:
+        if max_size < 1:
+            raise ValueError("Max size should be at least 1")
+        self.max_size = max_size
+        self.name = name  # Hits and misses are counted in metrics if named
+        self._data = OrderedDict()  # key: (expiry, value)
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Union[Any, None]:
+        """ Returns cached value, None if missing or expired """
+        value = self._get(key)
+        if self.name:
+            CACHE_REQUESTS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def _get(self, key: Hashable) -> Union[Any, None]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            expiry, value = entry
+            if expiry is not None and expiry <= monotonic():
+                del self._data[key]
+                return None
+
+            # Mark as recently used
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: int=0) -> None:
+        """ Stores value (ttl of 0 means no expiry) """
+        expiry = monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expiry, value)
+            self._data.move_to_end(key)
+
+            # Evict least recently used entries
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """ Removes all entries """
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,148 @@
+"""
+Page Cache
+----------
+
+Caches whole pages served to anonymous visitors
+
+Usage:
+    page_cache = PageCache(app, user_cookie=USER_SESSION_NAME)
+
+    @app.route("/about")
+    @page_cache.cached(ttl=300)
+    def about():
+        ...
+
+Cached pages are served from a before_request hook (so no session decoding,
+database queries or rendering happens on a hit). Only GET requests without
+a user session cookie or pending flash messages are cached. The csrf token is
+replaced with a placeholder before storing and injected again when served.
+"""
+from dataclasses import dataclass
+from functools import wraps
+from typing import Union
+from flask import Flask, request, session, make_response, g as flask_global
+from flask_wtf.csrf import generate_csrf
+from .catalogue import get_catalogue_version
+from .memory_cache import MemoryCache
+
+__all__ = ["PageCache"]
+
+# Stored in cached body in place of the csrf token of the request that rendered it
+_CSRF_PLACEHOLDER = b"__PAGE_CACHE_CSRF_TOKEN__"
+
+# Role used for keys of anonymous visitors
+_GUEST_ROLE = "guest"
+
+# Attribute set on view functions that can be cached
+_TTL_ATTRIBUTE = "page_cache_ttl"
+
+
+@dataclass
+class _CachedPage:
+    """ Response stored in page cache """
+    body: bytes
+    status: int
+    mimetype: str
+    has_csrf: bool
+
+
+class PageCache:
+    """ Full-page cache for anonymous GET requests """
+
+    def __init__(self, app: Flask=None, user_cookie: str=None, max_size: int=256, enabled: bool=True) -> None:
+        self.user_cookie = user_cookie  # Requests with this cookie are never cached
+        self.enabled = enabled
+        self.store = MemoryCache(max_size, name="page")
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Registers hook for serving cached pages
+        Should be called before the app's own before_request hooks,
+        as they are skipped when a cached page is served
+        """
+        self.app = app
+        app.before_request(self._serve_cached)
+
+    def cached(self, ttl: int=60):
+        """ Put this in routes whose pages can be cached for anonymous visitors """
+
+        def decorator(func):
+            @wraps(func)
+            def decorated_function(*args, **kwargs):
+                if not self._is_cacheable():
+                    return func(*args, **kwargs)
+
+                response = make_response(func(*args, **kwargs))
+
+                # Only cache successful pages (not redirects or errors)
+                if response.status_code == 200 and not response.direct_passthrough:
+                    self._store(response, ttl)
+                    response.headers["X-Page-Cache"] = "MISS"
+                return response
+
+            # Mark route as cacheable for before_request hook
+            setattr(decorated_function, _TTL_ATTRIBUTE, ttl)
+            return decorated_function
+        return decorator
+
+    def clear(self) -> None:
+        """ Removes all cached pages of this worker """
+        self.store.clear()
+
+    def _is_cacheable(self) -> bool:
+        """ Checks if request is from an anonymous visitor and can be cached """
+        if not self.enabled or request.method != "GET":
+            return False
+
+        # Logged in (or session expired) users get their own pages
+        if self.user_cookie and self.user_cookie in request.cookies:
+            return False
+
+        # Flashed messages are rendered into the page and consumed
+        if session.get("_flashes"):
+            return False
+
+        return True
+
+    @staticmethod
+    def _key() -> tuple:
+        """ Returns key of current request (path, query, role and catalogue version) """
+        query = tuple(sorted(request.args.items(multi=True)))
+        return (get_catalogue_version(), request.path, query, _GUEST_ROLE)
+
+    def _store(self, response, ttl: int) -> None:
+        """ Stores response with csrf token replaced by placeholder """
+        body = response.get_data()
+
+        # Token is stored in flask global once rendered by csrf_token() in template
+        token = flask_global.get(self.app.config.get("WTF_CSRF_FIELD_NAME", "csrf_token"))
+        has_csrf = bool(token) and token.encode() in body
+        if has_csrf:
+            body = body.replace(token.encode(), _CSRF_PLACEHOLDER)
+
+        page = _CachedPage(body, response.status_code, response.mimetype, has_csrf)
+        self.store.set(self._key(), page, ttl)
+
+    def _serve_cached(self):
+        """ Returns cached page if found (skips remaining before_request hooks) """
+        view = self.app.view_functions.get(request.endpoint)
+        if getattr(view, _TTL_ATTRIBUTE, None) is None or not self._is_cacheable():
+            return None
+
+        page: Union[_CachedPage, None] = self.store.get(self._key())
+        if page is None:
+            return None
+
+        # Anonymous visitor, needed by after_request hooks
+        flask_global.user = None
+
+        body = page.body
+        if page.has_csrf:
+            body = body.replace(_CSRF_PLACEHOLDER, generate_csrf().encode())
+
+        response = make_response(body, page.status)
+        response.mimetype = page.mimetype
+        response.headers["X-Page-Cache"] = "HIT"
+        return response
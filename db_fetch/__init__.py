@@ -5,6 +5,8 @@ Database Fetch
 Contains functions that interacts with the sqlite database
 """
 from .general import *
+from .instrumentation import *
+from .schema import *
 from .user import *
 from .customer import *
 from .admin import *
@@ -12,5 +14,10 @@ from .exists import *
 from .book import *
 from .review import *
 from .order import *
+from .payment import *
+from .stock import *
 from .cart import *
 from .staff import *
+from .data_key import *
+from .stats import *
+from .analytics import *
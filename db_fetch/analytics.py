@@ -0,0 +1,140 @@
+"""
+Analytics Functions
+-------------------
+
+Contains functions that maintain and read the daily sales rollups
+(SalesDaily and OrderStatusDaily, see schema.py)
+"""
+from datetime import date, timedelta
+from .general import *
+
+# Summaries are cached in memory so dashboards do not refresh every view
+_SUMMARY_TTL = 60
+_summary_cache = MemoryCache(16, name="sales_summary")
+
+# Books with less stock than this many days of recent sales are low on stock
+LOW_STOCK_DAYS = 14
+
+
+def refresh_sales_rollups() -> int:
+    """ Re-aggregates days with changed orders, returns number of days refreshed """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            # Take the write lock first so no order change is missed in between
+            connection.execute("BEGIN IMMEDIATE;")
+            days = [day for day, in connection.execute("SELECT day FROM SalesDirtyDays;")]
+            if not days:
+                return 0
+
+            dirty = "(SELECT day FROM SalesDirtyDays)"
+            connection.execute(f"DELETE FROM SalesDaily WHERE day IN {dirty};")
+            connection.execute(f"DELETE FROM OrderStatusDaily WHERE day IN {dirty};")
+
+            # CROSS JOIN keeps dirty days as the outer loop, so orders are found by
+            # idx_order_details_day instead of a full scan of order history
+            # (+d.day drops the TEXT affinity that stops the expression index being used)
+            # Cancelled orders are not sales. Revenue uses the price paid (PaymentItems, in cents),
+            # so a price change never rewrites history, and the current price only for orders from
+            # before Stripe checkouts were recorded
+            connection.execute("""
+                INSERT INTO SalesDaily (day, book_id, genre, language, units, revenue)
+                SELECT d.day, i.book_id, COALESCE(b.genre, 'Unknown'), COALESCE(b.language, 'Unknown'),
+                       SUM(i.quantity),
+                       SUM(i.quantity * COALESCE((SELECT p.unit_amount / 100.0 FROM PaymentItems p
+                                                  WHERE p.order_id = i.order_id AND p.book_id = i.book_id
+                                                  LIMIT 1), b.price, 0))
+                FROM SalesDirtyDays d
+                CROSS JOIN OrderDetails o ON date(o.order_date) = +d.day
+                CROSS JOIN OrderItems i ON i.order_id = o.order_id
+                LEFT JOIN Books b ON b.book_id = i.book_id
+                WHERE o.order_pending != 'Cancelled'
+                GROUP BY d.day, i.book_id;
+            """)
+            connection.execute("""
+                INSERT INTO OrderStatusDaily (day, status, orders)
+                SELECT d.day, o.order_pending, COUNT(*)
+                FROM SalesDirtyDays d
+                CROSS JOIN OrderDetails o ON date(o.order_date) = +d.day
+                GROUP BY d.day, o.order_pending;
+            """)
+            connection.execute("DELETE FROM SalesDirtyDays;")
+
+    _summary_cache.clear()
+    return len(days)
+
+
+def rebuild_sales_rollups() -> int:
+    """ Marks every order day dirty and refreshes, returns number of days refreshed """
+    execute_db("INSERT OR IGNORE INTO SalesDirtyDays (day) SELECT DISTINCT date(order_date) FROM OrderDetails;", ())
+    execute_db("INSERT OR IGNORE INTO SalesDirtyDays (day) SELECT DISTINCT day FROM SalesDaily;", ())
+    execute_db("INSERT OR IGNORE INTO SalesDirtyDays (day) SELECT DISTINCT day FROM OrderStatusDaily;", ())
+    return refresh_sales_rollups()
+
+
+def _sales_by(column: str, since: str, limit: int=None) -> list[dict]:
+    """ Returns units and revenue since a day grouped by a SalesDaily column """
+    query = f"""SELECT {column}, SUM(units), SUM(revenue) FROM SalesDaily WHERE day >= ?
+                GROUP BY {column} ORDER BY SUM(revenue) DESC, {column}"""
+    parameters = (since,)
+    if limit is not None:
+        query += " LIMIT ?"
+        parameters += (limit,)
+    return [dict(key=key, units=units, revenue=revenue)
+            for key, units, revenue in execute_db(query + ";", parameters)]
+
+
+def retrieve_sales_summary(days: int=30, top: int=5) -> dict:
+    """ Returns sales, order status and low stock summary of the last number of days """
+    summary = _summary_cache.get((days, top))
+    if summary is not None:
+        return summary
+
+    refresh_sales_rollups()
+    since = (date.today() - timedelta(days=days - 1)).isoformat()
+
+    units, revenue = execute_db(
+        "SELECT COALESCE(SUM(units), 0), COALESCE(SUM(revenue), 0) FROM SalesDaily WHERE day >= ?;",
+        (since,), fetchone=True
+    )
+    daily = [dict(day=day, units=day_units, revenue=day_revenue) for day, day_units, day_revenue in execute_db(
+        "SELECT day, SUM(units), SUM(revenue) FROM SalesDaily WHERE day >= ? GROUP BY day ORDER BY day;", (since,)
+    )]
+    statuses = dict(execute_db(
+        "SELECT status, SUM(orders) FROM OrderStatusDaily WHERE day >= ? GROUP BY status ORDER BY status;", (since,)
+    ))
+
+    # Best sellers with their titles
+    top_books = _sales_by("book_id", since, top)
+    titles = dict(execute_db(
+        f"SELECT book_id, title FROM Books WHERE book_id IN ({', '.join('?' * len(top_books))});",
+        tuple(book["key"] for book in top_books)
+    )) if top_books else {}
+    for book in top_books:
+        book["title"] = titles.get(book["key"], "Deleted book")
+
+    # Stock that will not last LOW_STOCK_DAYS at the recent rate of sales
+    low_stock = [dict(book_id=book_id, title=title, stock=stock, units_per_day=round(sold / days, 2))
+                 for book_id, title, stock, sold in execute_db(
+        """SELECT b.book_id, b.title, b.stock, s.sold FROM Books b
+           JOIN (SELECT book_id, SUM(units) AS sold FROM SalesDaily WHERE day >= ? GROUP BY book_id) s
+             ON s.book_id = b.book_id
+           WHERE b.stock * ? < s.sold * ?
+           ORDER BY b.stock * 1.0 / s.sold;""",
+        (since, days, LOW_STOCK_DAYS)
+    )]
+
+    summary = dict(
+        since=since,
+        days=days,
+        units=units,
+        revenue=revenue,
+        orders=sum(statuses.values()),
+        daily=daily,
+        statuses=statuses,
+        top_books=top_books,
+        genres=_sales_by("genre", since),
+        languages=_sales_by("language", since),
+        low_stock=low_stock,
+    )
+    _summary_cache.set((days, top), summary, _SUMMARY_TTL)
+    return summary
@@ -5,6 +5,8 @@ Book Functions
 Contains functions that interact with book information
 """
 from .general import *
+from typing import Callable
+from cache_handler import bump_catalogue_version
 
 """ User-triggered Functions """
 
@@ -22,6 +24,14 @@ def retrieve_book(id_of_book: str) -> Union[tuple, None]:
     return retrieve_db("Books", book_id=id_of_book, fetchone=True)
 
 
+def stream_inventory(chunk_size: int=500):
+    """ Yields books (without description) in chunks (see stream_db) """
+    return stream_db(
+        "SELECT book_id, title, author, language, genre, price, stock, cover_img FROM Books ORDER BY book_id;",
+        (), chunk_size
+    )
+
+
 def number_of_books():
     return retrieve_db("Books", columns=["COUNT(*)"])[0][0]
 
@@ -37,6 +47,7 @@ def book_add(details: tuple):
     # con.commit()
     # con.close()
     insert_row("Books", details)
+    bump_catalogue_version()
 
 
 def book_update(details: tuple, book_id: str):
@@ -47,6 +58,64 @@ def book_update(details: tuple, book_id: str):
     # con.commit()
     # con.close()
     update_rows("Books", ["language", "genre", "title", "stock", "price", "author", "description", "cover_img"], values=details, book_id=book_id)
+    bump_catalogue_version()
+
+
+def upsert_books(connection: sqlite3.Connection, books: list[dict],
+                 save_covers: Callable[[list[tuple[str, str]]], list[tuple[str, str]]]) -> tuple[list[tuple[str, str]], int, int]:
+    """
+    Inserts or updates a batch of books in one transaction (see bulk_connection)
+    Books are matched by title, author and language, new books without a cover are skipped
+
+    Args:
+        connection (sqlite3.Connection): Connection from bulk_connection()
+        books (list[dict]): Dicts of book_id (used if new), language, genre, title,
+            stock, price, author, description and cover (image path or None)
+        save_covers (Callable): Saves [(book_id, cover), ...] as <book_id>.png before the books
+            are written, returns [(book_id, error), ...] of covers that could not be saved
+
+    Returns:
+        tuple: ([(book_id, error), ...] of covers not saved, number inserted, number updated)
+    """
+    with connection:
+        connection.execute(
+            """CREATE TEMP TABLE IF NOT EXISTS ImportBooks (
+                book_id TEXT NOT NULL, language TEXT, genre TEXT, title TEXT COLLATE NOCASE,
+                stock INTEGER, price INTEGER, author TEXT, description TEXT, cover TEXT,
+                existing INTEGER NOT NULL DEFAULT 0
+            );"""
+        )
+        connection.execute("DELETE FROM ImportBooks;")
+        connection.executemany(
+            """INSERT INTO ImportBooks (book_id, language, genre, title, stock, price, author, description, cover)
+               VALUES (:book_id, :language, :genre, :title, :stock, :price, :author, :description, :cover);""",
+            books
+        )
+
+        # Existing books keep their book_id (found through idx_books_natural_key)
+        connection.execute(
+            """UPDATE ImportBooks AS t SET book_id = b.book_id, existing = 1 FROM Books AS b
+               WHERE b.title = t.title AND b.author = t.author AND b.language = t.language;"""
+        )
+
+        # Rows are only written once their cover file exists (only a read lock is held meanwhile)
+        covers = connection.execute("SELECT book_id, cover FROM ImportBooks WHERE cover IS NOT NULL;").fetchall()
+        cover_errors = save_covers(covers) if covers else []
+        connection.executemany("UPDATE ImportBooks SET cover = NULL WHERE book_id = ?;",
+                               ((book_id,) for book_id, _ in cover_errors))
+
+        updated = connection.execute(
+            """UPDATE Books AS b SET genre = t.genre, stock = t.stock, price = t.price, description = t.description,
+                      cover_img = CASE WHEN t.cover IS NULL THEN b.cover_img ELSE t.book_id || '.png' END
+               FROM ImportBooks AS t WHERE t.existing AND b.book_id = t.book_id;"""
+        ).rowcount
+        inserted = connection.execute(
+            """INSERT INTO Books (book_id, language, genre, title, stock, price, author, description, cover_img)
+               SELECT book_id, language, genre, title, stock, price, author, description, book_id || '.png'
+               FROM ImportBooks WHERE NOT existing AND cover IS NOT NULL;"""
+        ).rowcount
+
+    return cover_errors, inserted, updated
 
 
 def delete_book(id_of_book: str):
@@ -57,3 +126,4 @@ def delete_book(id_of_book: str):
     # con.commit()
     # con.close()
     delete_rows("Books", book_id=id_of_book)
+    bump_catalogue_version()
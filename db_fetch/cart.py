@@ -5,6 +5,7 @@ Cart Functions
 Contains functions that interacts with customer cart items
 """
 from .general import *
+from .stock import HOLD_SECONDS, hold_stock_in
 
 
 def add_to_shopping_cart(user_id: str, book_id: str, quantity: int) -> None:
@@ -42,3 +43,50 @@ def delete_shopping_cart_item(user_id, book_id):
     # cur.execute(query)
     # con.close()
     delete_rows("CartItems", user_id=user_id, or_and=1, book_id=book_id)
+
+
+def update_cart_lines(user_id: str, lines: Iterable[tuple[str, int, bool]], seconds: int=HOLD_SECONDS) -> list[tuple[str, int, int]]:
+    """
+    Applies (book_id, quantity, add) changes to user's cart in one transaction, adding quantity
+    to the book's line if add, else setting it (0 removes the line), in order
+    Changed lines hold their books and are cut to the stock left (removed if none is)
+    Returns (book_id, requested, quantity in cart) of every book changed, both 0 if the book does not exist
+    """
+    lines = list(lines)
+    book_ids = list(dict.fromkeys(book_id for book_id, _, _ in lines))
+    if not book_ids:
+        return []
+
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE;")
+            cursor = connection.cursor()
+
+            # One upsert for the whole batch (unique index on user_id, book_id), unknown books insert nothing
+            cursor.executemany(
+                """INSERT INTO CartItems (user_id, book_id, quantity)
+                   SELECT ?, book_id, MAX(?, 0) FROM Books WHERE book_id = ?
+                   ON CONFLICT (user_id, book_id) DO UPDATE
+                   SET quantity = MAX(CASE WHEN ? THEN quantity + excluded.quantity ELSE excluded.quantity END, 0);""",
+                ((user_id, quantity, book_id, add) for book_id, quantity, add in lines)
+            )
+
+            placeholders = ", ".join("?" * len(book_ids))
+            requested = dict(cursor.execute(
+                f"SELECT book_id, quantity FROM CartItems WHERE user_id = ? AND book_id IN ({placeholders});",
+                (user_id, *book_ids)
+            ).fetchall())
+
+            results = []
+            for book_id in book_ids:
+                quantity = requested.get(book_id, 0)
+                held = hold_stock_in(cursor, user_id, book_id, quantity, seconds, partial=True) if quantity else 0
+                results.append((book_id, quantity, held))
+
+            cursor.executemany("UPDATE CartItems SET quantity = ? WHERE user_id = ? AND book_id = ?;",
+                               ((held, user_id, book_id) for book_id, quantity, held in results if 0 < held < quantity))
+            cursor.executemany("DELETE FROM CartItems WHERE user_id = ? AND book_id = ?;",
+                               ((user_id, book_id) for book_id, _, held in results if not held))
+            cursor.executemany("DELETE FROM StockHolds WHERE user_id = ? AND book_id = ?;",
+                               ((user_id, book_id) for book_id, _, held in results if not held))
+    return results
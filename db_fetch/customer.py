@@ -9,6 +9,9 @@ from .general import *
 from .user import retrieve_user 
 import datetime
 
+# Customers ordered by username for manage users page
+customer_paginator = Paginator("Users NATURAL JOIN Customers", "username", role="customer")
+
 """ Customer-triggered Functions """
 
 
@@ -19,6 +22,7 @@ def create_customer(user_id, username, email, password) -> None:
     insert_row("Users", (user_id, username, email, password, None, "customer"))
     # Insert customer details into Customers table
     insert_row("Customers", (user_id,), ("user_id",))
+    customer_paginator.clear_counts()
 
 def create_2FA_token(user_id, twoFA_secret_token) -> None:
     """ Creates 2FA token for user_id """
@@ -194,6 +198,31 @@ def retrieve_these_customers(limit:int, offset: int) -> list[tuple]:
     """ Retrieves and returns a list of max 10 customers starting from offset """
     return retrieve_db("Users NATURAL JOIN Customers", limit=limit, offset=offset, role="customer")
 
+# Columns of customers that can be projected
+CUSTOMER_COLUMNS = ("user_id", "username", "email", "password", "profile_pic", "role",
+                    "name", "credit_card_no", "address", "phone_no")
+
+
+def retrieve_customers_after(user_id: str, limit: int, columns: Iterable[str]=CUSTOMER_COLUMNS) -> list[tuple]:
+    """ Retrieves next `limit` customers ordered by user_id, starting after user_id (keyset pagination) """
+    columns = tuple(columns)
+    if not columns or not set(columns) <= set(CUSTOMER_COLUMNS):
+        raise ValueError(f"Columns must be from {CUSTOMER_COLUMNS}")
+    return execute_db(
+        f"""SELECT {','.join(columns)} FROM Users NATURAL JOIN Customers
+            WHERE role = 'customer' AND user_id > ? ORDER BY user_id LIMIT ?;""",
+        (user_id, limit)
+    )
+
+def retrieve_customers_page(limit: int, after: str=None, before: str=None, last: bool=False, search: str="") -> Page:
+    """ Retrieves a page of customers ordered by username (see Paginator.page) """
+    return customer_paginator.page(limit, after, before, last, search)
+
+
+def approximate_number_of_customers(search: str="") -> int:
+    """ Returns cached count of customers (with username starting with search) """
+    return customer_paginator.count(search)
+
 ## TODO: name too similar to `retrieve_customer_details` function above ^ (curr line 24)
 def retrieve_customer_detail(user_id: str):
     return retrieve_db("Users NATURAL JOIN Customers", fetchone=True, role="customer", or_and=1, user_id=user_id)
@@ -210,4 +239,5 @@ def delete_customer(user_id: str) -> Union[tuple, None]:
     if customer_data:
         delete_rows("Users", user_id=user_id)
         delete_rows("Customers", user_id=user_id)
+        customer_paginator.clear_counts()
         return customer_data
\ No newline at end of file
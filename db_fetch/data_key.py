@@ -0,0 +1,17 @@
+"""
+Data Key Functions
+------------------
+
+Contains functions that store wrapped (encrypted) data keys used for envelope encryption
+"""
+from .general import *
+
+
+def create_data_key(key_id: str, wrapped_key: bytes, master_key_id: str) -> None:
+    """ Stores a new wrapped data key """
+    insert_row("DataKeys", (key_id, wrapped_key, master_key_id), ("key_id", "wrapped_key", "master_key_id"))
+
+
+def retrieve_data_key(key_id: str) -> Union[tuple, None]:
+    """ Returns (wrapped_key, master_key_id) of data key """
+    return retrieve_db("DataKeys", ("wrapped_key", "master_key_id"), key_id=key_id, fetchone=True)
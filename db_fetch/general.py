@@ -4,12 +4,17 @@ General Operations Functions
 
 Contains general functions (including CRUD functions)
 """
-from contextlib import closing
-from typing import Union, Iterable
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import Union, Iterable, Iterator, Any
+from time import perf_counter
+from cache_handler import MemoryCache
+from .instrumentation import record_query
 import sqlite3
+import os
 
-# Database filename
-DATABASE = r"database.db"
+# Database filename (DATABASE_PATH points the app at another copy, e.g. a benchmark snapshot)
+DATABASE = os.environ.get("DATABASE_PATH", r"database.db")
 
 
 def execute_db(query: str, parameters=None, fetchone=False) -> Union[list[tuple], tuple, None]:
@@ -18,28 +23,94 @@ def execute_db(query: str, parameters=None, fetchone=False) -> Union[list[tuple]
     # Ensure that query statement ends properly
     assert query.strip().endswith(";"), 'Must end SQL query with ";"'
 
-    # Use with statement to ensure proper closing of file
-    with closing(sqlite3.connect(DATABASE)) as connection:
-        with connection:
+    # Time spent connecting, executing, fetching and committing is recorded
+    start = perf_counter()
+    try:
+        # Use with statement to ensure proper closing of file
+        with closing(sqlite3.connect(DATABASE)) as connection:
+            with connection:
 
-            # Cursor for executing queries
-            cursor = connection.cursor()
+                # Cursor for executing queries
+                cursor = connection.cursor()
 
-            # Execute parameterised queries
-            retrieved = cursor.execute(query, parameters)
+                # Execute parameterised queries
+                retrieved = cursor.execute(query, parameters)
 
-            if fetchone:
-                data = retrieved.fetchone()
-            else:
-                data = retrieved.fetchall()
+                if fetchone:
+                    data = retrieved.fetchone()
+                else:
+                    data = retrieved.fetchall()
 
-            # Return fetched data (if any)
-            return data
+                # Return fetched data (if any)
+                return data
+    finally:
+        record_query(DATABASE, query, parameters, perf_counter() - start)
 
     # Code should never reach here, raise error just in case
     raise RuntimeError("Unknown critical error!")
 
 
+def execute_many_db(query: str, seq_of_parameters: Iterable) -> int:
+    """ Execute sql query once for each set of parameters in one transaction, returns rows changed """
+
+    # Ensure that query statement ends properly
+    assert query.strip().endswith(";"), 'Must end SQL query with ";"'
+
+    start = perf_counter()
+    try:
+        with closing(sqlite3.connect(DATABASE)) as connection:
+            with connection:
+                return connection.executemany(query, seq_of_parameters).rowcount
+    finally:
+        record_query(DATABASE, query, None, perf_counter() - start)
+
+
+def stream_db(query: str, parameters=(), chunk_size: int=500) -> Iterator[list[tuple]]:
+    """
+    Yields rows of a query in chunks of fetchmany, so memory use does not grow with the result
+    Connection is kept open (and closed) by the generator, the first chunk is the column names
+    """
+
+    # Ensure that query statement ends properly
+    assert query.strip().endswith(";"), 'Must end SQL query with ";"'
+
+    # Only time spent in the database is recorded (not time the consumer takes between chunks)
+    elapsed = 0.0
+    try:
+        with closing(sqlite3.connect(DATABASE)) as connection:
+            start = perf_counter()
+            cursor = connection.execute(query, parameters)
+            elapsed += perf_counter() - start
+            yield [column[0] for column in cursor.description]
+
+            while True:
+                start = perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                elapsed += perf_counter() - start
+                if not rows:
+                    break
+                yield rows
+    finally:
+        record_query(DATABASE, query, parameters, elapsed)
+
+
+# PRAGMAs for bulk loads, an OS crash can lose the last batches (but not corrupt the database)
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -262144;",  # 256 MiB
+)
+
+
+@contextmanager
+def bulk_connection():
+    """ Yields a connection set up for bulk loads (use `with connection:` for each batch transaction) """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        for pragma in BULK_LOAD_PRAGMAS:
+            connection.execute(pragma)
+        yield connection
+
+
 def retrieve_db(table: str, columns: Iterable=None, or_and: int=0, limit: int=0, offset: int=0, fetchone=False, **attributes) -> Union[list[tuple], tuple, None]:
     """
     Retrieve rows from table
@@ -170,3 +241,102 @@ def update_rows(table: str, columns: Iterable[str], values: Iterable, or_and: in
     params = tuple(values) + tuple(attributes.values())
 
     execute_db(query, params)
+
+
+@dataclass
+class Page:
+    """ A page of rows returned by Paginator """
+    rows: list[tuple]
+    first_key: Any  # Key of first row (cursor for previous page)
+    last_key: Any   # Key of last row (cursor for next page)
+    has_prev: bool
+    has_next: bool
+
+
+class Paginator:
+    """
+    Pages through rows of a table ordered by a unique (indexed) key column without OFFSET,
+    each page is an index range scan no matter how deep it is
+
+    For example:
+    staff_paginator = Paginator("Users", "username", role="staff")
+    page = staff_paginator.page(10, after="bob")
+    """
+
+    def __init__(self, table: str, key: str, columns: Iterable[str]=None, count_ttl: int=30, **attributes) -> None:
+        self.table = table
+        self.key = key
+        self.projection = ",".join(columns) if columns else "*"
+        self.attributes = attributes  # Selected with AND
+        self.count_ttl = count_ttl
+        self._counts = MemoryCache(64, name="paginator_count")
+
+    def _selection(self, search: str) -> tuple[list[str], list]:
+        """ Returns selection statements and parameters of attributes and search """
+        selection = [f"{attribute} = ?" for attribute in self.attributes]
+        params = list(self.attributes.values())
+
+        # Prefix search as a range, so the index on key is used
+        if search:
+            selection.append(f"{self.key} >= ? AND {self.key} < ?")
+            params.extend((search, search + "\U0010ffff"))
+        return selection, params
+
+    def page(self, limit: int, after: Any=None, before: Any=None, last: bool=False, search: str="") -> Page:
+        """
+        Returns page of max `limit` rows
+        after: key of last row of previous page (next page)
+        before: key of first row of next page (previous page)
+        last: returns last page if True
+        search: only rows whose key starts with search
+        """
+        assert limit > 0, "Limit should be a int more than 0"
+
+        selection, params = self._selection(search)
+        backwards = before is not None or last
+
+        if after is not None:
+            selection.append(f"{self.key} > ?")
+            params.append(after)
+        elif before is not None:
+            selection.append(f"{self.key} < ?")
+            params.append(before)
+
+        where = f" WHERE {' AND '.join(selection)}" if selection else ""
+        order = "DESC" if backwards else "ASC"
+
+        # Key is selected first for cursors, fetch an extra row to check if there are more
+        query = f"""SELECT {self.key}, {self.projection} FROM {self.table}{where} ORDER BY {self.key} {order} LIMIT ?;"""
+        rows = execute_db(query, tuple(params) + (limit + 1,))
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+
+        if backwards:
+            has_prev, has_next = has_more, before is not None
+        else:
+            has_prev, has_next = after is not None, has_more
+
+        return Page(
+            rows=[row[1:] for row in rows],
+            first_key=rows[0][0] if rows else None,
+            last_key=rows[-1][0] if rows else None,
+            has_prev=has_prev and bool(rows),
+            has_next=has_next and bool(rows)
+        )
+
+    def count(self, search: str="") -> int:
+        """ Returns number of rows (cached for count_ttl seconds, so it is approximate) """
+        count = self._counts.get(search)
+        if count is None:
+            selection, params = self._selection(search)
+            where = f" WHERE {' AND '.join(selection)}" if selection else ""
+            count = execute_db(f"""SELECT COUNT(*) FROM {self.table}{where};""", tuple(params), fetchone=True)[0]
+            self._counts.set(search, count, self.count_ttl)
+        return count
+
+    def clear_counts(self) -> None:
+        """ Clears cached counts (e.g. after rows are added or deleted) """
+        self._counts.clear()
@@ -0,0 +1,138 @@
+"""
+Query Instrumentation
+---------------------
+
+Times every query run through execute_db (and friends)
+
+Queries of the current request are collected in a QueryStats (started by the
+app's before_request hook), totals of each distinct query are kept per worker
+for top_queries(), and queries slower than SLOW_QUERY_MS are logged to
+SLOW_QUERY_LOG with their EXPLAIN QUERY PLAN (parameters are never logged).
+"""
+from contextlib import closing
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Union
+import logging
+import sqlite3
+import os
+from metrics import DB_QUERY_SECONDS
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 100))  # Queries slower than this are logged
+SLOW_QUERY_LOG = "log/slow_queries.log"
+MAX_STATEMENTS = 200  # Max number of statement timings kept per request
+MAX_DISTINCT_QUERIES = 1000  # Max number of distinct queries totalled per worker
+
+# Logging (file is only opened once a slow query is logged)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARNING)
+_fh = logging.FileHandler(SLOW_QUERY_LOG, delay=True)
+_fh.setLevel(logging.WARNING)
+_fh.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s]: %(message)s", "%Y-%m-%d %H:%M:%S"))
+logger.addHandler(_fh)
+
+
+@dataclass
+class QueryStats:
+    """ Queries run while handling one request """
+    start: float = field(default_factory=perf_counter)
+    count: int = 0
+    time: float = 0.0  # Seconds spent in the database
+    statements: list[tuple[str, float]] = field(default_factory=list)  # (query, seconds) of first MAX_STATEMENTS
+
+    def server_timing(self) -> str:
+        """ Returns value of Server-Timing header (database and total time so far) """
+        total = (perf_counter() - self.start) * 1000
+        return f'db;dur={self.time * 1000:.2f};desc="queries: {self.count}", app;dur={total:.2f}'
+
+
+@dataclass
+class _QueryTotal:
+    count: int = 0
+    time: float = 0.0
+    max: float = 0.0
+    plan: str = None  # Query plan (explained once, when first slow)
+
+
+_current: ContextVar[Union[QueryStats, None]] = ContextVar("query_stats", default=None)
+_totals: dict[str, _QueryTotal] = {}
+_totals_lock = Lock()
+
+
+def start_query_stats() -> QueryStats:
+    """ Starts collecting queries of the current request (thread) """
+    stats = QueryStats()
+    _current.set(stats)
+    return stats
+
+
+def stop_query_stats() -> None:
+    """ Stops collecting queries of the current request """
+    _current.set(None)
+
+
+def current_query_stats() -> Union[QueryStats, None]:
+    return _current.get()
+
+
+def explain_query(database: str, query: str, parameters=()) -> str:
+    """ Returns EXPLAIN QUERY PLAN of query as an indented tree """
+    try:
+        with closing(sqlite3.connect(database)) as connection:
+            rows = connection.execute(f"EXPLAIN QUERY PLAN {query}", parameters or ()).fetchall()
+    except sqlite3.Error as e:
+        return f"(could not explain: {e})"
+
+    # Rows are (id, parent id, unused, detail)
+    depth = {0: 0}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, 0) + 1
+        lines.append("  " * depth[node] + detail)
+    return "\n".join(lines)
+
+
+def record_query(database: str, query: str, parameters, elapsed: float) -> None:
+    """ Records a query that took elapsed seconds (called by execute_db) """
+    DB_QUERY_SECONDS.observe(elapsed)
+
+    stats = _current.get()
+    if stats is not None:
+        stats.count += 1
+        stats.time += elapsed
+        if len(stats.statements) < MAX_STATEMENTS:
+            stats.statements.append((query, elapsed))
+
+    key = " ".join(query.split())
+    with _totals_lock:
+        total = _totals.get(key)
+        if total is None and len(_totals) < MAX_DISTINCT_QUERIES:
+            total = _totals[key] = _QueryTotal()
+        if total is not None:
+            total.count += 1
+            total.time += elapsed
+            total.max = max(total.max, elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        plan = total.plan if total is not None else None
+        if plan is None:
+            plan = explain_query(database, query, parameters)
+            if total is not None:
+                total.plan = plan
+        logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {key}" + (f"\n{plan}" if plan else ""))
+
+
+def top_queries(limit: int=20) -> list[dict]:
+    """ Returns queries of this worker with the most cumulative time """
+    with _totals_lock:
+        totals = sorted(_totals.items(), key=lambda item: item[1].time, reverse=True)[:limit]
+        return [dict(query=query, count=total.count, total_ms=total.time * 1000,
+                     mean_ms=total.time * 1000 / total.count, max_ms=total.max * 1000, plan=total.plan)
+                for query, total in totals]
+
+
+def reset_top_queries() -> None:
+    with _totals_lock:
+        _totals.clear()
@@ -41,3 +41,34 @@ def get_all_orders():
 
 def number_of_orders():
     return retrieve_db("OrderDetails", columns=["COUNT(*)"])[0][0]
+
+
+def stream_orders(since: str=None, until: str=None, statuses: Iterable[str]=(), chunk_size: int=500):
+    """
+    Yields order items joined with their order details in chunks (see stream_db)
+    since and until are inclusive YYYY-MM-DD dates, statuses filter by order status
+    """
+    conditions, parameters = [], []
+
+    # Filters and ordering are on date(order_date) so idx_order_details_day is walked
+    # in order (no sort of the whole history before the first row is sent)
+    if since is not None:
+        conditions.append("date(o.order_date) >= ?")
+        parameters.append(since)
+    if until is not None:
+        conditions.append("date(o.order_date) <= ?")
+        parameters.append(until)
+    statuses = list(statuses)
+    if statuses:
+        conditions.append(f"o.order_pending IN ({', '.join('?' * len(statuses))})")
+        parameters.extend(statuses)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return stream_db(
+        f"""SELECT o.order_id, o.user_id, o.order_date, o.shipping_option, o.order_pending AS status,
+                   i.book_id, i.quantity
+            FROM OrderDetails o CROSS JOIN OrderItems i ON i.order_id = o.order_id
+            {where}
+            ORDER BY date(o.order_date);""",
+        parameters, chunk_size
+    )
@@ -0,0 +1,189 @@
+"""
+Payment Functions
+-----------------
+
+Contains functions that interact with the Payments, PaymentItems, StripeEvents and StripePrices tables
+
+A checkout creates a pending payment with a snapshot of the cart (its order id
+is reserved, but the order is only created in OrderDetails once Stripe reports
+the payment, so unpaid checkouts are never counted as orders or sales).
+A payment whose session could not be created is failed, and is reused (with the
+same order id, the idempotency key of its session) when the cart is checked out again.
+"""
+from .general import *
+
+PENDING = "pending"
+PAID = "paid"
+EXPIRED = "expired"
+FAILED = "failed"  # Creating the checkout session failed
+MAX_EVENT_ATTEMPTS = 5  # Events that failed this many times are no longer retried
+
+
+def retrieve_checkout_lines(user_id: str) -> list[tuple]:
+    """ Returns (book_id, title, quantity, unit_amount) of user's cart, prices in integer cents """
+    # Prices are converted once here, so amounts are never summed as floats
+    return execute_db(
+        """SELECT c.book_id, b.title, SUM(c.quantity), CAST(ROUND(b.price * 100) AS INTEGER)
+           FROM CartItems c JOIN Books b ON b.book_id = c.book_id
+           WHERE c.user_id = ?
+           GROUP BY c.book_id
+           ORDER BY MIN(c.rowid);""",
+        (user_id,)
+    )
+
+
+def create_payment(order_id: str, user_id: str, currency: str, shipping_option: str, shipping_amount: int,
+                   cart_hash: str, items: Iterable[tuple[str, int, int]]) -> tuple[int, int]:
+    """
+    Creates a pending payment with its items, (book_id, quantity, unit_amount) in cents
+    Returns (amount charged in cents (items and shipping, totalled by the database), created as unix time)
+    """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            connection.executemany(
+                "INSERT INTO PaymentItems (order_id, book_id, quantity, unit_amount) VALUES (?, ?, ?, ?);",
+                ((order_id, book_id, quantity, unit_amount) for book_id, quantity, unit_amount in items)
+            )
+            return connection.execute(
+                """INSERT INTO Payments (order_id, user_id, status, amount, currency, shipping_option, cart_hash)
+                   SELECT ?, ?, ?, ? + COALESCE(SUM(quantity * unit_amount), 0), ?, ?, ?
+                   FROM PaymentItems WHERE order_id = ?
+                   RETURNING amount, CAST(strftime('%s', created) AS INTEGER);""",
+                (order_id, user_id, PENDING, shipping_amount, currency, shipping_option, cart_hash, order_id)
+            ).fetchone()
+
+
+def set_payment_session(order_id: str, session_id: str, session_url: str) -> None:
+    """ Stores the Stripe checkout session of a payment (pending again if it had failed) """
+    execute_db("UPDATE Payments SET session_id = ?, session_url = ?, status = ? WHERE order_id = ? AND status IN (?, ?);",
+               (session_id, session_url, PENDING, order_id, PENDING, FAILED))
+
+
+def fail_payment(order_id: str) -> None:
+    """ Marks a pending payment whose checkout session could not be created """
+    execute_db("UPDATE Payments SET status = ? WHERE order_id = ? AND status = ?;", (FAILED, order_id, PENDING))
+
+
+def retrieve_reusable_payment(user_id: str, cart_hash: str, max_age: int) -> Union[tuple, None]:
+    """
+    Returns (order_id, session_url, created as unix time) of a pending or failed payment of the same
+    cart created less than max_age seconds ago, so checking out again reuses its order id and session
+    session_url is None if the session was never stored (e.g. Stripe timed out)
+    """
+    # Statuses are literals so idx_payments_open is used
+    return execute_db(
+        f"""SELECT order_id, session_url, CAST(strftime('%s', created) AS INTEGER) FROM Payments
+            WHERE user_id = ? AND cart_hash = ? AND status IN ('{PENDING}', '{FAILED}')
+              AND created > datetime('now', ?)
+            ORDER BY created DESC LIMIT 1;""",
+        (user_id, cart_hash, f"-{int(max_age)} seconds"), fetchone=True
+    )
+
+
+def retrieve_payment(order_id: str, user_id: str) -> Union[tuple, None]:
+    """ Returns (order_id, status, amount, currency) of a payment of user """
+    return execute_db("SELECT order_id, status, amount, currency FROM Payments WHERE order_id = ? AND user_id = ?;",
+                      (order_id, user_id), fetchone=True)
+
+
+def finalise_payment(session_id: str) -> Union[str, None]:
+    """
+    Marks the payment of a checkout session paid and creates its order from the
+    snapshot (removing the bought books from the cart and taking them off stock,
+    in place of the cart's holds), returns the order id
+    Returns None if the payment is unknown or was already finalised, so repeated
+    webhook deliveries never create an order twice
+    """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE;")
+            payment = connection.execute(
+                "UPDATE Payments SET status = ? WHERE session_id = ? AND status = ? RETURNING order_id, user_id, shipping_option;",
+                (PAID, session_id, PENDING)
+            ).fetchone()
+            if payment is None:
+                return None
+
+            order_id, user_id, shipping_option = payment
+            connection.execute(
+                "INSERT INTO OrderDetails (order_id, user_id, shipping_option, order_pending) VALUES (?, ?, ?, 'Ordered');",
+                (order_id, user_id, shipping_option)
+            )
+            connection.execute(
+                "INSERT INTO OrderItems (order_id, book_id, quantity) SELECT order_id, book_id, quantity FROM PaymentItems WHERE order_id = ?;",
+                (order_id,)
+            )
+            connection.execute(
+                "DELETE FROM CartItems WHERE user_id = ? AND book_id IN (SELECT book_id FROM PaymentItems WHERE order_id = ?);",
+                (user_id, order_id)
+            )
+            # Holds become sales, paid orders are kept even if the hold had expired and stock ran out
+            connection.execute(
+                """UPDATE Books SET stock = MAX(stock - (SELECT SUM(p.quantity) FROM PaymentItems p
+                                                         WHERE p.order_id = ? AND p.book_id = Books.book_id), 0)
+                   WHERE book_id IN (SELECT book_id FROM PaymentItems WHERE order_id = ?);""",
+                (order_id, order_id)
+            )
+            connection.execute(
+                "DELETE FROM StockHolds WHERE user_id = ? AND book_id IN (SELECT book_id FROM PaymentItems WHERE order_id = ?);",
+                (user_id, order_id)
+            )
+            return order_id
+
+
+def expire_payment(session_id: str) -> bool:
+    """ Marks the pending payment of an expired checkout session, returns whether it was pending """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            cursor = connection.execute("UPDATE Payments SET status = ? WHERE session_id = ? AND status = ?;",
+                                        (EXPIRED, session_id, PENDING))
+            return cursor.rowcount == 1
+
+
+def save_stripe_event(event_id: str, event_type: str, payload: str) -> bool:
+    """ Stores a webhook event to be processed, returns False if it was already received """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            cursor = connection.execute("INSERT OR IGNORE INTO StripeEvents (event_id, type, payload) VALUES (?, ?, ?);",
+                                        (event_id, event_type, payload))
+            return cursor.rowcount == 1
+
+
+def retrieve_unprocessed_stripe_events(limit: int=100) -> list[tuple]:
+    """ Returns (event_id, type, payload) of events still to be processed, oldest first """
+    return execute_db(
+        """SELECT event_id, type, payload FROM StripeEvents
+           WHERE processed IS NULL AND attempts < ? ORDER BY received LIMIT ?;""",
+        (MAX_EVENT_ATTEMPTS, limit)
+    )
+
+
+def mark_stripe_event_processed(event_id: str) -> None:
+    execute_db("UPDATE StripeEvents SET processed = CURRENT_TIMESTAMP WHERE event_id = ?;", (event_id,))
+
+
+def mark_stripe_event_failed(event_id: str) -> None:
+    execute_db("UPDATE StripeEvents SET attempts = attempts + 1 WHERE event_id = ?;", (event_id,))
+
+
+def retrieve_stripe_prices(mode: str, currency: str, item_ids: Iterable[str]) -> tuple[dict, dict]:
+    """ Returns ({(item_id, unit_amount): price_id}, {item_id: product_id}) of Stripe prices of items """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}, {}
+    rows = execute_db(
+        f"""SELECT item_id, unit_amount, price_id, product_id FROM StripePrices
+            WHERE mode = ? AND currency = ? AND item_id IN ({', '.join('?' * len(item_ids))});""",
+        (mode, currency, *item_ids)
+    )
+    return ({(item_id, unit_amount): price_id for item_id, unit_amount, price_id, _ in rows},
+            {item_id: product_id for item_id, _, _, product_id in rows})
+
+
+def create_stripe_price(mode: str, item_id: str, currency: str, unit_amount: int, price_id: str, product_id: str) -> None:
+    """ Stores a Stripe price (kept if another worker stored the same one first) """
+    execute_db(
+        """INSERT OR IGNORE INTO StripePrices (mode, item_id, currency, unit_amount, price_id, product_id)
+           VALUES (?, ?, ?, ?, ?, ?);""",
+        (mode, item_id, currency, unit_amount, price_id, product_id)
+    )
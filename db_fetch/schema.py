@@ -0,0 +1,194 @@
+"""
+Schema Functions
+----------------
+
+Contains tables and indexes added after the initial schema.sql,
+every statement is idempotent so upgrade_schema() can run on every startup
+"""
+from .general import *
+
+# Counter name: table counted (staff is Users WHERE role = 'staff')
+COUNTED_TABLES = {
+    "customers": "Customers",
+    "orders": "OrderDetails",
+    "books": "Books",
+    "staff": "Users WHERE role = 'staff'",
+    "reviews": "Reviews",
+}
+
+_UPGRADES = (
+    # Readers (e.g. streamed exports) no longer block writers
+    """PRAGMA journal_mode = WAL;""",
+
+    # Wrapped data keys for envelope encryption
+    """CREATE TABLE IF NOT EXISTS DataKeys (
+        key_id TEXT NOT NULL,
+        wrapped_key BLOB NOT NULL,
+        master_key_id TEXT NOT NULL,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (key_id)
+    );""",
+
+    # Keyset pagination of users by role, and joining customer details
+    """CREATE INDEX IF NOT EXISTS idx_users_role ON Users (role, user_id);""",
+    """CREATE INDEX IF NOT EXISTS idx_customers_user_id ON Customers (user_id);""",
+
+    # Keyset pagination and search of users by username (manage users/staff pages)
+    """CREATE INDEX IF NOT EXISTS idx_users_role_username ON Users (role, username);""",
+
+    # Row counts shown on dashboards, kept up to date by triggers
+    """CREATE TABLE IF NOT EXISTS Counters (
+        name TEXT NOT NULL,
+        value INTEGER NOT NULL,
+        PRIMARY KEY (name)
+    );""",
+    *(f"""INSERT OR IGNORE INTO Counters (name, value)
+          SELECT '{name}', (SELECT COUNT(*) FROM {table})
+          WHERE NOT EXISTS (SELECT 1 FROM Counters WHERE name = '{name}');"""
+      for name, table in COUNTED_TABLES.items()),
+    *(f"""CREATE TRIGGER IF NOT EXISTS trg_{name}_{event.lower()} AFTER {event} ON {table}
+          BEGIN UPDATE Counters SET value = value {sign} 1 WHERE name = '{name}'; END;"""
+      for name, table in COUNTED_TABLES.items() if name != "staff"
+      for event, sign in (("INSERT", "+"), ("DELETE", "-"))),
+    """CREATE TRIGGER IF NOT EXISTS trg_staff_insert AFTER INSERT ON Users WHEN NEW.role = 'staff'
+       BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'staff'; END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_staff_delete AFTER DELETE ON Users WHEN OLD.role = 'staff'
+       BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'staff'; END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_staff_update AFTER UPDATE OF role ON Users WHEN OLD.role IS NOT NEW.role
+       BEGIN UPDATE Counters SET value = value + (NEW.role = 'staff') - (OLD.role = 'staff') WHERE name = 'staff'; END;""",
+
+    # Natural key of books used by import_books.py to match existing books
+    """CREATE INDEX IF NOT EXISTS idx_books_natural_key ON Books (title, author, language);""",
+
+    # Daily sales rollups, days touched by order changes are marked dirty and re-aggregated
+    """CREATE TABLE IF NOT EXISTS SalesDaily (
+        day TEXT NOT NULL,
+        book_id TEXT NOT NULL,
+        genre TEXT NOT NULL,
+        language TEXT NOT NULL,
+        units INTEGER NOT NULL,
+        revenue INTEGER NOT NULL,
+        PRIMARY KEY (day, book_id)
+    );""",
+    """CREATE TABLE IF NOT EXISTS OrderStatusDaily (
+        day TEXT NOT NULL,
+        status TEXT NOT NULL,
+        orders INTEGER NOT NULL,
+        PRIMARY KEY (day, status)
+    );""",
+    """CREATE TABLE IF NOT EXISTS SalesDirtyDays (
+        day TEXT NOT NULL,
+        PRIMARY KEY (day)
+    );""",
+    """CREATE INDEX IF NOT EXISTS idx_order_details_day ON OrderDetails (date(order_date));""",
+    """CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON OrderItems (order_id);""",
+    # Existing orders are rolled up the first time the tables are created
+    """INSERT OR IGNORE INTO SalesDirtyDays (day)
+       SELECT DISTINCT date(order_date) FROM OrderDetails
+       WHERE NOT EXISTS (SELECT 1 FROM OrderStatusDaily);""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_order_insert AFTER INSERT ON OrderDetails
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(NEW.order_date)); END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_order_update AFTER UPDATE OF order_date, order_pending ON OrderDetails
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(OLD.order_date)), (date(NEW.order_date)); END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_order_delete AFTER DELETE ON OrderDetails
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(OLD.order_date)); END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_item_insert AFTER INSERT ON OrderItems
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+             SELECT date(order_date) FROM OrderDetails WHERE order_id = NEW.order_id; END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_item_update AFTER UPDATE ON OrderItems
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+             SELECT date(order_date) FROM OrderDetails WHERE order_id IN (OLD.order_id, NEW.order_id); END;""",
+    """CREATE TRIGGER IF NOT EXISTS trg_sales_item_delete AFTER DELETE ON OrderItems
+       BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+             SELECT date(order_date) FROM OrderDetails WHERE order_id = OLD.order_id; END;""",
+
+    # Stripe checkouts, orders are created from the snapshot of the cart once the webhook reports payment
+    """CREATE TABLE IF NOT EXISTS Payments (
+        order_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        status TEXT NOT NULL,
+        amount INTEGER NOT NULL,
+        currency TEXT NOT NULL,
+        shipping_option TEXT NOT NULL,
+        cart_hash TEXT NOT NULL,
+        session_id TEXT,
+        session_url TEXT,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (order_id),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    );""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_session_id ON Payments (session_id);""",
+    """CREATE INDEX IF NOT EXISTS idx_payments_open ON Payments (user_id, cart_hash) WHERE status IN ('pending', 'failed');""",
+    """CREATE TABLE IF NOT EXISTS PaymentItems (
+        order_id TEXT NOT NULL,
+        book_id TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_amount INTEGER NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES Payments(order_id),
+        FOREIGN KEY (book_id) REFERENCES Books(book_id)
+    );""",
+    """CREATE INDEX IF NOT EXISTS idx_payment_items_order_id ON PaymentItems (order_id);""",
+    """CREATE TABLE IF NOT EXISTS StripeEvents (
+        event_id TEXT NOT NULL,
+        type TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        received TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        processed TIMESTAMP,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (event_id)
+    );""",
+    """CREATE INDEX IF NOT EXISTS idx_stripe_events_unprocessed ON StripeEvents (received) WHERE processed IS NULL;""",
+
+    # Stripe prices of books and shipping options by amount in cents (prices cannot change amount)
+    """CREATE TABLE IF NOT EXISTS StripePrices (
+        mode TEXT NOT NULL,
+        item_id TEXT NOT NULL,
+        currency TEXT NOT NULL,
+        unit_amount INTEGER NOT NULL,
+        price_id TEXT NOT NULL,
+        product_id TEXT NOT NULL,
+        created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (mode, item_id, currency, unit_amount)
+    );""",
+
+    # Stock held by carts until expiry, available stock is Books.stock less unexpired holds
+    """CREATE TABLE IF NOT EXISTS StockHolds (
+        user_id TEXT NOT NULL,
+        book_id TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        expires TIMESTAMP NOT NULL,
+        PRIMARY KEY (user_id, book_id),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id),
+        FOREIGN KEY (book_id) REFERENCES Books(book_id)
+    );""",
+    """CREATE INDEX IF NOT EXISTS idx_stock_holds_book_id ON StockHolds (book_id, expires, quantity);""",
+    """CREATE INDEX IF NOT EXISTS idx_stock_holds_expires ON StockHolds (expires);""",
+
+)
+
+
+def _merge_cart_lines() -> None:
+    """ Merges duplicate cart lines of a book into the first one, then makes them unique (once) """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE;")
+            # Checked inside the transaction, another worker may have just created it
+            if connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_cart_items_user_book';").fetchone():
+                return
+            connection.execute(
+                """UPDATE CartItems SET quantity = (SELECT SUM(c.quantity) FROM CartItems c
+                                                   WHERE c.user_id = CartItems.user_id AND c.book_id = CartItems.book_id)
+                   WHERE rowid IN (SELECT MIN(rowid) FROM CartItems GROUP BY user_id, book_id HAVING COUNT(*) > 1);"""
+            )
+            connection.execute("DELETE FROM CartItems WHERE rowid NOT IN (SELECT MIN(rowid) FROM CartItems GROUP BY user_id, book_id);")
+            connection.execute("CREATE UNIQUE INDEX idx_cart_items_user_book ON CartItems (user_id, book_id);")
+
+
+def upgrade_schema() -> None:
+    """ Creates tables and indexes missing from the database """
+    for statement in _UPGRADES:
+        execute_db(statement, ())
+
+    # One cart line per book, only merged while the unique index is missing
+    if not execute_db("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_cart_items_user_book';", (), fetchone=True):
+        _merge_cart_lines()
@@ -1,10 +1,14 @@
 from .general import *
 from .user import retrieve_user
 
+# Staff ordered by username for manage staff page
+staff_paginator = Paginator("Users", "username", role="staff")
+
 
 def create_staff(staff_id: str, username: str, email: str, password: str) -> None:
     """ Creates an admin account """
     insert_row("Users", (staff_id, username, email, password, None, "staff"))
+    staff_paginator.clear_counts()
 
 
 def number_of_staff():
@@ -16,8 +20,19 @@ def retrieve_all_staff(limit:int, offset: int) -> list[tuple]:
     return retrieve_db("Users", limit=limit, offset=offset, role="staff")
 
 
+def retrieve_staff_page(limit: int, after: str=None, before: str=None, last: bool=False, search: str="") -> Page:
+    """ Retrieves a page of staff ordered by username (see Paginator.page) """
+    return staff_paginator.page(limit, after, before, last, search)
+
+
+def approximate_number_of_staff(search: str="") -> int:
+    """ Returns cached count of staff (with username starting with search) """
+    return staff_paginator.count(search)
+
+
 def delete_staff(staff_id):
     staff_data = retrieve_user(staff_id)
     if staff_data:
         delete_rows("Users", or_and=1, role="staff", user_id=staff_id)
+        staff_paginator.clear_counts()
         return staff_data
@@ -0,0 +1,38 @@
+"""
+Stats Functions
+---------------
+
+Contains functions that read the row counters shown on dashboards
+(Counters table is kept up to date by triggers, see schema.py)
+"""
+from .general import *
+from .schema import COUNTED_TABLES
+
+# Counters are cached in memory so dashboards do not query every view
+_COUNTERS_TTL = 5
+_counters_cache = MemoryCache(1, name="counters")
+
+
+def retrieve_counters() -> dict[str, int]:
+    """ Returns counters by name (customers, orders, books, staff and reviews) """
+    counters = _counters_cache.get("counters")
+    if counters is None:
+        counters = dict(retrieve_db("Counters", ("name", "value")))
+        _counters_cache.set("counters", counters, _COUNTERS_TTL)
+    return counters
+
+
+def reconcile_counters() -> dict[str, int]:
+    """ Recounts every counted table and fixes counters, returns the new counters """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            # Recount in one transaction so no trigger update is lost in between
+            connection.execute("BEGIN IMMEDIATE;")
+            for name, table in COUNTED_TABLES.items():
+                connection.execute(
+                    f"""INSERT INTO Counters (name, value) SELECT ?, (SELECT COUNT(*) FROM {table}) WHERE true
+                        ON CONFLICT (name) DO UPDATE SET value = excluded.value;""",
+                    (name,)
+                )
+    _counters_cache.clear()
+    return retrieve_counters()
@@ -0,0 +1,93 @@
+"""
+Stock Functions
+---------------
+
+Contains functions that reserve stock for carts (StockHolds table)
+
+Every cart line holds its quantity of the book until the hold expires, so stock
+available to sell is a book's stock less the unexpired holds of everyone else.
+A hold is only taken (or changed) by a single conditional statement, so two
+customers can never both be given the last copy. Holds are converted into sales
+(stock taken off) when the order is paid, see finalise_payment.
+"""
+from .general import *
+
+HOLD_SECONDS = 900  # Seconds a cart line holds its books after it was last changed
+
+# Books held by other unexpired holds (?: book_id, user_id)
+_HELD_BY_OTHERS = """COALESCE((SELECT SUM(h.quantity) FROM StockHolds h
+                               WHERE h.book_id = ? AND h.user_id != ? AND h.expires > datetime('now')), 0)"""
+
+
+def hold_stock_in(cursor: sqlite3.Cursor, user_id: str, book_id: str, quantity: int, seconds: int, partial: bool) -> int:
+    """
+    Holds quantity of a book for user (replacing user's previous hold of it) in the transaction of cursor
+    (commit it), returns quantity held
+    If partial, holds as many as available (up to quantity), otherwise all or nothing (0)
+    """
+    # Checks and writes in one statement, so the check cannot go stale before the write
+    row = cursor.execute(
+        f"""INSERT INTO StockHolds (user_id, book_id, quantity, expires)
+            SELECT ?, b.book_id, MIN(?, b.stock - {_HELD_BY_OTHERS}), datetime('now', ?)
+            FROM Books b
+            WHERE b.book_id = ? AND b.stock - {_HELD_BY_OTHERS} >= ?
+            ON CONFLICT (user_id, book_id) DO UPDATE SET quantity = excluded.quantity, expires = excluded.expires
+            RETURNING quantity;""",
+        (user_id, quantity, book_id, user_id, f"+{int(seconds)} seconds",
+         book_id, book_id, user_id, min(quantity, 1) if partial else quantity)
+    ).fetchone()
+    return row[0] if row is not None else 0
+
+
+def hold_cart_stock(user_id: str, seconds: int=HOLD_SECONDS) -> list[tuple[str, int, int]]:
+    """
+    Holds the stock of every line of user's cart for seconds (e.g. while paying)
+    Returns (book_id, quantity, available) of lines that could not be held, holding none of the cart if any
+    """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            connection.execute("BEGIN IMMEDIATE;")
+            cursor = connection.cursor()
+            lines = cursor.execute(
+                "SELECT book_id, SUM(quantity) FROM CartItems WHERE user_id = ? GROUP BY book_id;", (user_id,)
+            ).fetchall()
+
+            short = []
+            for book_id, quantity in lines:
+                if not hold_stock_in(cursor, user_id, book_id, quantity, seconds, partial=False):
+                    available = cursor.execute(
+                        f"SELECT MAX(b.stock - {_HELD_BY_OTHERS}, 0) FROM Books b WHERE b.book_id = ?;",
+                        (book_id, user_id, book_id)
+                    ).fetchone()
+                    short.append((book_id, quantity, available[0] if available else 0))
+            if short:
+                connection.rollback()
+    return short
+
+
+def release_cart_stock(user_id: str) -> None:
+    """ Releases all of user's holds (e.g. checkout failed) """
+    delete_rows("StockHolds", user_id=user_id)
+
+
+def delete_expired_holds() -> int:
+    """ Deletes expired holds (they no longer count already), returns number deleted """
+    with closing(sqlite3.connect(DATABASE)) as connection:
+        with connection:
+            return connection.execute("DELETE FROM StockHolds WHERE expires <= datetime('now');").rowcount
+
+
+def retrieve_available_stock(book_ids: Iterable[str]) -> dict[str, int]:
+    """ Returns stock available to sell (stock less unexpired holds) of books by book_id (missing books left out) """
+    book_ids = list(book_ids)
+    if not book_ids:
+        return {}
+
+    # Only the holds of these books are summed (idx_stock_holds_book_id)
+    placeholders = ", ".join("?" * len(book_ids))
+    return dict(execute_db(
+        f"""SELECT b.book_id, MAX(b.stock - COALESCE((SELECT SUM(h.quantity) FROM StockHolds h
+                                                     WHERE h.book_id = b.book_id AND h.expires > datetime('now')), 0), 0)
+            FROM Books b WHERE b.book_id IN ({placeholders});""",
+        tuple(book_ids)
+    ))
@@ -19,6 +19,22 @@ def retrieve_user_ids_and_emails() -> list[tuple[str, str]]:
     return retrieve_db("Users", columns=["user_id", "email"])
 
 
+def retrieve_user_emails_after(user_id: str, limit: int) -> list[tuple[str, str]]:
+    """ Returns next `limit` (user_id, email) pairs ordered by user_id, after user_id """
+    return execute_db(
+        """SELECT user_id, email FROM Users WHERE user_id > ? ORDER BY user_id LIMIT ?;""",
+        (user_id, limit)
+    )
+
+
+def update_user_emails(user_emails: Iterable[tuple[str, str, str]]) -> int:
+    """
+    Updates emails of users from (new email, user_id, email read) in one transaction, returns rows updated
+    Users whose email changed since it was read are skipped, so a newer email is never overwritten
+    """
+    return execute_many_db("""UPDATE Users SET email = ? WHERE user_id = ? AND email = ?;""", user_emails)
+
+
 def retrieve_user(user_id: str) -> Union[tuple, None]:
     """ Returns user_data using user_id """
     return retrieve_db("Users", user_id=user_id, fetchone=True)
@@ -1,27 +1,92 @@
-import base64
-from cryptography.fernet import Fernet
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.fernet import Fernet, MultiFernet
+from typing import Iterable, Union
 import os
 
 AWS_KEY = b"NEqIjI1CsQfKQjJXITyC6tLOj_to_YOx-005CMwibVk="
 
+# Batches smaller than this are decrypted in the calling thread
+_THREAD_THRESHOLD = 256
+_MAX_WORKERS = 4
 
-def aws_encrypt(string):
-    """Encryption will return a ciphertext"""
-    key = AWS_KEY
-    fernet = Fernet(key)
 
-    encrypted = fernet.encrypt(string.encode())
-    return encrypted.decode()
+def _load_keys() -> list[bytes]:
+    """
+    Returns Fernet keys, newest (used for encryption) first
+    Set FERNET_KEYS="new_key,old_key" to rotate keys
+    """
+    keys = os.environ.get("FERNET_KEYS")
+    if not keys:
+        return [AWS_KEY]
+    return [key.strip().encode() for key in keys.split(",") if key.strip()]
 
 
-def aws_decrypt(ciphertext:bytes):
-    """Decryption will return the plaintext string"""
+def _to_bytes(ciphertext: Union[str, bytes]) -> bytes:
+    """ Ensures ciphertext is bytes """
     if isinstance(ciphertext, str):
         ciphertext = ciphertext.encode()
     if not isinstance(ciphertext, bytes):
         raise TypeError("ciphertext be bytes")
-    key = AWS_KEY
-    fernet = Fernet(key)
+    return ciphertext
+
+
+class CryptoService:
+    """ Holds prebuilt Fernet instances for encrypting and decrypting values """
+
+    def __init__(self, keys: Iterable[bytes]) -> None:
+        keys = list(keys)
+        if not keys:
+            raise ValueError("Must specify at least one key")
+
+        # MultiFernet encrypts with the first key and decrypts with any of them
+        self.fernet = MultiFernet([Fernet(key) for key in keys])
+        self._executor = None
+
+    def encrypt(self, string: str) -> str:
+        """ Encryption will return a ciphertext """
+        return self.fernet.encrypt(string.encode()).decode()
+
+    def decrypt(self, ciphertext: Union[str, bytes]) -> str:
+        """ Decryption will return the plaintext string """
+        return self.fernet.decrypt(_to_bytes(ciphertext)).decode()
+
+    def decrypt_many(self, ciphertexts: Iterable[Union[str, bytes]]) -> list[str]:
+        """ Decrypts a batch of ciphertexts (large batches are spread over a thread pool) """
+        ciphertexts = list(ciphertexts)
+        if len(ciphertexts) < _THREAD_THRESHOLD:
+            return [self.decrypt(ciphertext) for ciphertext in ciphertexts]
+
+        # Created on first large batch (threads are not inherited across fork)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(_MAX_WORKERS, thread_name_prefix="decrypt")
+
+        # One chunk per worker (chunksize is ignored by thread pools)
+        chunk_size = -(-len(ciphertexts) // _MAX_WORKERS)
+        chunks = [ciphertexts[i:i + chunk_size] for i in range(0, len(ciphertexts), chunk_size)]
+        decrypt_chunk = lambda chunk: [self.decrypt(ciphertext) for ciphertext in chunk]
+        return [plaintext for chunk in self._executor.map(decrypt_chunk, chunks) for plaintext in chunk]
+
+    def rotate(self, ciphertext: Union[str, bytes]) -> str:
+        """ Re-encrypts ciphertext with the newest key """
+        return self.fernet.rotate(_to_bytes(ciphertext)).decode()
+
+
+crypto = CryptoService(_load_keys())
+
+# Threads of a pool created before fork (e.g. by a preloading server) do not exist in the worker
+os.register_at_fork(after_in_child=lambda: setattr(crypto, "_executor", None))
+
+
+def aws_encrypt(string):
+    """Encryption will return a ciphertext"""
+    return crypto.encrypt(string)
+
+
+def aws_decrypt(ciphertext:bytes):
+    """Decryption will return the plaintext string"""
+    return crypto.decrypt(ciphertext)
+
 
-    decrypted = fernet.decrypt(ciphertext)
-    return decrypted.decode()
+def aws_decrypt_many(ciphertexts):
+    """Decrypts a list of ciphertexts, returns list of plaintext strings"""
+    return crypto.decrypt_many(ciphertexts)
@@ -0,0 +1,9 @@
+"""
+Envelope Encryption
+-------------------
+
+Encrypts values locally with AES-GCM data keys,
+data keys are generated and wrapped by a master key provider (AWS KMS or a local key file)
+"""
+from .providers import *
+from .envelope import *
@@ -0,0 +1,161 @@
+"""
+Envelope Cipher
+---------------
+
+Encrypts each value with AES-GCM using a cached data key
+
+Ciphertext format:
+    "env1:" + urlsafe base64 of version (1 byte) | data key id (16 bytes) | nonce (12 bytes) | ciphertext + tag
+
+The text tag tells envelope ciphertexts apart from base64 KMS ciphertexts stored
+before envelope encryption was used (":" is never part of base64, so they cannot collide).
+
+The data key id header allows keys to be rotated without re-encrypting old values,
+wrapped data keys are stored in the DataKeys table and unwrapped once per worker.
+"""
+import base64
+import os
+import uuid
+from threading import Lock
+from time import monotonic
+from typing import Iterable, Union
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cache_handler import MemoryCache
+from .providers import KeyProvider
+import db_fetch as dbf
+
+__all__ = ["EnvelopeCipher", "is_envelope"]
+
+_TAG = b"env1:"
+_VERSION = b"\x01"
+_KEY_ID_SIZE = 16
+_NONCE_SIZE = 12
+_HEADER_SIZE = len(_VERSION) + _KEY_ID_SIZE
+
+# Defaults for rotating the data key used for encryption
+_MAX_KEY_AGE = 3600       # Seconds a data key is used for encryption (1 hour)
+_MAX_KEY_USES = 2 ** 20   # Values encrypted with one data key (well below AES-GCM nonce limits)
+
+# Unwrapped data keys kept in memory for decryption
+_DECRYPT_CACHE_SIZE = 64
+_DECRYPT_CACHE_TTL = 3600
+
+
+def is_envelope(ciphertext: Union[str, bytes]) -> bool:
+    """ Checks if ciphertext was created by EnvelopeCipher """
+    if isinstance(ciphertext, str):
+        ciphertext = ciphertext.encode()
+    return isinstance(ciphertext, bytes) and ciphertext.startswith(_TAG)
+
+
+class EnvelopeCipher:
+    """ Envelope encryption with a cached data key from a key provider """
+
+    def __init__(self, provider: KeyProvider, max_key_age: int=_MAX_KEY_AGE, max_key_uses: int=_MAX_KEY_USES) -> None:
+        self.provider = provider
+        self.max_key_age = max_key_age
+        self.max_key_uses = max_key_uses
+
+        self._lock = Lock()
+        self._key_id = None     # Raw id of current data key
+        self._aead = None       # AESGCM instance of current data key
+        self._key_created = 0.0
+        self._key_uses = 0
+
+        self._decrypt_keys = MemoryCache(_DECRYPT_CACHE_SIZE, name="data_key")
+        dbf.upgrade_schema()  # Ensures DataKeys table exists
+
+    def rotate(self) -> None:
+        """ Generates a new data key for encryption (old values can still be decrypted) """
+        with self._lock:
+            self._new_data_key()
+
+    def _new_data_key(self) -> None:
+        """ Generates, stores and caches a new data key (lock must be held) """
+        data_key, wrapped_key, master_key_id = self.provider.generate_data_key()
+        key_id = uuid.uuid4()
+        dbf.create_data_key(key_id.hex, wrapped_key, master_key_id)
+
+        self._key_id = key_id.bytes
+        self._aead = AESGCM(data_key)
+        self._key_created = monotonic()
+        self._key_uses = 0
+        self._decrypt_keys.set(self._key_id, self._aead, _DECRYPT_CACHE_TTL)
+
+    def _encryption_key(self, uses: int) -> tuple[bytes, AESGCM]:
+        """ Returns current data key, rotates it if too old or used too often """
+        with self._lock:
+            if (self._aead is None
+                    or monotonic() - self._key_created >= self.max_key_age
+                    or self._key_uses + uses > self.max_key_uses):
+                self._new_data_key()
+            self._key_uses += uses
+            return self._key_id, self._aead
+
+    def _decryption_key(self, key_id: bytes) -> AESGCM:
+        """ Returns cached data key, unwraps it using provider if not cached """
+        aead = self._decrypt_keys.get(key_id)
+        if aead is None:
+            data = dbf.retrieve_data_key(uuid.UUID(bytes=key_id).hex)
+            if data is None:
+                raise ValueError("Unknown data key")
+            wrapped_key, master_key_id = data
+            aead = AESGCM(self.provider.unwrap_data_key(wrapped_key, master_key_id))
+            self._decrypt_keys.set(key_id, aead, _DECRYPT_CACHE_TTL)
+        return aead
+
+    @staticmethod
+    def _seal(key_id: bytes, aead: AESGCM, plaintext: str) -> str:
+        """ Encrypts plaintext with data key (header is authenticated) """
+        header = _VERSION + key_id
+        nonce = os.urandom(_NONCE_SIZE)
+        ciphertext = aead.encrypt(nonce, plaintext.encode("utf-8"), header)
+        return (_TAG + base64.urlsafe_b64encode(header + nonce + ciphertext)).decode()
+
+    @staticmethod
+    def _split(ciphertext: Union[str, bytes]) -> tuple[bytes, bytes, bytes, bytes]:
+        """ Returns (header, key id, nonce, ciphertext) """
+        if isinstance(ciphertext, str):
+            ciphertext = ciphertext.encode()
+        if not isinstance(ciphertext, bytes):
+            raise TypeError("ciphertext should be str or bytes")
+
+        if not ciphertext.startswith(_TAG):
+            raise ValueError("Invalid ciphertext")
+        raw = base64.b64decode(ciphertext[len(_TAG):], altchars=b"-_", validate=True)
+        if len(raw) <= _HEADER_SIZE + _NONCE_SIZE or raw[:1] != _VERSION:
+            raise ValueError("Invalid ciphertext")
+
+        header = raw[:_HEADER_SIZE]
+        nonce = raw[_HEADER_SIZE:_HEADER_SIZE + _NONCE_SIZE]
+        return header, header[1:], nonce, raw[_HEADER_SIZE + _NONCE_SIZE:]
+
+    def encrypt(self, plaintext: str) -> str:
+        """ Encrypts and returns ciphertext """
+        key_id, aead = self._encryption_key(1)
+        return self._seal(key_id, aead, plaintext)
+
+    def decrypt(self, ciphertext: Union[str, bytes]) -> str:
+        """ Decrypts and returns plaintext """
+        header, key_id, nonce, data = self._split(ciphertext)
+        return self._decryption_key(key_id).decrypt(nonce, data, header).decode("utf-8")
+
+    def encrypt_many(self, plaintexts: Iterable[str]) -> list[str]:
+        """ Encrypts a batch of values with one data key """
+        plaintexts = list(plaintexts)
+        if not plaintexts:
+            return []
+        key_id, aead = self._encryption_key(len(plaintexts))
+        return [self._seal(key_id, aead, plaintext) for plaintext in plaintexts]
+
+    def decrypt_many(self, ciphertexts: Iterable[Union[str, bytes]]) -> list[str]:
+        """ Decrypts a batch of values, each data key is resolved once per batch """
+        aeads = {}
+        plaintexts = []
+        for ciphertext in ciphertexts:
+            header, key_id, nonce, data = self._split(ciphertext)
+            aead = aeads.get(key_id)
+            if aead is None:
+                aead = aeads[key_id] = self._decryption_key(key_id)
+            plaintexts.append(aead.decrypt(nonce, data, header).decode("utf-8"))
+        return plaintexts
@@ -0,0 +1,116 @@
+"""
+Key Providers
+-------------
+
+Master key providers that generate and unwrap data keys
+"""
+import hashlib
+import os
+import time
+from typing import Union
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+__all__ = ["KeyProvider", "KMSKeyProvider", "LocalKeyProvider"]
+
+# Size of data keys in bytes (AES-256)
+DATA_KEY_SIZE = 32
+
+
+class KeyProvider:
+    """ Base class of master key providers """
+
+    def generate_data_key(self) -> tuple[bytes, bytes, str]:
+        """ Returns a new data key as (plaintext key, wrapped key, master key id) """
+        raise NotImplementedError
+
+    def unwrap_data_key(self, wrapped_key: bytes, master_key_id: str) -> bytes:
+        """ Returns plaintext of a wrapped data key """
+        raise NotImplementedError
+
+
+class KMSKeyProvider(KeyProvider):
+    """ Generates data keys using AWS KMS (one remote call per data key, not per value) """
+
+    def __init__(self, key_id: str, region_name: str="ap-southeast-1", client=None) -> None:
+        self.key_id = key_id
+        self.region_name = region_name
+        self._client = client
+        self._pid = None  # Process the client was created in (None if it was given)
+
+    @property
+    def client(self):
+        """ KMS client (session and client are only created once per process) """
+        # Connections of a client created before fork cannot be shared with the parent
+        if self._client is None or self._pid not in (None, os.getpid()):
+            import boto3  # Only needed when KMS is actually used
+
+            session = boto3.session.Session(
+                aws_access_key_id=os.environ.get("ACCESS_KEY_ID"),
+                aws_secret_access_key=os.environ.get("SECRET_ACCESS_KEY"),
+                region_name=self.region_name
+            )
+            self._client = session.client(service_name="kms")
+            self._pid = os.getpid()
+        return self._client
+
+    def generate_data_key(self) -> tuple[bytes, bytes, str]:
+        result = self.client.generate_data_key(KeyId=self.key_id, KeySpec="AES_256")
+        return result["Plaintext"], result["CiphertextBlob"], self.key_id
+
+    def unwrap_data_key(self, wrapped_key: bytes, master_key_id: str) -> bytes:
+        # Wrapped key identifies its own master key, KeyId only pins it
+        return self.client.decrypt(CiphertextBlob=wrapped_key, KeyId=master_key_id)["Plaintext"]
+
+
+class LocalKeyProvider(KeyProvider):
+    """
+    Wraps data keys with a master key stored in a local file
+    (stand-in for KMS when testing or running without AWS credentials)
+    """
+
+    def __init__(self, path: str, master_key: Union[bytes, None]=None) -> None:
+        self.path = path
+        if master_key is None:
+            master_key = self._load_or_create(path)
+        if len(master_key) != DATA_KEY_SIZE:
+            raise ValueError(f"Master key must be {DATA_KEY_SIZE} bytes")
+        self._aead = AESGCM(master_key)
+        self.master_key_id = "local:" + hashlib.sha256(master_key).hexdigest()[:16]
+
+    @staticmethod
+    def _load_or_create(path: str) -> bytes:
+        """ Reads master key from file, creates file (owner only) with a random key if missing """
+        if not os.path.isfile(path):
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            master_key = AESGCM.generate_key(bit_length=DATA_KEY_SIZE * 8)
+            try:
+                # Fails if another process created it first, so every process ends up with the same key
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600)
+            except FileExistsError:
+                pass
+            else:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(master_key)
+                return master_key
+
+        # The process that created the file may still be writing the key
+        for _ in range(50):
+            with open(path, "rb") as f:
+                master_key = f.read()
+            if len(master_key) >= DATA_KEY_SIZE:
+                break
+            time.sleep(0.01)
+        return master_key
+
+    def generate_data_key(self) -> tuple[bytes, bytes, str]:
+        data_key = AESGCM.generate_key(bit_length=DATA_KEY_SIZE * 8)
+        nonce = os.urandom(12)
+        wrapped_key = nonce + self._aead.encrypt(nonce, data_key, self.master_key_id.encode())
+        return data_key, wrapped_key, self.master_key_id
+
+    def unwrap_data_key(self, wrapped_key: bytes, master_key_id: str) -> bytes:
+        if master_key_id != self.master_key_id:
+            raise ValueError(f"Data key was wrapped by another master key: {master_key_id}")
+        return self._aead.decrypt(wrapped_key[:12], wrapped_key[12:], master_key_id.encode())
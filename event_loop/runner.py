@@ -0,0 +1,81 @@
+"""
+Event Loop Runner
+-----------------
+
+Runs the coroutines of async views on one event loop per process
+
+Usage:
+    app.async_to_sync = async_to_sync  # In create_app, Flask then runs async views with it
+    result = run(coroutine)  # From a request thread, waits for coroutine
+
+Flask's default (asgiref) starts a new event loop for every request, but async
+clients of remote APIs (Gmail, Stripe) keep connection pools bound to the loop
+they were created in. Instead, every request thread of the process (WSGI or
+ASGI) hands its view to a loop in a daemon thread and waits for it, so requests
+waiting on remote APIs share one loop and one connection pool per API.
+Blocking calls (SQLite) in async views go through asyncio.to_thread.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+from concurrent.futures import Future
+from functools import wraps
+from typing import Any, Awaitable, Callable, Coroutine
+
+__all__ = ["get_loop", "run", "async_to_sync"]
+
+_loop = None
+_pid = None  # Process the loop was started in
+_lock = threading.Lock()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """ Returns the loop of this process, started on first use """
+    global _loop, _pid
+    with _lock:
+        # The thread of a loop started before fork (e.g. by a preloading server) does not exist in the worker
+        if _loop is None or _pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name="event-loop", daemon=True).start()
+        return _loop
+
+
+def _copy_result(task: asyncio.Task, future: Future) -> None:
+    if task.cancelled():
+        future.cancel()
+    elif task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
+
+
+def run(coroutine: Coroutine) -> Any:
+    """ Runs coroutine on the loop and returns its result, blocking the calling thread meanwhile """
+    loop = get_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        coroutine.close()
+        raise RuntimeError("run() would block the event loop it waits on")
+
+    # The task runs in the caller's context, so Flask's request and app contexts are available in it
+    future = Future()
+
+    def start() -> None:
+        loop.create_task(coroutine).add_done_callback(lambda task: _copy_result(task, future))
+
+    loop.call_soon_threadsafe(start, context=contextvars.copy_context())
+    return future.result()
+
+
+def async_to_sync(func: Callable[..., Awaitable]) -> Callable:
+    """ Returns a sync function running the async func on the loop (for Flask.async_to_sync) """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return run(func(*args, **kwargs))
+    return wrapper
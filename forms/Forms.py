@@ -179,6 +179,12 @@ class DeleteUserForm(Form):
     user_id = StringField(validators=[validators.InputRequired(message="")])
 
 
+# Choices of AddBookForm (also used by import_books.py)
+lang_list = [('', 'Select'), ('English', 'English'), ('Chinese', 'Chinese'), ('Malay', 'Malay'), ('Tamil', 'Tamil')]
+category_list = [('', 'Select'), ('Action & Adventure', 'Action & Adventure'), ('Classic', 'Classic'),
+                 ('Comic', 'Comic'), ('Detective & Mystery', 'Detective & Mystery')]
+
+
 class AddBookForm(Form):
     """ Form used for adding books into inventory """
 
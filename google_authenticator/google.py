@@ -1,22 +1,20 @@
 from __future__ import print_function
 
-import base64
-from email.message import EmailMessage
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-
 import os.path
 
+# Google client libraries are slow to import, so they are imported when the first email is sent
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-def get_service():
-    """Shows basic usage of the Gmail API.
-    Lists the user's Gmail labels.
+def get_credentials():
+    """Returns the Gmail API credentials from token.json,
+    refreshing them (or letting the user log in) when they are not valid.
     """
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
@@ -34,6 +32,17 @@ def get_service():
         # Save the credentials for the next run
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
+    return creds
+
+
+def get_service():
+    """Shows basic usage of the Gmail API.
+    Lists the user's Gmail labels.
+    """
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
+    creds = get_credentials()
 
     try:
         # Call the Gmail API
@@ -1,10 +1,32 @@
+import asyncio
 import base64
-from google_authenticator import get_service
+from threading import Lock
+from weakref import WeakKeyDictionary
+from google_authenticator import get_service, get_credentials
 from email.message import EmailMessage
+from metrics import EMAILS_SENT
 
-from googleapiclient.errors import HttpError
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+GMAIL_SEND_URL = "https://gmail.googleapis.com/gmail/v1/users/me/messages/send"
+GMAIL_TIMEOUT = 10  # Seconds to wait on Gmail before the email counts as failed
+
+_credentials = None
+_credentials_lock = Lock()
+_clients = WeakKeyDictionary()  # HTTP client of each event loop (its connections belong to the loop)
+_transport = None  # httpx transport of new clients (None for the network, benchmarks stub Gmail with it)
+
+
+def encode_message(email, subject, content):
+    """ Returns the email as the raw (urlsafe base64) message Gmail sends """
+    message = EmailMessage()
+
+    message.set_content(content)
+
+    message['To'] = email
+    message['From'] = 'noreplybbb02@gmail.com'
+    message['Subject'] = subject
+
+    # encoded message
+    return base64.urlsafe_b64encode(message.as_bytes()).decode()
 
 
 def gmail_send(email, subject, content):
@@ -16,29 +38,62 @@ def gmail_send(email, subject, content):
     TODO(developer) - See https://developers.google.com/identity
     for guides on implementing OAuth2 for the application.
     """
+    from googleapiclient.errors import HttpError
     service = get_service()
 
     try:
-        message = EmailMessage()
-
-        message.set_content(content)
-
-        message['To'] = email
-        message['From'] = 'noreplybbb02@gmail.com'
-        message['Subject'] = subject
-
-        # encoded message
-        encoded_message = base64.urlsafe_b64encode(message.as_bytes()) \
-            .decode()
-
         create_message = {
-            'raw': encoded_message
+            'raw': encode_message(email, subject, content)
         }
         # pylint: disable=E1101
         send_message = (service.users().messages().send
                         (userId="me", body=create_message).execute())
         print(F'Message Id: {send_message["id"]}')
+        EMAILS_SENT.inc(status="sent")
     except HttpError as error:
         print(F'An error occurred: {error}')
+        EMAILS_SENT.inc(status="failed")
+        send_message = None
+    return send_message
+
+
+def get_access_token():
+    """ Returns an access token of the Gmail API, credentials are loaded once and refreshed when expired """
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None or not _credentials.valid:
+            _credentials = get_credentials()
+        return _credentials.token
+
+
+def _client():
+    """ Returns the HTTP client of the running event loop (connections are reused between emails) """
+    import httpx  # Only needed when emails are sent
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(timeout=GMAIL_TIMEOUT, transport=_transport)
+    return client
+
+
+async def gmail_send_async(email, subject, content):
+    """
+    Same as gmail_send, but waits for Gmail without holding a thread (from async views)
+    Sends with the Gmail REST API, credentials are read (and refreshed) in a thread
+    """
+    import httpx
+
+    try:
+        token = await asyncio.to_thread(get_access_token)
+        response = await _client().post(GMAIL_SEND_URL, json={'raw': encode_message(email, subject, content)},
+                                        headers={'Authorization': f'Bearer {token}'})
+        response.raise_for_status()
+        send_message = response.json()
+        print(F'Message Id: {send_message["id"]}')
+        EMAILS_SENT.inc(status="sent")
+    except httpx.HTTPError as error:
+        print(F'An error occurred: {error}')
+        EMAILS_SENT.inc(status="failed")
         send_message = None
-    return send_message
\ No newline at end of file
+    return send_message
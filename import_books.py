@@ -0,0 +1,193 @@
+"""
+Import Books
+------------
+
+Bulk imports books into the catalogue from a CSV or JSON Lines file
+
+Usage:
+    python import_books.py books.csv [--batch-size 5000] [--workers 4]
+
+Columns (CSV header or JSON keys): title, author, language, genre, price,
+stock, description and cover (image path, relative to the imported file).
+Rows are validated with the same rules as AddBookForm. A book with the same
+title, author and language as an existing book updates it instead, so an
+import can be safely re-run. Cover is optional when updating a book.
+Rows repeating a book in the same batch are merged (later values win, but a
+cover given by any of them is kept). Covers are saved before the rows that
+point at them are committed.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterator, Optional
+from PIL import Image
+from werkzeug.datastructures import MultiDict
+from cache_handler import bump_catalogue_version
+from forms import AddBookForm, lang_list, category_list
+from models import BOOK_IMG_UPLOAD_FOLDER
+import db_fetch as dbf
+
+DEFAULT_BATCH_SIZE = 5000
+COVERS_PER_TASK = 64  # Covers resized per worker task (fewer round trips to the pool)
+BOOK_UPLOAD_FOLDER = BOOK_IMG_UPLOAD_FOLDER[1:]
+COVER_SIZE = (259, 371)  # Same size as covers uploaded through add_book()
+ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png"}
+
+
+def read_rows(path: str) -> Iterator[tuple[int, dict]]:
+    """ Yields (line number, row) from a CSV or JSON Lines file one at a time """
+    with open(path, newline="", encoding="utf-8") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line_no, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    row = None
+                yield line_no, row if isinstance(row, dict) else {}
+        else:
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+
+
+_form = None
+
+
+def validate_row(row: dict, base_dir: str) -> tuple[Optional[dict], Optional[str]]:
+    """ Returns (book, None) if row passes AddBookForm validation, else (None, error) """
+    global _form
+
+    # One form per process is reused for every row (building a form is slower than validating it)
+    if _form is None:
+        _form = AddBookForm()
+        _form.language.choices = lang_list
+        _form.category.choices = category_list
+
+    fields = dict(language=row.get("language"),
+                  category=row.get("genre", row.get("category")),
+                  title=row.get("title"),
+                  author=row.get("author"),
+                  price=row.get("price"),
+                  stock=row.get("stock"),
+                  description=row.get("description"))
+    _form.process(MultiDict({key: str(value) for key, value in fields.items() if value is not None}))
+    if not _form.validate():
+        return None, "; ".join(f"{field}: {', '.join(errors)}" for field, errors in _form.errors.items())
+
+    cover = row.get("cover") or None
+    if cover is not None:
+        cover = os.path.join(base_dir, cover)
+        if cover.rsplit(".", 1)[-1].lower() not in ALLOWED_EXTENSIONS:
+            return None, f"cover: must be one of {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+        if not os.path.isfile(cover):
+            return None, f"cover: {cover} does not exist"
+
+    return dict(book_id=str(uuid.uuid4()),
+                language=_form.language.data,
+                genre=_form.category.data,
+                title=_form.title.data,
+                stock=_form.stock.data,
+                price=_form.price.data,
+                author=_form.author.data,
+                description=_form.description.data,
+                cover=cover), None
+
+
+def validate_batch(batch: list[tuple[int, dict]], base_dir: str) -> tuple[dict, list[str]]:
+    """ Validates a batch of rows, returns (books by natural key, errors) (runs in a worker process) """
+    books, errors = {}, []
+    for line_no, row in batch:
+        book, error = validate_row(row, base_dir)
+        if error is not None:
+            errors.append(f"Line {line_no}: {error}")
+            continue
+
+        # Rows of the same book are merged, later values win except a missing cover (title is NOCASE in sqlite)
+        key = book["title"].lower(), book["author"], book["language"]
+        if key in books:
+            book.update(book_id=books[key]["book_id"], cover=book["cover"] or books[key]["cover"])
+        books[key] = book
+    return books, errors
+
+
+def process_covers(covers: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """ Resizes and saves covers as <book_id>.png, returns (book_id, error) of failed covers (runs in a worker process) """
+    errors = []
+    for book_id, source in covers:
+        try:
+            with Image.open(source) as image:
+                image.resize(COVER_SIZE).save(os.path.join(BOOK_UPLOAD_FOLDER, f"{book_id}.png"))
+        except (OSError, ValueError) as error:
+            errors.append((book_id, f"{source}: {error}"))
+    return errors
+
+
+def import_books(path: str, batch_size: int=DEFAULT_BATCH_SIZE, workers: int=None) -> dict[str, int]:
+    """ Imports books batch by batch, returns counts of inserted, updated, skipped and rejected rows """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    workers = workers or os.cpu_count() or 1
+    stats = dict(inserted=0, updated=0, skipped=0, rejected=0, cover_errors=0)
+    rows = read_rows(path)
+    batches = iter(lambda: list(islice(rows, batch_size)), [])
+    validating = deque()
+
+    dbf.upgrade_schema()
+    with dbf.bulk_connection() as connection, ProcessPoolExecutor(workers) as pool:
+        def save_covers(covers: list[tuple[str, str]]) -> list[tuple[str, str]]:
+            # Split between workers, next batches keep validating meanwhile
+            tasks = [pool.submit(process_covers, covers[i:i + COVERS_PER_TASK])
+                     for i in range(0, len(covers), COVERS_PER_TASK)]
+            return [error for task in tasks for error in task.result()]
+
+        while True:
+            # Keep a few batches validating in the pool while this one is written
+            # (bounded, so the file is never read into memory all at once)
+            for batch in islice(batches, workers + 1 - len(validating)):
+                validating.append(pool.submit(validate_batch, batch, base_dir))
+            if not validating:
+                break
+
+            books, errors = validating.popleft().result()
+            stats["rejected"] += len(errors)
+            for error in errors:
+                print(error, file=sys.stderr)
+
+            # Covers are saved before the batch is committed, books whose cover failed are not pointed at it
+            cover_errors, inserted, updated = dbf.upsert_books(connection, list(books.values()), save_covers)
+            stats["inserted"] += inserted
+            stats["updated"] += updated
+            stats["skipped"] += len(books) - inserted - updated
+            stats["cover_errors"] += len(cover_errors)
+            for _, error in cover_errors:
+                print(f"Cover {error}", file=sys.stderr)
+
+    if stats["inserted"] or stats["updated"]:
+        bump_catalogue_version()
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Bulk imports books from a CSV or JSON Lines file")
+    parser.add_argument("path", help="CSV file, or JSON Lines file ending with .jsonl/.ndjson")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="rows per transaction")
+    parser.add_argument("--workers", type=int, default=None, help="processes validating rows and resizing covers (default: CPU count)")
+    args = parser.parse_args()
+
+    stats = import_books(args.path, args.batch_size, args.workers)
+    print(f"\033[0;31mInserted {stats['inserted']}, updated {stats['updated']} books!\033[0m")
+    if stats["skipped"]:
+        print(f"Skipped {stats['skipped']} new books without a cover (or whose cover could not be saved)")
+    if stats["rejected"] or stats["cover_errors"]:
+        print(f"Rejected {stats['rejected']} rows, {stats['cover_errors']} covers could not be saved")
+
+
+if __name__ == "__main__":
+    main()
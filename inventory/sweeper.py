@@ -0,0 +1,67 @@
+"""
+Hold Sweeper
+------------
+
+Deletes expired stock holds in a background thread
+
+Usage:
+    hold_sweeper = HoldSweeper()
+    dbf.update_cart_lines(...)  # In the view changing the cart (holds its books)
+    hold_sweeper.start()
+
+    python -m inventory.sweeper  # Deletes expired holds once (e.g. from cron)
+
+Expired holds no longer count against stock (every query checks expires), so
+the sweeper only keeps the StockHolds table and its indexes small.
+"""
+import logging
+import os
+import threading
+import db_fetch as dbf
+
+__all__ = ["HoldSweeper", "SWEEP_INTERVAL"]
+
+SWEEP_INTERVAL = 60  # Seconds between sweeps
+
+logger = logging.getLogger(__name__)
+
+
+class HoldSweeper:
+    """ Daemon thread deleting expired holds every SWEEP_INTERVAL seconds """
+
+    def __init__(self, interval: float=SWEEP_INTERVAL) -> None:
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self) -> None:
+        """ Starts the thread in this process if it is not running """
+        # Threads do not survive a fork
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None:
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="hold-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        stop = threading.Event()
+        while not stop.wait(self.interval):
+            try:
+                deleted = dbf.delete_expired_holds()
+                if deleted:
+                    logger.info(f"{deleted} expired stock holds deleted")
+            except Exception:
+                logger.exception("Hold sweeper failed")  # Database busy or gone, try again later
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    dbf.upgrade_schema()
+    print(f"{dbf.delete_expired_holds()} expired stock holds deleted")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# File to allow imports (importing registers the sqlite:// storage scheme with Flask-Limiter)
+from .sqlite_storage import *
@@ -0,0 +1,166 @@
+"""
+SQLite Rate Limit Storage
+-------------------------
+
+Fixed-window counter storage for Flask-Limiter shared by every worker on the host
+
+Usage:
+    Limiter(app, key_func=..., storage_uri="sqlite:///cache/ratelimit.db?stripes=4")
+
+Counters are striped across `stripes` database files by key hash, so workers
+incrementing different keys do not wait on the same write lock. Each increment
+is a single upsert in its own transaction. Expired counters are deleted
+periodically so the files do not grow without bound.
+"""
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from contextlib import closing
+from typing import Union
+from urllib.parse import urlparse, parse_qs
+from limits.storage import Storage
+
+__all__ = ["SQLiteStorage"]
+
+# Seconds between deleting expired counters (per stripe, per process)
+_COMPACT_INTERVAL = 60
+
+# Write lock wait (seconds) before giving up
+_BUSY_TIMEOUT = 5
+
+_CREATE_TABLE = """CREATE TABLE IF NOT EXISTS RateLimits (
+    key TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    expiry REAL NOT NULL,
+    PRIMARY KEY (key)
+) WITHOUT ROWID;"""
+
+# Starts a new window if current one has expired, else adds to it
+_INCREMENT = """INSERT INTO RateLimits (key, count, expiry) VALUES (:key, :amount, :expiry)
+ON CONFLICT (key) DO UPDATE SET
+    count = CASE WHEN expiry <= :now THEN excluded.count ELSE count + excluded.count END,
+    expiry = CASE WHEN expiry <= :now OR :elastic THEN excluded.expiry ELSE expiry END;"""
+
+
+class SQLiteStorage(Storage):
+    """ Rate limit storage backed by SQLite files """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, **options) -> None:
+        # Options in uri query override keyword options
+        parsed = urlparse(uri)
+        query = {key: value[-1] for key, value in parse_qs(parsed.query).items()}
+        self.stripes = int(query.get("stripes", options.pop("stripes", 1)))
+        if self.stripes < 1:
+            raise ValueError("Stripes should be at least 1")
+
+        # sqlite:///relative/path.db or sqlite:////absolute/path.db
+        path = parsed.path[1:] if parsed.path.startswith("/") else parsed.path
+        if not path:
+            raise ValueError("Database path must be specified, e.g. sqlite:///cache/ratelimit.db")
+        root, ext = os.path.splitext(path)
+        self.paths = [path] if self.stripes == 1 else [f"{root}.{i}{ext or '.db'}" for i in range(self.stripes)]
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._local = threading.local()
+        self._last_compact = [0.0] * self.stripes
+
+        super().__init__(uri, **options)
+
+        for i in range(self.stripes):
+            self._connection(i).execute(_CREATE_TABLE)
+
+    @property
+    def base_exceptions(self) -> Union[type[Exception], tuple[type[Exception], ...]]:
+        return sqlite3.Error
+
+    def _connection(self, stripe: int) -> sqlite3.Connection:
+        """ Returns connection to stripe for current thread (reconnects after fork) """
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            local.pid = os.getpid()
+            local.connections = {}
+
+        connection = local.connections.get(stripe)
+        if connection is None:
+            # Autocommit mode, transactions are started explicitly
+            connection = sqlite3.connect(self.paths[stripe], timeout=_BUSY_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL;")
+            connection.execute("PRAGMA synchronous = OFF;")  # Counters can be lost on power failure
+            local.connections[stripe] = connection
+        return connection
+
+    def _stripe(self, key: str) -> int:
+        """ Returns stripe which key is stored in """
+        if self.stripes == 1:
+            return 0
+        return zlib.crc32(key.encode()) % self.stripes
+
+    def _compact(self, stripe: int, now: float) -> None:
+        """ Deletes expired counters once in a while """
+        if now - self._last_compact[stripe] < _COMPACT_INTERVAL:
+            return
+        self._last_compact[stripe] = now
+        self._connection(stripe).execute("DELETE FROM RateLimits WHERE expiry <= ?;", (now,))
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool=False, amount: int=1) -> int:
+        """ Increments counter of key and returns new value """
+        stripe = self._stripe(key)
+        connection = self._connection(stripe)
+        now = time.time()
+
+        with closing(connection.cursor()) as cursor:
+            cursor.execute("BEGIN IMMEDIATE;")
+            try:
+                cursor.execute(_INCREMENT, {
+                    "key": key, "amount": amount, "expiry": now + expiry, "now": now, "elastic": elastic_expiry
+                })
+                count = cursor.execute("SELECT count FROM RateLimits WHERE key = ?;", (key,)).fetchone()[0]
+            except BaseException:
+                cursor.execute("ROLLBACK;")
+                raise
+            cursor.execute("COMMIT;")
+
+        self._compact(stripe, now)
+        return count
+
+    def get(self, key: str) -> int:
+        """ Returns counter of key (0 if expired) """
+        data = self._connection(self._stripe(key)).execute(
+            "SELECT count FROM RateLimits WHERE key = ? AND expiry > ?;", (key, time.time())
+        ).fetchone()
+        return data[0] if data else 0
+
+    def get_expiry(self, key: str) -> float:
+        """ Returns time (epoch seconds) when counter of key resets """
+        now = time.time()
+        data = self._connection(self._stripe(key)).execute(
+            "SELECT expiry FROM RateLimits WHERE key = ? AND expiry > ?;", (key, now)
+        ).fetchone()
+        return data[0] if data else now
+
+    def check(self) -> bool:
+        """ Checks if every stripe can be queried """
+        try:
+            for i in range(self.stripes):
+                self._connection(i).execute("SELECT 1;").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def reset(self) -> Union[int, None]:
+        """ Clears all counters and returns number cleared """
+        cleared = 0
+        for i in range(self.stripes):
+            cleared += self._connection(i).execute("DELETE FROM RateLimits;").rowcount
+        return cleared
+
+    def clear(self, key: str) -> None:
+        """ Clears counter of key """
+        self._connection(self._stripe(key)).execute("DELETE FROM RateLimits WHERE key = ?;", (key,))
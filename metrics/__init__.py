@@ -0,0 +1,3 @@
+# File to allow imports
+from .registry import *
+from .metrics import *
@@ -0,0 +1,25 @@
+"""
+Metrics
+-------
+
+Metrics recorded by the app (exposed at /metrics)
+"""
+from .registry import Counter, Histogram
+
+__all__ = [
+    "HTTP_REQUESTS", "HTTP_REQUEST_SECONDS", "DB_QUERY_SECONDS", "RATE_LIMITED",
+    "CACHE_REQUESTS", "EMAILS_SENT", "IMAGE_PROCESSING_SECONDS"
+]
+
+HTTP_REQUESTS = Counter("http_requests_total", "Requests handled", ("method", "endpoint", "status"))
+HTTP_REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time taken to handle requests", ("method", "endpoint"))
+
+# Queries are not labelled (there are too many distinct ones), see /debug/queries for those
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "Time taken by database queries",
+                             buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests rejected by the rate limiter", ("endpoint",))
+CACHE_REQUESTS = Counter("cache_requests_total", "Lookups of in-memory caches", ("cache", "result"))
+EMAILS_SENT = Counter("emails_sent_total", "Emails sent through Gmail", ("status",))
+IMAGE_PROCESSING_SECONDS = Histogram("image_processing_duration_seconds", "Time taken to resize and save images",
+                                     ("operation",))
@@ -0,0 +1,221 @@
+"""
+Metrics Registry
+----------------
+
+Counters and histograms exposed in the Prometheus text exposition format
+
+Usage:
+    REQUESTS = Counter("http_requests_total", "Requests handled", ("method", "status"))
+    REQUESTS.inc(method="GET", status="200")
+    with LATENCY.time(endpoint="home"):
+        ...
+    REGISTRY.exposition()  # Text of all workers
+
+Every worker keeps its values in memory and writes them (at most every
+FLUSH_INTERVAL seconds) to its own file in METRICS_DIR, exposition() adds up
+the files of all workers. A worker forked after values were recorded starts
+from zero with a new file, so values are never counted twice. Files of workers
+that have exited are kept (counters must not go down), clear METRICS_DIR when
+deploying.
+"""
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterable
+
+__all__ = ["Counter", "Histogram", "Registry", "REGISTRY", "METRICS_DIR", "DEFAULT_BUCKETS"]
+
+METRICS_DIR = os.environ.get("METRICS_DIR", "cache/metrics")
+FLUSH_INTERVAL = 1  # Seconds between writes of a worker's values
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # Seconds
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f"{{{labels}}}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """ Metric with values per combination of labels """
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str]=(), registry: "Registry"=None) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def merge(self, total: dict, values: list) -> None:
+        """ Adds values (read from a worker's file) to total """
+        raise NotImplementedError
+
+    def samples(self, values: dict) -> Iterable[str]:
+        """ Yields exposition lines of values """
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """ Value that only goes up """
+    TYPE = "counter"
+
+    def inc(self, amount: float=1, **labels) -> None:
+        if amount < 0:
+            raise ValueError("Counters can only be increased")
+        key = self._key(labels)
+        with self.registry.lock:
+            values = self.registry.values_of(self)
+            values[key] = values.get(key, 0) + amount
+
+    def merge(self, total: dict, values: list) -> None:
+        for key, value in values:
+            total[tuple(key)] = total.get(tuple(key), 0) + value
+
+    def samples(self, values: dict) -> Iterable[str]:
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    """ Counts of observed values in buckets, with their sum """
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str]=(),
+                 buckets: Iterable[float]=DEFAULT_BUCKETS, registry: "Registry"=None) -> None:
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self.registry.lock:
+            values = self.registry.values_of(self)
+            counts = values.get(key)
+            if counts is None:
+                counts = values[key] = [0] * len(self.buckets) + [0.0]  # Count per bucket, then sum
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observes seconds taken by the with block """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def merge(self, total: dict, values: list) -> None:
+        for key, counts in values:
+            current = total.setdefault(tuple(key), [0] * len(self.buckets) + [0.0])
+            for i, count in enumerate(counts):
+                current[i] += count
+
+    def samples(self, values: dict) -> Iterable[str]:
+        names = self.labelnames + ("le",)
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(counts[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """ Metrics of this worker, written to (and added up from) files in directory """
+
+    def __init__(self, directory: str=METRICS_DIR) -> None:
+        self.directory = directory
+        self.metrics: dict[str, _Metric] = {}
+        self.lock = threading.Lock()
+        self._values: dict[str, dict] = {}
+        self._pid = None
+        self._file = None
+        self._flushed = 0.0
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+
+    def values_of(self, metric: _Metric) -> dict:
+        """ Returns values of metric in this worker (call with lock held) """
+        # Forked worker, values recorded before the fork belong to the parent's file
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._file = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+            self._values = {}
+        return self._values.setdefault(metric.name, {})
+
+    def flush(self, force: bool=False) -> None:
+        """ Writes this worker's values to its file (at most every FLUSH_INTERVAL seconds unless forced) """
+        now = time.monotonic()
+        if self._pid != os.getpid() or not force and now - self._flushed < FLUSH_INTERVAL:
+            return
+
+        with self.lock:
+            self._flushed = now
+            data = {name: [[list(key), value] for key, value in values.items()]
+                    for name, values in self._values.items()}
+            path = self._file
+
+        # Replaced atomically, so readers never see a partly written file
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(data, file)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> dict[str, dict]:
+        """ Returns values of all workers added up by metric name """
+        self.flush(force=True)
+        totals = {name: {} for name in self.metrics}
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue  # Removed (or being cleared) while reading
+            for metric_name, values in data.items():
+                metric = self.metrics.get(metric_name)
+                if metric is not None:
+                    metric.merge(totals[metric_name], values)
+        return totals
+
+    def exposition(self) -> str:
+        """ Returns metrics of all workers in the text exposition format """
+        lines = []
+        for name, values in self.collect().items():
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.TYPE}")
+            lines.extend(metric.samples(values))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
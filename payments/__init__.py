@@ -0,0 +1,6 @@
+# File to allow imports
+from .webhook import *
+from .stub import *
+from .checkout import *
+from .prices import *
+from .worker import *
@@ -0,0 +1,61 @@
+"""
+Stripe Checkout
+---------------
+
+Creates Stripe checkout sessions for pending payments
+
+Usage:
+    stripe = get_stripe(app.config)  # The stripe library, or the stub when STRIPE_STUB is set
+    line_items = await checkout_line_items(stripe, stripe_mode(app.config), lines, shipping_option)
+    session_id, session_url = await create_checkout_session(stripe, order_id, created, line_items, success_url, cancel_url)
+
+Sessions are created with the order id as idempotency key, so a retried
+request (e.g. after a timeout) gets the same session instead of a second one.
+Stripe only replays a request with the same parameters, so the expiry is
+derived from when the payment was created, not from when the call is made.
+Stripe is called with its async client (httpx), from async views.
+"""
+from hashlib import sha1
+from typing import Iterable
+from .stub import STRIPE_STUB
+
+__all__ = ["CURRENCY", "SESSION_EXPIRY", "MIN_SESSION_EXPIRY", "get_stripe", "cart_hash", "create_checkout_session"]
+
+CURRENCY = "sgd"
+SESSION_EXPIRY = 3600  # Seconds before an unpaid checkout session expires (Stripe allows 30 mins to 24 hours)
+MIN_SESSION_EXPIRY = 1800  # Stripe rejects sessions expiring sooner than this after they are created
+
+
+def get_stripe(config):
+    """ Returns the stripe library set up with the secret key (or the stub) """
+    if config.get("STRIPE_STUB"):
+        return STRIPE_STUB
+
+    import stripe  # Slow to import and only needed when checking out
+    stripe.api_key = config["STRIPE_SECRET_KEY"]
+    return stripe
+
+
+def cart_hash(items: Iterable[tuple[str, int, int]], shipping_option: str) -> str:
+    """ Returns a hash of (book_id, quantity, unit_amount) items, equal for the same cart at the same prices """
+    return sha1(repr((sorted(items), shipping_option)).encode()).hexdigest()
+
+
+async def create_checkout_session(stripe, order_id: str, created: int, line_items: list[dict],
+                            success_url: str, cancel_url: str) -> tuple[str, str]:
+    """
+    Creates the checkout session of a payment created at unix time created (see checkout_line_items),
+    returns (session id, url)
+    """
+    session = await stripe.checkout.Session.create_async(
+        line_items=line_items,
+        payment_method_types=['card'],
+        mode='payment',
+        client_reference_id=order_id,
+        metadata={'order_id': order_id},
+        expires_at=created + SESSION_EXPIRY,
+        success_url=success_url,
+        cancel_url=cancel_url,
+        idempotency_key=f"checkout-{order_id}",
+    )
+    return session.id, session.url
@@ -0,0 +1,80 @@
+"""
+Stripe Prices
+-------------
+
+Maps books (and shipping options) to Stripe prices, so checkout sessions are
+itemised with one line per book
+
+Usage:
+    line_items = await checkout_line_items(stripe, stripe_mode(config), lines, "Standard Delivery")
+
+Stripe prices cannot change amount, so a price is created (with its product,
+reused for later prices of the same book) the first time a book is checked out
+at an amount, and its id is kept in the StripePrices table and in memory.
+Ids are kept per mode, as live, test and stub prices are unknown to each other.
+Missing prices of a checkout are created with concurrent requests to Stripe.
+"""
+import asyncio
+from typing import Iterable
+from cache_handler import MemoryCache
+import db_fetch as dbf
+from .checkout import CURRENCY
+
+__all__ = ["SHIPPING_FEES", "PRICE_CACHE_SIZE", "stripe_mode", "get_price_ids", "checkout_line_items"]
+
+SHIPPING_FEES = {"Standard Delivery": 500}  # Cents per order
+PRICE_CACHE_SIZE = 4096  # Max number of price ids kept per worker
+
+_price_ids = MemoryCache(PRICE_CACHE_SIZE, name="stripe_prices")
+
+
+def stripe_mode(config) -> str:
+    """ Returns "stub", "live" or "test", the set of Stripe ids the app is using """
+    if config.get("STRIPE_STUB"):
+        return "stub"
+    return "live" if config["STRIPE_SECRET_KEY"].startswith("sk_live_") else "test"
+
+
+async def get_price_ids(stripe, mode: str, items: Iterable[tuple[str, str, int]]) -> list[str]:
+    """ Returns price ids of (item_id, name, unit_amount in cents) items, creating missing prices """
+    items = list(items)
+    price_ids = {(item_id, unit_amount): _price_ids.get((mode, CURRENCY, item_id, unit_amount))
+                 for item_id, _, unit_amount in items}
+
+    missing = [(item_id, name, unit_amount) for item_id, name, unit_amount in items
+               if price_ids[item_id, unit_amount] is None]
+    if missing:
+        known, products = await asyncio.to_thread(dbf.retrieve_stripe_prices, mode, CURRENCY,
+                                                  {item_id for item_id, _, _ in missing})
+
+        async def create_price(item_id: str, name: str, unit_amount: int) -> str:
+            # Idempotency key stops two workers creating the same price at once
+            price = await stripe.Price.create_async(
+                unit_amount=unit_amount,
+                currency=CURRENCY,
+                **({"product": products[item_id]} if item_id in products else {"product_data": {"name": name}}),
+                idempotency_key=f"price-{mode}-{item_id}-{CURRENCY}-{unit_amount}",
+            )
+            await asyncio.to_thread(dbf.create_stripe_price, mode, item_id, CURRENCY, unit_amount, price.id, price.product)
+            return price.id
+
+        # Items are one per book (and shipping option), so prices created at once never share a product
+        new = [(item_id, name, unit_amount) for item_id, name, unit_amount in missing if (item_id, unit_amount) not in known]
+        for (item_id, _, unit_amount), price_id in zip(new, await asyncio.gather(*(create_price(*item) for item in new))):
+            known[item_id, unit_amount] = price_id
+
+        for item_id, _, unit_amount in missing:
+            price_ids[item_id, unit_amount] = known[item_id, unit_amount]
+            _price_ids.set((mode, CURRENCY, item_id, unit_amount), known[item_id, unit_amount])
+
+    return [price_ids[item_id, unit_amount] for item_id, _, unit_amount in items]
+
+
+async def checkout_line_items(stripe, mode: str, lines: Iterable[tuple[str, str, int, int]], shipping_option: str) -> list[dict]:
+    """ Returns line_items of a checkout session of (book_id, title, quantity, unit_amount) lines and shipping """
+    lines = list(lines)
+    items = [(book_id, title, unit_amount) for book_id, title, _, unit_amount in lines]
+    items.append((f"shipping:{shipping_option}", shipping_option, SHIPPING_FEES[shipping_option]))
+    quantities = [quantity for _, _, quantity, _ in lines] + [1]
+    return [dict(price=price_id, quantity=quantity)
+            for price_id, quantity in zip(await get_price_ids(stripe, mode, items), quantities)]
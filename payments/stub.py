@@ -0,0 +1,109 @@
+"""
+Stripe Stub
+-----------
+
+Stands in for the stripe library when testing checkouts locally (STRIPE_STUB=1)
+
+Usage:
+    stub = STRIPE_STUB
+    session = await stub.checkout.Session.create_async(..., idempotency_key="checkout-...")
+    payload, signature = stub.complete(session.id, secret)  # Signed checkout.session.completed
+    client.post("/api/stripe/webhook", data=payload, headers={"Stripe-Signature": signature})
+
+Sessions and prices are kept in memory, creating one again with the same
+idempotency key returns the first one (like Stripe does for 24 hours).
+The session url is its success_url, as if the payment went through at once.
+"""
+import json
+import time
+import uuid
+from threading import Lock
+from types import SimpleNamespace
+from .webhook import sign_webhook
+
+__all__ = ["StubStripe", "STRIPE_STUB"]
+
+
+class _Sessions:
+    """ stripe.checkout.Session """
+
+    def __init__(self, stub: "StubStripe") -> None:
+        self._stub = stub
+
+    def create(self, idempotency_key: str=None, api_key: str=None, **params) -> SimpleNamespace:
+        with self._stub.lock:
+            if idempotency_key in self._stub.idempotent:
+                return self._stub.idempotent[idempotency_key]
+
+            session_id = f"cs_test_{uuid.uuid4().hex}"
+            session = SimpleNamespace(id=session_id, url=params["success_url"], object="checkout.session",
+                                      payment_status="unpaid", params=params)
+            self._stub.sessions[session_id] = session
+            self._stub.created += 1
+            if idempotency_key is not None:
+                self._stub.idempotent[idempotency_key] = session
+            return session
+
+    async def create_async(self, **params) -> SimpleNamespace:
+        return self.create(**params)
+
+
+class _Prices:
+    """ stripe.Price """
+
+    def __init__(self, stub: "StubStripe") -> None:
+        self._stub = stub
+
+    def create(self, idempotency_key: str=None, api_key: str=None, **params) -> SimpleNamespace:
+        with self._stub.lock:
+            if idempotency_key in self._stub.idempotent:
+                return self._stub.idempotent[idempotency_key]
+
+            # A product is created with the price unless an existing one is given
+            product = params.get("product") or f"prod_{uuid.uuid4().hex[:14]}"
+            price = SimpleNamespace(id=f"price_{uuid.uuid4().hex[:24]}", object="price", product=product, params=params)
+            self._stub.prices[price.id] = price
+            if idempotency_key is not None:
+                self._stub.idempotent[idempotency_key] = price
+            return price
+
+    async def create_async(self, **params) -> SimpleNamespace:
+        return self.create(**params)
+
+
+class StubStripe:
+    """ Records checkout sessions and signs their webhook events """
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.sessions: dict[str, SimpleNamespace] = {}
+        self.prices: dict[str, SimpleNamespace] = {}
+        self.idempotent: dict[str, SimpleNamespace] = {}
+        self.created = 0  # Sessions created (not counting idempotent retries)
+        self.checkout = SimpleNamespace(Session=_Sessions(self))
+        self.Price = _Prices(self)
+
+    def event(self, event_type: str, session_id: str, payment_status: str="paid") -> dict:
+        """ Returns a webhook event of a session """
+        session = self.sessions[session_id]
+        obj = dict(id=session.id, object=session.object, payment_status=payment_status,
+                   client_reference_id=session.params.get("client_reference_id"),
+                   metadata=session.params.get("metadata", {}))
+        return dict(id=f"evt_{uuid.uuid4().hex}", object="event", type=event_type,
+                    created=int(time.time()), data=dict(object=obj))
+
+    def signed(self, event: dict, secret: str) -> tuple[bytes, str]:
+        """ Returns (payload, Stripe-Signature header) of an event """
+        payload = json.dumps(event).encode()
+        return payload, sign_webhook(payload, secret)
+
+    def complete(self, session_id: str, secret: str) -> tuple[bytes, str]:
+        """ Returns a signed checkout.session.completed event of a paid session """
+        return self.signed(self.event("checkout.session.completed", session_id), secret)
+
+    def expire(self, session_id: str, secret: str) -> tuple[bytes, str]:
+        """ Returns a signed checkout.session.expired event """
+        return self.signed(self.event("checkout.session.expired", session_id, "unpaid"), secret)
+
+
+STRIPE_STUB = StubStripe()
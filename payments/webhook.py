@@ -0,0 +1,63 @@
+"""
+Stripe Webhooks
+---------------
+
+Verifies the Stripe-Signature header of webhook requests
+
+Usage:
+    event = verify_webhook(request.get_data(), request.headers["Stripe-Signature"], secret)
+
+Stripe signs "{timestamp}.{payload}" with HMAC-SHA256 using the endpoint's
+signing secret and sends "t={timestamp},v1={signature}" (more than one v1 while
+the secret is being rolled), old timestamps are rejected to stop replays.
+"""
+import hmac
+import json
+import time
+from hashlib import sha256
+
+__all__ = ["WebhookSignatureError", "verify_webhook", "sign_webhook", "TOLERANCE"]
+
+TOLERANCE = 300  # Max age (seconds) of a signed payload
+
+
+class WebhookSignatureError(ValueError):
+    """ Raised when a webhook payload is not signed with the endpoint's secret """
+
+
+def _signature(payload: bytes, timestamp: int, secret: str) -> str:
+    return hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, sha256).hexdigest()
+
+
+def sign_webhook(payload: bytes, secret: str, timestamp: int=None) -> str:
+    """ Returns the Stripe-Signature header of payload (as sent by Stripe) """
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f"t={timestamp},v1={_signature(payload, timestamp, secret)}"
+
+
+def verify_webhook(payload: bytes, header: str, secret: str, tolerance: int=TOLERANCE) -> dict:
+    """ Returns the event of a signed payload, raises WebhookSignatureError otherwise """
+    if not secret:
+        raise WebhookSignatureError("No webhook secret configured")
+
+    timestamp, signatures = None, []
+    for item in (header or "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t" and value.isascii() and value.isdigit():
+            timestamp = int(value)
+        elif key == "v1":
+            signatures.append(value)
+    if timestamp is None or not signatures:
+        raise WebhookSignatureError("Malformed Stripe-Signature header")
+
+    # Compared as bytes, the header is untrusted and compare_digest rejects non-ASCII str
+    expected = _signature(payload, timestamp, secret).encode()
+    if not any(hmac.compare_digest(expected, signature.encode()) for signature in signatures):
+        raise WebhookSignatureError("Signature does not match payload")
+    if abs(time.time() - timestamp) > tolerance:
+        raise WebhookSignatureError("Timestamp outside the tolerance")
+
+    try:
+        return json.loads(payload)
+    except ValueError:
+        raise WebhookSignatureError("Payload is not json")
@@ -0,0 +1,121 @@
+"""
+Payment Worker
+--------------
+
+Processes received Stripe webhook events in a background thread
+
+Usage:
+    payment_worker = PaymentWorker()
+    dbf.save_stripe_event(...)  # In the webhook view, which returns at once
+    payment_worker.notify()
+
+    python -m payments.worker  # Processes events left unprocessed (e.g. by a worker that was stopped)
+
+Events are stored before the webhook is answered, so none are lost if a worker
+dies before processing them: every thread also polls for unprocessed events.
+Handlers are idempotent (orders are only created from pending payments), so an
+event delivered twice or processed by two workers at once only counts once.
+"""
+import json
+import logging
+import os
+import threading
+import db_fetch as dbf
+
+__all__ = ["PaymentWorker", "process_events", "POLL_INTERVAL"]
+
+POLL_INTERVAL = 30  # Seconds between checks for events left unprocessed
+
+logger = logging.getLogger(__name__)
+
+
+def _session_id(event: dict) -> str:
+    return event["data"]["object"]["id"]
+
+
+def _completed(event: dict) -> None:
+    # Delayed payment methods complete the session before the money arrives
+    if event["data"]["object"].get("payment_status") == "paid":
+        _paid(event)
+
+
+def _paid(event: dict) -> None:
+    order_id = dbf.finalise_payment(_session_id(event))
+    if order_id is not None:
+        logger.info(f"Order {order_id} paid")
+
+
+def _expired(event: dict) -> None:
+    dbf.expire_payment(_session_id(event))
+
+
+# Event type: handler (other events are marked processed and ignored)
+HANDLERS = {
+    "checkout.session.completed": _completed,
+    "checkout.session.async_payment_succeeded": _paid,
+    "checkout.session.expired": _expired,
+}
+
+
+def process_events(limit: int=100) -> int:
+    """ Processes unprocessed events (oldest first), returns number processed """
+    processed = 0
+    for event_id, event_type, payload in dbf.retrieve_unprocessed_stripe_events(limit):
+        handler = HANDLERS.get(event_type)
+        try:
+            if handler is not None:
+                handler(json.loads(payload))
+        except Exception:
+            logger.exception(f"Could not process Stripe event {event_id} ({event_type})")
+            dbf.mark_stripe_event_failed(event_id)
+            continue
+        dbf.mark_stripe_event_processed(event_id)
+        processed += 1
+    return processed
+
+
+class PaymentWorker:
+    """ Daemon thread processing events when notified (and every POLL_INTERVAL seconds) """
+
+    def __init__(self, interval: float=POLL_INTERVAL) -> None:
+        self.interval = interval
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def notify(self) -> None:
+        """ Wakes the thread (starting it in this process if needed) """
+        with self._lock:
+            # Threads do not survive a fork
+            if self._pid != os.getpid() or self._thread is None:
+                self._pid = os.getpid()
+                self._wake = threading.Event()
+                self._thread = threading.Thread(target=self._run, name="payment-worker", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                process_events()
+            except Exception:
+                logger.exception("Payment worker failed")  # Database busy or gone, try again later
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    dbf.upgrade_schema()
+    total = 0
+    while True:
+        processed = process_events()
+        if not processed:
+            break
+        total += processed
+    print(f"{total} Stripe events processed")
+
+
+if __name__ == "__main__":
+    main()
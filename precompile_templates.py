@@ -0,0 +1,44 @@
+"""
+Precompile Templates
+--------------------
+
+Fills the template bytecode cache (TEMPLATE_CACHE_DIR), so workers started
+after a deploy load compiled templates instead of compiling them
+
+Usage:
+    python precompile_templates.py [--clear]
+
+Run after the new templates are in place and before the workers are restarted,
+--clear first removes compiled templates of the previous deploy.
+Templates that could not be compiled are listed (they fail when rendered too).
+"""
+import argparse
+import importlib.util
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compiles all templates into the bytecode cache")
+    parser.add_argument("--clear", action="store_true", help="remove previously compiled templates first")
+    args = parser.parse_args()
+
+    # The app lives in __init__.py, which cannot be imported by name
+    spec = importlib.util.spec_from_file_location("app", "__init__.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    app = module.create_app()
+
+    bytecode_cache = app.jinja_env.bytecode_cache
+    if bytecode_cache is None:
+        print("TEMPLATE_CACHE_DIR is not set, nothing to do")
+        return
+    if args.clear:
+        bytecode_cache.clear()
+
+    compiled, errors = module.precompile_templates(app.jinja_env)
+    for name, error in errors.items():
+        print(f"\033[0;31m{name}: {error}\033[0m")
+    print(f"{compiled} templates compiled into {app.config['TEMPLATE_CACHE_DIR']}")
+
+
+if __name__ == "__main__":
+    main()
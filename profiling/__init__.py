@@ -0,0 +1,2 @@
+# File to allow imports
+from .sampler import *
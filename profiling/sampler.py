@@ -0,0 +1,194 @@
+"""
+Sampling Profiler
+-----------------
+
+Samples stacks of threads handling profiled requests and aggregates them by endpoint
+
+Usage:
+    profiler = SamplingProfiler()
+    profiler.start("books")  # In the thread handling the request
+    ...
+    profiler.stop()
+    profiler.collapsed("books")  # Collapsed stacks (flamegraph.pl, speedscope, ...)
+    profiler.speedscope("books")  # speedscope.app json
+
+A daemon thread reads sys._current_frames() every `interval` seconds, but only
+while at least one thread is being profiled, so idle workers pay nothing.
+Every worker writes its samples to its own file in PROFILES_DIR (at most every
+FLUSH_INTERVAL seconds), collapsed() and speedscope() add up all the files.
+clear() leaves a marker file, so other workers drop their samples on their next flush.
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import lru_cache
+
+__all__ = ["SamplingProfiler", "PROFILES_DIR"]
+
+PROFILES_DIR = os.environ.get("PROFILES_DIR", "cache/profiles")
+DEFAULT_INTERVAL = 0.005  # Seconds between samples
+FLUSH_INTERVAL = 5  # Seconds between writes of a worker's samples
+MAX_DEPTH = 128  # Deeper stacks are cut at the root
+_CLEARED = "cleared"  # Marker file touched by clear()
+
+
+@lru_cache(maxsize=4096)
+def _frame_name(code) -> str:
+    """ Returns name of code's frames in a collapsed stack (no semicolons allowed) """
+    filename = os.path.relpath(code.co_filename) if code.co_filename.startswith(os.getcwd()) else code.co_filename
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ":")
+
+
+class SamplingProfiler:
+    """ Samples stacks of profiled threads, counted by endpoint and collapsed stack """
+
+    def __init__(self, interval: float=DEFAULT_INTERVAL, directory: str=PROFILES_DIR) -> None:
+        self.interval = interval
+        self.directory = directory
+        self._profiled: dict[int, str] = {}  # Thread id: endpoint
+        self._samples: dict[str, Counter] = {}  # Endpoint: {collapsed stack: samples}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._file = None
+        self._flushed = 0.0
+        self._reset = time.time()  # When samples were last dropped
+
+    def start(self, endpoint: str) -> None:
+        """ Starts sampling the current thread under endpoint """
+        with self._lock:
+            # Threads do not survive a fork, nor do samples belong to the child
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._file = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+                self._samples = {}
+                self._reset = time.time()
+                self._thread = None
+
+            self._profiled[threading.get_ident()] = endpoint
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+            self._active.set()
+
+    def stop(self) -> None:
+        """ Stops sampling the current thread """
+        with self._lock:
+            self._profiled.pop(threading.get_ident(), None)
+            if not self._profiled:
+                self._active.clear()
+
+    def _run(self) -> None:
+        while True:
+            self._active.wait()
+            self._sample()
+            time.sleep(self.interval)
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, endpoint in self._profiled.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                if stack:
+                    stack.reverse()
+                    self._samples.setdefault(endpoint, Counter())[";".join(stack)] += 1
+
+    def flush(self, force: bool=False) -> None:
+        """ Writes this worker's samples to its file (at most every FLUSH_INTERVAL seconds unless forced) """
+        now = time.monotonic()
+        if self._pid != os.getpid() or not force and now - self._flushed < FLUSH_INTERVAL:
+            return
+
+        marker = os.path.join(self.directory, _CLEARED)
+        cleared = os.path.getmtime(marker) if os.path.exists(marker) else 0
+
+        with self._lock:
+            # Samples were cleared by another worker
+            if cleared > self._reset:
+                self._samples = {}
+                self._reset = cleared
+
+            self._flushed = now
+            data = {endpoint: dict(stacks) for endpoint, stacks in self._samples.items()}
+            path = self._file
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(data, file)
+        os.replace(f"{path}.tmp", path)
+
+    def collect(self) -> dict[str, Counter]:
+        """ Returns samples of all workers by endpoint """
+        self.flush(force=True)
+        totals: dict[str, Counter] = {}
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except FileNotFoundError:
+            names = []
+
+        for name in names:
+            try:
+                with open(os.path.join(self.directory, name)) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue  # Removed (or being cleared) while reading
+            for endpoint, stacks in data.items():
+                totals.setdefault(endpoint, Counter()).update(stacks)
+        return totals
+
+    def summary(self) -> dict[str, int]:
+        """ Returns number of samples of each endpoint """
+        return {endpoint: sum(stacks.values()) for endpoint, stacks in sorted(self.collect().items())}
+
+    def collapsed(self, endpoint: str) -> str:
+        """ Returns samples of endpoint as collapsed stacks ("frame;frame;frame count" lines) """
+        stacks = self.collect().get(endpoint, Counter())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+    def speedscope(self, endpoint: str) -> dict:
+        """ Returns samples of endpoint in the speedscope file format """
+        stacks = self.collect().get(endpoint, Counter())
+        frames, indexes = [], {}
+        samples, weights = [], []
+        for stack, count in sorted(stacks.items()):
+            sample = []
+            for name in stack.split(";"):
+                if name not in indexes:
+                    indexes[name] = len(frames)
+                    frames.append(dict(name=name))
+                sample.append(indexes[name])
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": dict(frames=frames),
+            "profiles": [dict(type="sampled", name=endpoint, unit="seconds", startValue=0,
+                              endValue=sum(weights), samples=samples, weights=weights)],
+            "name": endpoint,
+            "exporter": "bras-basah-books",
+        }
+
+    def clear(self) -> None:
+        """ Removes samples of all workers """
+        with self._lock:
+            self._samples = {}
+            self._reset = time.time()
+
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
+        marker = os.path.join(self.directory, _CLEARED)
+        with open(marker, "w"):
+            pass
+        self._reset = os.path.getmtime(marker)
@@ -0,0 +1,24 @@
+"""
+Reconcile Dashboard Counters
+----------------------------
+
+Recounts the tables behind the Counters table and fixes any drift
+
+Usage:
+    python reconcile_counters.py
+
+Counters are kept up to date by triggers, so this is only needed
+after the database was edited with the triggers missing or disabled.
+"""
+import db_fetch as dbf
+
+
+def main() -> None:
+    dbf.upgrade_schema()
+    for name, value in dbf.reconcile_counters().items():
+        print(f"{name}: {value}")
+    print("\033[0;31mCounters reconciled!\033[0m")
+
+
+if __name__ == "__main__":
+    main()
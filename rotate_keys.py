@@ -0,0 +1,58 @@
+"""
+Rotate Email Encryption Keys
+----------------------------
+
+Re-encrypts the Users.email column with the newest Fernet key
+
+Usage:
+    FERNET_KEYS="new_key,old_key" python rotate_keys.py [--chunk-size 500]
+
+Rows are processed in small chunks (each in its own short transaction),
+so the table is never locked for long and the app can keep running.
+Emails changed by the app while a chunk is re-encrypted are skipped rather
+than overwritten with the old address (the app encrypts with the newest key).
+Remove the old key from FERNET_KEYS once the script is done.
+"""
+import argparse
+import time
+from encrypt import crypto
+import db_fetch as dbf
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+def rotate_emails(chunk_size: int=DEFAULT_CHUNK_SIZE, pause: float=0) -> tuple[int, int]:
+    """ Re-encrypts all emails chunk by chunk, returns (rows updated, rows skipped as changed since read) """
+    last_user_id = ""
+    updated = skipped = 0
+    while True:
+        # Keyset paging, so each chunk is an index range scan
+        rows = dbf.retrieve_user_emails_after(last_user_id, chunk_size)
+        if not rows:
+            return updated, skipped
+
+        # Only updated if the email is still the one read
+        count = dbf.update_user_emails((crypto.rotate(email), user_id, email) for user_id, email in rows)
+        updated += count
+        skipped += len(rows) - count
+        last_user_id = rows[-1][0]
+
+        # Give other writers a chance to take the database lock
+        if pause:
+            time.sleep(pause)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Re-encrypts Users.email with the newest Fernet key")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between chunks")
+    args = parser.parse_args()
+
+    updated, skipped = rotate_emails(args.chunk_size, args.pause)
+    print(f"\033[0;31mRe-encrypted {updated} emails!\033[0m")
+    if skipped:
+        print(f"Skipped {skipped} emails changed while rotating")
+
+
+if __name__ == "__main__":
+    main()
@@ -124,3 +124,156 @@ CREATE TABLE Reviews (
     FOREIGN KEY (book_id) REFERENCES Books(book_id),
     FOREIGN KEY (user_id) REFERENCES Users(user_id)
 );
+
+CREATE TABLE DataKeys (
+    key_id TEXT NOT NULL,
+    wrapped_key BLOB NOT NULL,
+    master_key_id TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (key_id)
+);
+
+CREATE INDEX idx_users_role ON Users (role, user_id);
+CREATE INDEX idx_customers_user_id ON Customers (user_id);
+CREATE INDEX idx_users_role_username ON Users (role, username);
+CREATE INDEX idx_books_natural_key ON Books (title, author, language);
+CREATE UNIQUE INDEX idx_cart_items_user_book ON CartItems (user_id, book_id);
+
+CREATE TABLE Counters (
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (name)
+);
+
+INSERT INTO Counters (name, value) VALUES
+    ('customers', 0), ('orders', 0), ('books', 0), ('staff', 0), ('reviews', 0);
+
+CREATE TRIGGER trg_customers_insert AFTER INSERT ON Customers
+BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'customers'; END;
+CREATE TRIGGER trg_customers_delete AFTER DELETE ON Customers
+BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'customers'; END;
+CREATE TRIGGER trg_orders_insert AFTER INSERT ON OrderDetails
+BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'orders'; END;
+CREATE TRIGGER trg_orders_delete AFTER DELETE ON OrderDetails
+BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'orders'; END;
+CREATE TRIGGER trg_books_insert AFTER INSERT ON Books
+BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'books'; END;
+CREATE TRIGGER trg_books_delete AFTER DELETE ON Books
+BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'books'; END;
+CREATE TRIGGER trg_reviews_insert AFTER INSERT ON Reviews
+BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'reviews'; END;
+CREATE TRIGGER trg_reviews_delete AFTER DELETE ON Reviews
+BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'reviews'; END;
+CREATE TRIGGER trg_staff_insert AFTER INSERT ON Users WHEN NEW.role = 'staff'
+BEGIN UPDATE Counters SET value = value + 1 WHERE name = 'staff'; END;
+CREATE TRIGGER trg_staff_delete AFTER DELETE ON Users WHEN OLD.role = 'staff'
+BEGIN UPDATE Counters SET value = value - 1 WHERE name = 'staff'; END;
+CREATE TRIGGER trg_staff_update AFTER UPDATE OF role ON Users WHEN OLD.role IS NOT NEW.role
+BEGIN UPDATE Counters SET value = value + (NEW.role = 'staff') - (OLD.role = 'staff') WHERE name = 'staff'; END;
+
+CREATE TABLE SalesDaily (
+    day TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    language TEXT NOT NULL,
+    units INTEGER NOT NULL,
+    revenue INTEGER NOT NULL,
+    PRIMARY KEY (day, book_id)
+);
+
+CREATE TABLE OrderStatusDaily (
+    day TEXT NOT NULL,
+    status TEXT NOT NULL,
+    orders INTEGER NOT NULL,
+    PRIMARY KEY (day, status)
+);
+
+CREATE TABLE SalesDirtyDays (
+    day TEXT NOT NULL,
+    PRIMARY KEY (day)
+);
+
+CREATE INDEX idx_order_details_day ON OrderDetails (date(order_date));
+CREATE INDEX idx_order_items_order_id ON OrderItems (order_id);
+
+CREATE TRIGGER trg_sales_order_insert AFTER INSERT ON OrderDetails
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(NEW.order_date)); END;
+CREATE TRIGGER trg_sales_order_update AFTER UPDATE OF order_date, order_pending ON OrderDetails
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(OLD.order_date)), (date(NEW.order_date)); END;
+CREATE TRIGGER trg_sales_order_delete AFTER DELETE ON OrderDetails
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day) VALUES (date(OLD.order_date)); END;
+CREATE TRIGGER trg_sales_item_insert AFTER INSERT ON OrderItems
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+      SELECT date(order_date) FROM OrderDetails WHERE order_id = NEW.order_id; END;
+CREATE TRIGGER trg_sales_item_update AFTER UPDATE ON OrderItems
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+      SELECT date(order_date) FROM OrderDetails WHERE order_id IN (OLD.order_id, NEW.order_id); END;
+CREATE TRIGGER trg_sales_item_delete AFTER DELETE ON OrderItems
+BEGIN INSERT OR IGNORE INTO SalesDirtyDays (day)
+      SELECT date(order_date) FROM OrderDetails WHERE order_id = OLD.order_id; END;
+
+CREATE TABLE Payments (
+    order_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    amount INTEGER NOT NULL,
+    currency TEXT NOT NULL,
+    shipping_option TEXT NOT NULL,
+    cart_hash TEXT NOT NULL,
+    session_id TEXT,
+    session_url TEXT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (order_id),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id)
+);
+
+CREATE UNIQUE INDEX idx_payments_session_id ON Payments (session_id);
+CREATE INDEX idx_payments_open ON Payments (user_id, cart_hash) WHERE status IN ('pending', 'failed');
+
+CREATE TABLE PaymentItems (
+    order_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    unit_amount INTEGER NOT NULL,
+    FOREIGN KEY (order_id) REFERENCES Payments(order_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+CREATE INDEX idx_payment_items_order_id ON PaymentItems (order_id);
+
+CREATE TABLE StripeEvents (
+    event_id TEXT NOT NULL,
+    type TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    received TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (event_id)
+);
+
+CREATE INDEX idx_stripe_events_unprocessed ON StripeEvents (received) WHERE processed IS NULL;
+
+CREATE TABLE StripePrices (
+    mode TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    currency TEXT NOT NULL,
+    unit_amount INTEGER NOT NULL,
+    price_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (mode, item_id, currency, unit_amount)
+);
+
+CREATE TABLE StockHolds (
+    user_id TEXT NOT NULL,
+    book_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    expires TIMESTAMP NOT NULL,
+    PRIMARY KEY (user_id, book_id),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+CREATE INDEX idx_stock_holds_book_id ON StockHolds (book_id, expires, quantity);
+
+CREATE INDEX idx_stock_holds_expires ON StockHolds (expires);
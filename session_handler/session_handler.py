@@ -13,7 +13,7 @@ logger.setLevel(logging.WARNING)
 _LOG_FILE = "log/monitor_deserialisation.log"
 _LOG_FORMAT = "%(asctime)s [%(levelname)s]: %(message)s"
 _DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
-_fh = logging.FileHandler(_LOG_FILE)
+_fh = logging.FileHandler(_LOG_FILE, delay=True)  # Opened on first log
 _fh.setLevel(logging.WARNING)
 _fh.setFormatter(logging.Formatter(_LOG_FORMAT, _DATE_FORMAT))
 
@@ -0,0 +1,78 @@
+"""
+Envelope Encryption Tests
+-------------------------
+
+Usage:
+    python -m unittest tests.test_envelope
+
+KMS is replaced by a stub, data keys are stored in a copy of database.db.
+"""
+import base64
+import os
+import shutil
+import tempfile
+import unittest
+
+# db_fetch reads DATABASE_PATH on import, so data keys are stored in a copy of the database
+_tmp = tempfile.mkdtemp()
+shutil.copyfile("database.db", os.path.join(_tmp, "database.db"))
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "database.db")
+
+import SecurityFunctions
+from envelope_encryption import EnvelopeCipher, KMSKeyProvider, LocalKeyProvider, is_envelope
+
+
+class _StubKMS:
+    """ Stands in for the KMS client, ciphertext blobs start with 0x01 like real ones """
+
+    def __init__(self) -> None:
+        self.blobs = {}
+
+    def encrypt(self, KeyId: str, Plaintext: bytes) -> dict:
+        blob = b"\x01\x02\x02\x00x" + os.urandom(180)
+        self.blobs[blob] = Plaintext
+        return dict(CiphertextBlob=blob)
+
+    def decrypt(self, CiphertextBlob: bytes) -> dict:
+        return dict(Plaintext=self.blobs[CiphertextBlob])
+
+    def generate_data_key(self, KeyId: str, KeySpec: str) -> dict:
+        data_key = os.urandom(32)
+        return dict(Plaintext=data_key, CiphertextBlob=self.encrypt(KeyId, data_key)["CiphertextBlob"])
+
+
+class EnvelopeTest(unittest.TestCase):
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        shutil.rmtree(_tmp, ignore_errors=True)
+
+    def setUp(self) -> None:
+        self.kms = _StubKMS()
+        SecurityFunctions._envelope_cipher = EnvelopeCipher(KMSKeyProvider("key", client=self.kms))
+
+    def test_round_trip(self) -> None:
+        ciphertext = SecurityFunctions.AWS_encrypt("secret")
+        self.assertTrue(is_envelope(ciphertext))
+        self.assertEqual(SecurityFunctions.AWS_decrypt(ciphertext), "secret")
+
+    def test_legacy_kms_blob(self) -> None:
+        # Stored by AWS_encrypt before envelope encryption, base64 of the KMS CiphertextBlob (AQICAH...)
+        legacy = base64.b64encode(self.kms.encrypt("key", "legacy secret".encode())["CiphertextBlob"])
+        self.assertFalse(is_envelope(legacy))
+        self.assertEqual(SecurityFunctions.AWS_decrypt(legacy), "legacy secret")
+        self.assertEqual(SecurityFunctions.AWS_decrypt(legacy.decode()), "legacy secret")
+
+    def test_decrypt_many_mixed(self) -> None:
+        legacy = base64.b64encode(self.kms.encrypt("key", b"old")["CiphertextBlob"])
+        values = SecurityFunctions.AWS_encrypt_many(["a", "b"])
+        self.assertEqual(SecurityFunctions.AWS_decrypt_many([values[0], legacy, values[1]]), ["a", "old", "b"])
+
+    def test_legacy_needs_kms(self) -> None:
+        SecurityFunctions._envelope_cipher = EnvelopeCipher(LocalKeyProvider(os.path.join(_tmp, "master.key")))
+        with self.assertRaises(ValueError):
+            SecurityFunctions.AWS_decrypt(base64.b64encode(b"\x01\x02\x02\x00x" + os.urandom(180)))
+
+
+if __name__ == "__main__":
+    unittest.main()